@@ -16,7 +16,12 @@ from rich.console import Console
 from elia_chat.app import Elia
 from elia_chat.config import LaunchConfig
 from elia_chat.database.import_chatgpt import import_chatgpt_data
-from elia_chat.database.database import create_database, sqlite_file_name
+from elia_chat.database.database import (
+    configure_database,
+    create_database,
+    sqlite_file_name,
+    upgrade_database,
+)
 from elia_chat.locations import config_file
 
 console = Console()
@@ -25,6 +30,10 @@ def create_db_if_not_exists() -> None:
     if not sqlite_file_name.exists():
         click.echo(f"Creating database at {sqlite_file_name!r}")
         asyncio.run(create_database())
+    else:
+        migrated_to = asyncio.run(upgrade_database())
+        if migrated_to:
+            click.echo(f"Upgraded database to schema version {migrated_to[-1]}")
 
 def load_or_create_config_file() -> dict[str, Any]:
     config = config_file()
@@ -40,6 +49,10 @@ def load_or_create_config_file() -> dict[str, Any]:
 
     return file_config
 
+def configure_database_from_config_file() -> None:
+    """Configure the database connections using the config file."""
+    configure_database(LaunchConfig(**load_or_create_config_file()).database)
+
 @click.group(cls=DefaultGroup, default="default", default_if_no_args=True)
 def cli() -> None:
     """Interact with large language models using your terminal."""
@@ -63,14 +76,15 @@ def cli() -> None:
 def default(prompt: tuple[str, ...], model: str, inline: bool) -> None:
     prompt = prompt or ("",)
     joined_prompt = " ".join(prompt)
-    create_db_if_not_exists()
     file_config = load_or_create_config_file()
     cli_config = {}
     if model:
         cli_config["default_model"] = model
 
-    launch_config: dict[str, Any] = {**file_config, **cli_config}
-    app = Elia(LaunchConfig(**launch_config), startup_prompt=joined_prompt)
+    launch_config = LaunchConfig(**{**file_config, **cli_config})
+    configure_database(launch_config.database)
+    create_db_if_not_exists()
+    app = Elia(launch_config, startup_prompt=joined_prompt)
     app.run(inline=inline)
 
 @cli.command()
@@ -101,6 +115,12 @@ You may wish to create a backup of \
     )
     if click.confirm("Delete all chats?", abort=True):
         sqlite_file_name.unlink(missing_ok=True)
+        # A leftover journal would be applied to (and corrupt) the new database.
+        for suffix in ("-wal", "-shm", "-journal"):
+            sqlite_file_name.with_name(sqlite_file_name.name + suffix).unlink(
+                missing_ok=True
+            )
+        configure_database_from_config_file()
         asyncio.run(create_database())
         console.print(f"♻️  Database reset @ {sqlite_file_name}")
 
@@ -118,6 +138,8 @@ def import_file_to_db(file: pathlib.Path) -> None:
     This command will import the ChatGPT conversations from a local
     JSON file into the database.
     """
+    configure_database_from_config_file()
+    create_db_if_not_exists()
     asyncio.run(import_chatgpt_data(file=file))
     console.print(f"[green]ChatGPT data imported from {str(file)!r}")
 
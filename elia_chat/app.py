@@ -1,15 +1,18 @@
 from __future__ import annotations
 
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import TYPE_CHECKING
 
+from textual import log
 from textual.app import App
 from textual.binding import Binding
 from textual.reactive import Reactive, reactive
 from textual.signal import Signal
 
-from elia_chat.chats_manager import ChatsManager
+from elia_chat import constants
+from elia_chat.chats_manager import ChatEvent, ChatsManager, ChatWrite
 from elia_chat.models import ChatData, ChatMessage
 from elia_chat.config import EliaChatModel, LaunchConfig
 from elia_chat.runtime_config import RuntimeConfig
@@ -17,6 +20,8 @@ from elia_chat.screens.chat_screen import ChatScreen
 from elia_chat.screens.help_screen import HelpScreen
 from elia_chat.screens.home_screen import HomeScreen
 from elia_chat.themes import BUILTIN_THEMES, Theme, load_user_themes
+from elia_chat.widgets.render_cache import RenderCache
+from elia_chat.write_queue import WriteQueue
 
 if TYPE_CHECKING:
     from litellm.types.completion import (
@@ -51,6 +56,27 @@ class Elia(App[None]):
         """Widgets can subscribe to this signal to be notified of
         when the user has changed configuration at runtime (e.g. using the UI)."""
 
+        self.chat_event_signal = Signal[ChatEvent](self, "chat-event")
+        """Published by the ChatsManager whenever a chat is created, updated, or
+        archived, so widgets can update incrementally rather than reloading."""
+
+        self.render_cache = RenderCache(constants.RENDER_CACHE_SIZE)
+        """Rendered message output, shared by every Chatbox. The hit and miss
+        counts are logged when the app exits."""
+
+        self.render_pool = ThreadPoolExecutor(
+            constants.PRERENDER_THREADS, thread_name_prefix="elia-prerender"
+        )
+        """Renders messages into the render cache in the background, so that
+        opening a chat with large messages doesn't block the UI."""
+
+        self.write_queue = WriteQueue(
+            constants.WRITE_QUEUE_INTERVAL_SECS, on_error=self.report_write_error
+        )
+        """Commits changes to the chat history in the background, so the UI
+        doesn't wait for the disk. Flushed when a chat is closed, and when the
+        app exits."""
+
         self.startup_prompt = startup_prompt
         """Elia can be launched with a prompt on startup via a command line option.
 
@@ -72,6 +98,7 @@ class Elia(App[None]):
         self.runtime_config_signal.publish(self.runtime_config)
 
     async def on_mount(self) -> None:
+        self.write_queue.start()
         await self.push_screen(HomeScreen(self.runtime_config_signal))
         self.theme = self.launch_config.theme
         if self.startup_prompt:
@@ -80,6 +107,19 @@ class Elia(App[None]):
                 model=self.runtime_config.selected_model,
             )
 
+    async def on_unmount(self) -> None:
+        log.debug(f"Render cache stats: {self.render_cache!r}")
+        self.render_pool.shutdown(wait=False, cancel_futures=True)
+        await self.write_queue.close()
+
+    def report_write_error(self, write: ChatWrite, error: Exception) -> None:
+        self.notify(
+            f"{write.describe()}\n{error}",
+            title="Couldn't save changes",
+            severity="error",
+            timeout=constants.ERROR_NOTIFY_TIMEOUT_SECS,
+        )
+
     async def launch_chat(self, prompt: str, model: EliaChatModel) -> None:
         current_time = datetime.datetime.now(datetime.timezone.utc)
         system_message: ChatCompletionSystemMessageParam = {
@@ -130,6 +170,8 @@ class Elia(App[None]):
         return {**super().get_css_variables(), **color_system}
 
     def watch_theme(self, theme: str | None) -> None:
+        # Output rendered for the previous theme won't be used again.
+        self.render_cache.clear()
         self.refresh_css(animate=False)
         self.screen._update_styles()
 
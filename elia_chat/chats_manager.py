@@ -1,36 +1,514 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
 import datetime
+from typing import TYPE_CHECKING, Any, Callable, Sequence, cast
 
-from sqlmodel import select
+from sqlalchemy import delete, desc, func, update
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from textual import log
+from textual._context import active_app
 
 from elia_chat.database.converters import (
     chat_dao_to_chat_data,
+    chat_dao_to_chat_summary,
     chat_message_to_message_dao,
+    chat_summary_row_to_chat_summary,
     message_dao_to_chat_message,
+    search_row_to_search_result,
 )
 from elia_chat.database.database import get_session
-from elia_chat.database.models import ChatDao, MessageDao
-from elia_chat.models import ChatData, ChatMessage
+from elia_chat.database.models import CHAT_PREVIEW_LENGTH, ChatDao, MessageDao
+from elia_chat.models import (
+    ChatData,
+    ChatMessage,
+    ChatSummary,
+    SearchResult,
+    get_model,
+)
+
+if TYPE_CHECKING:
+    from elia_chat.app import Elia
+
+
+@dataclass
+class ChatCreated:
+    """A new chat was created."""
+
+    chat: ChatSummary
+
+
+@dataclass
+class MessageAppended:
+    """A message was added to a chat, so it's now the most recently active."""
+
+    chat: ChatSummary
+
+
+@dataclass
+class ChatRenamed:
+    chat_id: int
+    title: str
+
+
+@dataclass
+class ChatsArchived:
+    """Chats were archived, or unarchived if `archived` is False."""
+
+    chat_ids: tuple[int, ...]
+    archived: bool = True
+    changed_count: int = 0
+    """The number of the chats which weren't already (un)archived."""
+
+
+@dataclass
+class ChatsDeleted:
+    chat_ids: tuple[int, ...]
+    unarchived_count: int = 0
+    """The number of the deleted chats which weren't archived."""
+
+
+# Describes a change made to the chat history via the ChatsManager.
+ChatEvent = (
+    ChatCreated | MessageAppended | ChatRenamed | ChatsArchived | ChatsDeleted
+)
+
+
+def publish_chat_event(event: ChatEvent | Callable[[], ChatEvent]) -> None:
+    """Publish a change to the chat history to the running app (if any),
+    so that widgets can update themselves without reloading.
+
+    Args:
+        event: The event, or a function which creates it. Creating a
+            ChatSummary looks up its model in the app's config, so events
+            containing one must be created by a function, which is only
+            called if an app is running.
+    """
+    try:
+        app = cast("Elia", active_app.get())
+    except LookupError:
+        # No app is running (e.g. we're importing from the command line).
+        return
+    if callable(event):
+        event = event()
+    app.chat_event_signal.publish(event)
+
+
+class ChatWrite(ABC):
+    """A change to the chat history.
+
+    Writes can be applied in a transaction of their own (via the methods of
+    ChatsManager), or grouped with other writes into a single transaction by
+    the app's WriteQueue. If the transaction fails, a write may be applied
+    again in another, so `apply` mustn't change the objects being written.
+    Those changes are made by `committed`.
+    """
+
+    @abstractmethod
+    async def apply(self, session: AsyncSession) -> None:
+        """Make the change in the session, without committing it."""
+
+    def committed(self) -> None:
+        """Called once the transaction containing the change is committed."""
+
+    @abstractmethod
+    def describe(self) -> str:
+        """A description of the change, for reporting that it failed."""
+
+
+@dataclass
+class AddMessage(ChatWrite):
+    """Add a message to the end of a chat."""
+
+    chat_id: int
+    message: ChatMessage
+    _snapshot: ChatMessage = field(init=False, repr=False)
+    """The message as it was when the write was created."""
+    _chat: ChatDao | None = field(default=None, init=False, repr=False)
+    _message_id: int | None = field(default=None, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        # The message may change before the write is applied (e.g. a response
+        # which is streaming in), and those changes are written separately.
+        self._snapshot = self.message.copy()
+
+    async def apply(self, session: AsyncSession) -> None:
+        # The message is inserted directly, without loading the chat's existing
+        # messages, so the cost doesn't depend on the length of the chat.
+        chat: ChatDao | None = await session.get(ChatDao, self.chat_id)
+        if not chat:
+            raise RuntimeError(f"Chat with ID {self.chat_id} not found.")
+        message_dao = chat_message_to_message_dao(self._snapshot, self.chat_id)
+        session.add(message_dao)
+        chat.record_message(message_dao)
+        # Assign the message an ID, so later writes in the batch can refer to it.
+        await session.flush()
+        assert message_dao.id is not None
+        _assigned_message_ids(session)[id(self.message)] = message_dao.id
+        self._message_id = message_dao.id
+        self._chat = chat
+
+    def committed(self) -> None:
+        assert self._chat is not None
+        self.message.id = self._message_id
+        chat = self._chat
+        publish_chat_event(lambda: MessageAppended(chat_dao_to_chat_summary(chat)))
+
+    def describe(self) -> str:
+        return f"Couldn't save a message in chat {self.chat_id}."
+
+
+@dataclass
+class UpdateMessage(ChatWrite):
+    """Append text to the content of a saved message, and/or replace its
+    metadata.
+
+    Only the appended text is sent to the database, so a response can be
+    saved incrementally as it streams in.
+    """
+
+    message: ChatMessage
+    appended: str = ""
+    meta: dict[str, Any] | None = None
+    """The new metadata of the message, or None to leave it unchanged."""
+
+    async def apply(self, session: AsyncSession) -> None:
+        message_id = _message_id(session, self.message)
+        if message_id is None:
+            # Saving the message failed, and that has already been reported.
+            log.warning(f"Not updating unsaved message: {self!r}")
+            return
+        values: dict[str, Any] = {}
+        if self.appended:
+            values["content"] = MessageDao.content + self.appended
+        if self.meta is not None:
+            values["meta"] = self.meta
+        if values:
+            statement = (
+                update(MessageDao)
+                .where(col(MessageDao.id) == message_id)
+                .values(values)
+            )
+            await session.exec(statement)
+
+    def describe(self) -> str:
+        return f"Couldn't save changes to message {self.message.id}."
+
+
+@dataclass
+class DeleteMessage(ChatWrite):
+    """Delete a saved message from the end of a chat."""
+
+    chat_id: int
+    message: ChatMessage
+
+    async def apply(self, session: AsyncSession) -> None:
+        message_id = _message_id(session, self.message)
+        if message_id is None:
+            return
+        result = await session.exec(
+            delete(MessageDao).where(col(MessageDao.id) == message_id)
+        )
+        if not result.rowcount:
+            return
+
+        # Recalculate the chat's denormalised metadata from the messages which
+        # remain (see `ChatDao.record_message`).
+        last_message_at = select(func.max(MessageDao.timestamp)).where(
+            MessageDao.chat_id == self.chat_id
+        )
+        preview = (
+            select(func.substr(MessageDao.content, 1, CHAT_PREVIEW_LENGTH))
+            .where(MessageDao.chat_id == self.chat_id)
+            .where(MessageDao.role == "user")
+            .order_by(col(MessageDao.id))
+            .limit(1)
+        )
+        await session.exec(
+            update(ChatDao)
+            .where(col(ChatDao.id) == self.chat_id)
+            .values(
+                message_count=ChatDao.message_count - 1,
+                last_message_at=last_message_at.scalar_subquery(),
+                preview=func.coalesce(preview.scalar_subquery(), ""),
+            )
+        )
+
+    def committed(self) -> None:
+        self.message.id = None
+
+    def describe(self) -> str:
+        return f"Couldn't delete a message from chat {self.chat_id}."
+
+
+@dataclass
+class RenameChat(ChatWrite):
+    chat_id: int
+    title: str
+
+    async def apply(self, session: AsyncSession) -> None:
+        statement = (
+            update(ChatDao)
+            .where(col(ChatDao.id) == self.chat_id)
+            .values(title=self.title)
+        )
+        result = await session.exec(statement)
+        if result.rowcount == 0:
+            raise RuntimeError(f"Chat with ID {self.chat_id} not found.")
+
+    def committed(self) -> None:
+        publish_chat_event(ChatRenamed(self.chat_id, self.title))
+
+    def describe(self) -> str:
+        return f"Couldn't rename chat {self.chat_id}."
+
+
+@dataclass
+class ArchiveChats(ChatWrite):
+    """Archive (or unarchive) any number of chats with a single statement.
+
+    No rows are loaded, so the cost doesn't depend on the size of the chats.
+    """
+
+    chat_ids: tuple[int, ...]
+    archived: bool = True
+    """False to unarchive the chats."""
+    _changed_count: int = field(default=0, init=False, repr=False)
+
+    async def apply(self, session: AsyncSession) -> None:
+        statement = (
+            update(ChatDao)
+            .where(col(ChatDao.id).in_(self.chat_ids))
+            .where(col(ChatDao.archived) != self.archived)
+            .values(archived=self.archived)
+        )
+        result = await session.exec(statement)
+        self._changed_count = result.rowcount
+
+    def committed(self) -> None:
+        publish_chat_event(
+            ChatsArchived(self.chat_ids, self.archived, self._changed_count)
+        )
+
+    def describe(self) -> str:
+        action = "archive" if self.archived else "unarchive"
+        return f"Couldn't {action} {_describe_chats(self.chat_ids)}."
+
+
+@dataclass
+class DeleteChats(ChatWrite):
+    """Permanently delete any number of chats and their messages, with a
+    statement for the messages and two for the chats."""
+
+    chat_ids: tuple[int, ...]
+    _unarchived_count: int = field(default=0, init=False, repr=False)
+
+    async def apply(self, session: AsyncSession) -> None:
+        await session.exec(
+            delete(MessageDao).where(col(MessageDao.chat_id).in_(self.chat_ids))
+        )
+        # The unarchived chats are deleted first, to count them.
+        result = await session.exec(
+            delete(ChatDao)
+            .where(col(ChatDao.id).in_(self.chat_ids))
+            .where(col(ChatDao.archived) == False)  # noqa: E712
+        )
+        self._unarchived_count = result.rowcount
+        await session.exec(delete(ChatDao).where(col(ChatDao.id).in_(self.chat_ids)))
+
+    def committed(self) -> None:
+        publish_chat_event(ChatsDeleted(self.chat_ids, self._unarchived_count))
+
+    def describe(self) -> str:
+        return f"Couldn't delete {_describe_chats(self.chat_ids)}."
+
+
+def _assigned_message_ids(session: AsyncSession) -> dict[int, int]:
+    """The IDs assigned to messages added in the session's transaction, by the
+    `id()` of the message. They're only set on the messages once it commits."""
+    return session.info.setdefault("assigned_message_ids", {})
+
+
+def _message_id(session: AsyncSession, message: ChatMessage) -> int | None:
+    """The ID of a message, which may have been added earlier in the session's
+    transaction, or None if it hasn't been saved."""
+    return _assigned_message_ids(session).get(id(message), message.id)
+
+
+def _describe_chats(chat_ids: Sequence[int]) -> str:
+    if len(chat_ids) == 1:
+        return f"chat {chat_ids[0]}"
+    return f"{len(chat_ids)} chats"
 
 
 @dataclass
 class ChatsManager:
     @staticmethod
-    async def all_chats() -> list[ChatData]:
-        chat_daos = await ChatDao.all()
-        return [chat_dao_to_chat_data(chat) for chat in chat_daos]
+    async def list_summaries(
+        limit: int | None = None, after: ChatSummary | None = None
+    ) -> list[ChatSummary]:
+        """Return summaries of unarchived chats, most recently active first.
+
+        Use `get_chat` to load the full chat (including messages) when required.
+
+        Args:
+            limit: The maximum number of summaries to return.
+            after: The last summary of the previous page, if paginating.
+        """
+        cursor = None
+        if after is not None and after.last_message_at is not None:
+            cursor = (after.last_message_at, after.id)
+        rows = await ChatDao.summaries(limit=limit, after=cursor)
+        return [chat_summary_row_to_chat_summary(row) for row in rows]
+
+    @staticmethod
+    async def count_chats() -> int:
+        """Return the number of unarchived chats."""
+        return await ChatDao.count()
 
     @staticmethod
     async def get_chat(chat_id: int) -> ChatData:
         chat_dao = await ChatDao.from_id(chat_id)
         return chat_dao_to_chat_data(chat_dao)
 
+    @staticmethod
+    async def get_chat_tail(chat_id: int, limit: int) -> ChatData:
+        """Return the chat with only its system prompt and its latest messages loaded.
+
+        Older messages can be loaded later using `get_messages_before`, so long
+        chats can be opened without loading every message.
+
+        Args:
+            chat_id: The ID of the chat.
+            limit: The maximum number of non-system messages to load.
+        """
+        async with get_session() as session:
+            chat: ChatDao | None = await session.get(ChatDao, chat_id)
+            if not chat:
+                raise RuntimeError(f"Chat with ID {chat_id} not found.")
+
+            system_statement = (
+                select(MessageDao)
+                .where(MessageDao.chat_id == chat_id)
+                .order_by(col(MessageDao.id))
+                .limit(1)
+            )
+            system_message = (await session.exec(system_statement)).first()
+            if system_message is None:
+                message_daos = []
+            else:
+                tail_statement = (
+                    select(MessageDao)
+                    .where(MessageDao.chat_id == chat_id)
+                    .where(col(MessageDao.id) > system_message.id)
+                    .order_by(desc(col(MessageDao.id)))
+                    .limit(limit)
+                )
+                tail = (await session.exec(tail_statement)).all()
+                message_daos = [system_message, *reversed(tail)]
+
+        model = get_model(chat.model)
+        messages = [
+            message_dao_to_chat_message(message_dao, model)
+            for message_dao in message_daos
+        ]
+        return ChatData(
+            id=chat.id,
+            title=chat.title,
+            model=model,
+            create_timestamp=chat.started_at if chat.started_at else None,
+            messages=messages,
+            older_message_count=max(0, chat.message_count - len(messages)),
+            preview=chat.preview,
+        )
+
+    @staticmethod
+    async def get_chat_tail_including(
+        chat_id: int, message_id: int, limit: int
+    ) -> ChatData:
+        """Like `get_chat_tail`, but loads enough messages to include the
+        given message, and up to `limit // 2` messages before it.
+
+        Args:
+            chat_id: The ID of the chat.
+            message_id: The ID of a message in the chat.
+            limit: The minimum number of non-system messages to load.
+        """
+        async with get_session() as session:
+            statement = (
+                select(func.count())
+                .select_from(MessageDao)
+                .where(MessageDao.chat_id == chat_id)
+                .where(col(MessageDao.id) >= message_id)
+            )
+            from_message = (await session.exec(statement)).one()
+        return await ChatsManager.get_chat_tail(
+            chat_id, max(limit, from_message + limit // 2)
+        )
+
+    @staticmethod
+    async def search(query: str, limit: int) -> list[SearchResult]:
+        """Search the titles of unarchived chats and the content of their messages.
+
+        Chats whose titles match come first, then matching messages, each most
+        relevant first.
+
+        Args:
+            query: The search, as typed by the user.
+            limit: The maximum number of results to return.
+        """
+        title_rows = await ChatDao.search_titles(query, limit)
+        message_rows = await MessageDao.search(query, limit - len(title_rows))
+        return [
+            search_row_to_search_result(row) for row in [*title_rows, *message_rows]
+        ]
+
+    @staticmethod
+    async def get_messages_before(
+        chat_id: int, message_id: int, limit: int | None = None
+    ) -> list[ChatMessage]:
+        """Return the non-system messages of a chat which precede a message.
+
+        Args:
+            chat_id: The ID of the chat.
+            message_id: Only messages with an ID lower than this are returned.
+            limit: The maximum number of messages to return. These will be the
+                messages immediately preceding `message_id`.
+
+        Returns:
+            The messages, oldest first.
+        """
+        async with get_session() as session:
+            chat: ChatDao | None = await session.get(ChatDao, chat_id)
+            if not chat:
+                raise RuntimeError(f"Chat with ID {chat_id} not found.")
+
+            system_message_id = (
+                select(func.min(col(MessageDao.id)))
+                .where(MessageDao.chat_id == chat_id)
+                .scalar_subquery()
+            )
+            statement = (
+                select(MessageDao)
+                .where(MessageDao.chat_id == chat_id)
+                .where(col(MessageDao.id) < message_id)
+                .where(col(MessageDao.id) > system_message_id)
+                .order_by(desc(col(MessageDao.id)))
+                .limit(limit)
+            )
+            message_daos = (await session.exec(statement)).all()
+
+        model = get_model(chat.model)
+        return [
+            message_dao_to_chat_message(message_dao, model)
+            for message_dao in reversed(message_daos)
+        ]
+
     @staticmethod
     async def rename_chat(chat_id: int, new_title: str) -> None:
-        await ChatDao.rename_chat(chat_id, new_title)
+        await ChatsManager.apply_writes([RenameChat(chat_id, new_title)])
 
     @staticmethod
     async def get_messages(
@@ -51,7 +529,7 @@ class ChatsManager:
             await session.commit()
 
         # Convert MessageDao objects to ChatMessages
-        model = chat.model
+        model = get_model(chat.model)
         chat_messages: list[ChatMessage] = []
         for message_dao in message_daos:
             chat_message = message_dao_to_chat_message(message_dao, model)
@@ -73,41 +551,71 @@ class ChatsManager:
                 started_at=datetime.datetime.now(datetime.timezone.utc),
             )
             session.add(chat)
-            await session.commit()
+            # Assign the chat an ID, so that its messages can refer to it.
+            await session.flush()
 
             chat_id = chat.id
+            message_daos: list[MessageDao] = []
             for message in chat_data.messages:
-                litellm_message = message.message
-                content = litellm_message["content"]
+                content = message.content
                 new_message = MessageDao(
                     chat_id=chat_id,
-                    role=litellm_message["role"],
+                    role=message.role,
                     content=content if isinstance(content, str) else "",
                     model=lookup_key,
                     timestamp=message.timestamp,
                 )
-                (await chat.awaitable_attrs.messages).append(new_message)
+                session.add(new_message)
+                chat.record_message(new_message)
+                message_daos.append(new_message)
 
             await session.commit()
 
+            for message, message_dao in zip(chat_data.messages, message_daos):
+                message.id = message_dao.id
+
+        publish_chat_event(lambda: ChatCreated(chat_dao_to_chat_summary(chat)))
         return chat.id
 
     @staticmethod
     async def archive_chat(chat_id: int) -> None:
-        async with get_session() as session:
-            statement = select(ChatDao).where(ChatDao.id == chat_id)
-            result = await session.exec(statement)
-            chat_dao = result.one()
-            chat_dao.archived = True
-            await session.commit()
+        await ChatsManager.archive_chats([chat_id])
+
+    @staticmethod
+    async def archive_chats(chat_ids: Sequence[int]) -> None:
+        """Archive chats, using a single UPDATE statement."""
+        await ChatsManager.apply_writes([ArchiveChats(tuple(chat_ids))])
+
+    @staticmethod
+    async def unarchive_chats(chat_ids: Sequence[int]) -> None:
+        """Unarchive chats, using a single UPDATE statement."""
+        write = ArchiveChats(tuple(chat_ids), archived=False)
+        await ChatsManager.apply_writes([write])
+
+    @staticmethod
+    async def delete_chats(chat_ids: Sequence[int]) -> None:
+        """Permanently delete chats and all of their messages."""
+        await ChatsManager.apply_writes([DeleteChats(tuple(chat_ids))])
 
     @staticmethod
     async def add_message_to_chat(chat_id: int, message: ChatMessage) -> None:
+        """Add a message to the end of a chat.
+
+        The chat's metadata is updated in the same transaction, and the cost
+        doesn't depend on the length of the chat.
+        """
+        await ChatsManager.apply_writes([AddMessage(chat_id, message)])
+
+    @staticmethod
+    async def apply_writes(writes: Sequence[ChatWrite]) -> None:
+        """Apply changes to the chat history in a single transaction.
+
+        If any of them fails, none of them are made.
+        """
         async with get_session() as session:
-            chat: ChatDao | None = await session.get(ChatDao, chat_id)
-            if not chat:
-                raise Exception(f"Chat with ID {chat_id} not found.")
-            message_dao = chat_message_to_message_dao(message, chat_id)
-            (await chat.awaitable_attrs.messages).append(message_dao)
-            session.add(chat)
+            for write in writes:
+                await write.apply(session)
             await session.commit()
+
+        for write in writes:
+            write.committed()
@@ -1,4 +1,8 @@
 import os
+from functools import cached_property
+from types import MappingProxyType
+from typing import Literal, Sequence
+
 from pydantic import AnyHttpUrl, BaseModel, ConfigDict, Field, SecretStr
 
 
@@ -45,6 +49,41 @@ class EliaChatModel(BaseModel):
         return self.id or self.name
 
 
+class UnknownModel(EliaChatModel):
+    model_config = ConfigDict(frozen=True)
+
+
+# Stands in for a model which isn't configured, e.g. the model of an old chat
+# which has since been removed from the config. Shared, so it's immutable.
+UNKNOWN_MODEL = UnknownModel(id="unknown", name="unknown model")
+
+
+class ModelRegistry:
+    """The configured models, indexed by ID and by name.
+
+    Built once per LaunchConfig, so looking up a model (which happens for every
+    chat and message loaded from the database) doesn't rebuild any indexes.
+    """
+
+    def __init__(self, models: Sequence[EliaChatModel]) -> None:
+        self.models: tuple[EliaChatModel, ...] = tuple(models)
+        # Where models share an ID or name, the last one wins.
+        self._by_id = MappingProxyType({model.id: model for model in self.models})
+        self._by_name = MappingProxyType(
+            {model.name: model for model in self.models}
+        )
+
+    def get(self, model_id_or_name: str) -> EliaChatModel:
+        """Return the model with the given ID or, failing that, name.
+
+        Returns `UNKNOWN_MODEL` if there's no such model.
+        """
+        model = self._by_id.get(model_id_or_name)
+        if model is None:
+            model = self._by_name.get(model_id_or_name, UNKNOWN_MODEL)
+        return model
+
+
 def get_builtin_openai_models() -> list[EliaChatModel]:
     return [
         EliaChatModel(
@@ -148,6 +187,51 @@ def get_builtin_models() -> list[EliaChatModel]:
     )
 
 
+class DatabaseConfig(BaseModel):
+    """The PRAGMAs applied to each connection to Elia's SQLite database.
+
+    See https://www.sqlite.org/pragma.html for what each of them does.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    journal_mode: Literal["delete", "truncate", "persist", "memory", "wal"] = "wal"
+    """With `wal`, a write only needs one sync (or none, with `synchronous =
+    "normal"`) rather than several, and doesn't block reads. WAL relies on
+    shared memory, so it can't be used when the database is accessed from
+    several machines over a network filesystem: use `truncate` instead."""
+    synchronous: Literal["off", "normal", "full", "extra"] = "normal"
+    """With `normal` in WAL mode, the database is synced at checkpoints rather
+    than on every commit. A power loss may lose the latest commits, but
+    can't corrupt the database."""
+    busy_timeout: int = Field(default=5000, ge=0)
+    """The number of milliseconds to wait for a lock held by another
+    connection before failing with "database is locked"."""
+    cache_size: int = Field(default=-16000)
+    """The size of the page cache of each connection. Negative values are in
+    KiB, positive values are in pages."""
+    mmap_size: int = Field(default=64 * 1024 * 1024, ge=0)
+    """The number of bytes of the database to read using memory-mapped I/O.
+    Set to 0 to disable memory-mapped I/O (e.g. on an unreliable network
+    filesystem)."""
+    temp_store: Literal["default", "file", "memory"] = "memory"
+    """Where temporary tables and indices are stored."""
+    statement_cache_size: int = Field(default=256, ge=0)
+    """The number of prepared statements cached by each connection."""
+
+    @property
+    def pragmas(self) -> dict[str, str | int]:
+        """The PRAGMAs to apply to each connection, by name."""
+        return {
+            "journal_mode": self.journal_mode,
+            "synchronous": self.synchronous,
+            "busy_timeout": self.busy_timeout,
+            "cache_size": self.cache_size,
+            "mmap_size": self.mmap_size,
+            "temp_store": self.temp_store,
+        }
+
+
 class LaunchConfig(BaseModel):
     """The config of the application at launch.
 
@@ -165,21 +249,31 @@ class LaunchConfig(BaseModel):
     )
     message_code_theme: str = Field(default="monokai")
     """The default Pygments syntax highlighting theme to be used in chatboxes."""
+    stream_fps: int = Field(default=30, gt=0)
+    """The maximum number of times per second a streaming response is redrawn."""
     models: list[EliaChatModel] = Field(default_factory=list)
     builtin_models: list[EliaChatModel] = Field(
         default_factory=get_builtin_models, init=False
     )
     theme: str = Field(default="nebula")
+    database: DatabaseConfig = Field(default_factory=DatabaseConfig)
+    """How connections to the database are configured."""
+
+    @cached_property
+    def model_registry(self) -> ModelRegistry:
+        """The configured models followed by the builtin ones, indexed for lookup.
+
+        The config is frozen, so this is only built once.
+        """
+        return ModelRegistry(self.models + self.builtin_models)
 
     @property
-    def all_models(self) -> list[EliaChatModel]:
-        return self.models + self.builtin_models
+    def all_models(self) -> tuple[EliaChatModel, ...]:
+        return self.model_registry.models
 
     @property
     def default_model_object(self) -> EliaChatModel:
-        from elia_chat.models import get_model
-
-        return get_model(self.default_model, self)
+        return self.model_registry.get(self.default_model)
 
     @classmethod
     def get_current(cls) -> "LaunchConfig":
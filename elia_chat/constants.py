@@ -1 +1,22 @@
 ERROR_NOTIFY_TIMEOUT_SECS = 15
+# The number of messages loaded at a time when opening and scrolling back
+# through a chat.
+CHAT_HISTORY_PAGE_SIZE = 50
+# The maximum number of rendered segments held in the render cache.
+RENDER_CACHE_SIZE = 200_000
+# The number of threads which render messages in the background when a chat
+# is opened.
+PRERENDER_THREADS = 2
+# The maximum time to wait for a model to start responding, and between the
+# chunks of its response.
+AGENT_RESPONSE_TIMEOUT_SECS = 120
+# How often the text of a response which is streaming in is saved, so that
+# it can be recovered if Elia exits before the response is complete.
+RESPONSE_CHECKPOINT_INTERVAL_SECS = 1.0
+# How long changes to the chat history wait to be grouped with others into a
+# single transaction before being committed.
+WRITE_QUEUE_INTERVAL_SECS = 0.1
+# The maximum number of results shown when searching the chat history.
+SEARCH_RESULT_LIMIT = 50
+# How long to wait after the user stops typing a search before running it.
+SEARCH_DEBOUNCE_SECS = 0.15
@@ -1,8 +1,21 @@
 from typing import TYPE_CHECKING, Any
 
+from sqlalchemy import Row
 
-from elia_chat.database.models import ChatDao, MessageDao
-from elia_chat.models import ChatData, ChatMessage, get_model
+from elia_chat.config import EliaChatModel
+from elia_chat.database.models import (
+    SEARCH_HIGHLIGHT_END,
+    SEARCH_HIGHLIGHT_START,
+    ChatDao,
+    MessageDao,
+)
+from elia_chat.models import (
+    ChatData,
+    ChatMessage,
+    ChatSummary,
+    SearchResult,
+    get_model,
+)
 
 if TYPE_CHECKING:
     from litellm.types.completion import ChatCompletionUserMessageParam
@@ -13,11 +26,11 @@ def chat_message_to_message_dao(
     chat_id: int,
 ) -> MessageDao:
     """Convert a ChatMessage to a SQLModel message."""
-    meta: dict[str, Any] = {}
-    content = message.message.get("content", "")
+    meta: dict[str, Any] = dict(message.meta)
+    content = message.content
     return MessageDao(
         chat_id=chat_id,
-        role=message.message["role"],
+        role=message.role,
         content=content if isinstance(content, str) else "",
         timestamp=message.timestamp,
         model=message.model.lookup_key,
@@ -27,11 +40,11 @@ def chat_message_to_message_dao(
 
 def chat_dao_to_chat_data(chat_dao: ChatDao) -> ChatData:
     """Convert the SQLModel chat to a ChatData."""
-    model = chat_dao.model
+    model = get_model(chat_dao.model)
     return ChatData(
         id=chat_dao.id,
         title=chat_dao.title,
-        model=get_model(model),
+        model=model,
         create_timestamp=chat_dao.started_at if chat_dao.started_at else None,
         messages=[
             message_dao_to_chat_message(message, model) for message in chat_dao.messages
@@ -39,8 +52,40 @@ def chat_dao_to_chat_data(chat_dao: ChatDao) -> ChatData:
     )
 
 
-def message_dao_to_chat_message(message_dao: MessageDao, model: str) -> ChatMessage:
-    """Convert the SQLModel message to a ChatMessage."""
+def chat_dao_to_chat_summary(chat_dao: ChatDao) -> ChatSummary:
+    """Convert the SQLModel chat to a ChatSummary, without touching its messages."""
+    return ChatSummary(
+        id=chat_dao.id,
+        model=get_model(chat_dao.model),
+        title=chat_dao.title,
+        preview=chat_dao.preview,
+        message_count=chat_dao.message_count,
+        last_message_at=chat_dao.last_message_at,
+    )
+
+
+def chat_summary_row_to_chat_summary(row: Row[Any]) -> ChatSummary:
+    """Convert a row returned by `ChatDao.summaries` to a ChatSummary."""
+    return ChatSummary(
+        id=row.id,
+        model=get_model(row.model),
+        title=row.title,
+        preview=row.preview or "",
+        message_count=row.message_count,
+        last_message_at=row.last_message_at,
+    )
+
+
+def message_dao_to_chat_message(
+    message_dao: MessageDao, model: EliaChatModel
+) -> ChatMessage:
+    """Convert the SQLModel message to a ChatMessage.
+
+    Args:
+        message_dao: The message to convert.
+        model: The model of the chat the message belongs to. This is looked up
+            once per chat by the caller, rather than once per message.
+    """
     message: ChatCompletionUserMessageParam = {
         "content": message_dao.content,
         "role": message_dao.role,  # type: ignore
@@ -49,5 +94,32 @@ def message_dao_to_chat_message(message_dao: MessageDao, model: str) -> ChatMess
     return ChatMessage(
         message=message,
         timestamp=message_dao.timestamp,
-        model=get_model(model),
+        model=model,
+        id=message_dao.id,
+        meta=dict(message_dao.meta) if message_dao.meta else None,
+    )
+
+
+def search_row_to_search_result(row: Row[Any]) -> SearchResult:
+    """Convert a row returned by `MessageDao.search` or `ChatDao.search_titles`
+    to a SearchResult."""
+    # Split the snippet on the highlight markers: every odd part is a match.
+    parts = (row.snippet or "").replace(SEARCH_HIGHLIGHT_END, SEARCH_HIGHLIGHT_START)
+    snippet = ""
+    highlights: list[tuple[int, int]] = []
+    for index, part in enumerate(parts.split(SEARCH_HIGHLIGHT_START)):
+        if index % 2:
+            highlights.append((len(snippet), len(snippet) + len(part)))
+        snippet += part
+
+    mapping = row._mapping
+    return SearchResult(
+        chat_id=row.chat_id,
+        chat_title=row.chat_title,
+        chat_preview=row.chat_preview or "",
+        snippet=snippet,
+        highlights=highlights,
+        message_id=mapping.get("message_id"),
+        role=mapping.get("role"),
+        timestamp=row.timestamp,
     )
@@ -1,27 +1,80 @@
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator
 from sqlmodel import SQLModel
+from elia_chat.config import DatabaseConfig
+from elia_chat.database.migrations import migrate
 from elia_chat.locations import data_directory
 
 from sqlmodel.ext.asyncio.session import AsyncSession
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    async_sessionmaker,
+    create_async_engine,
+)
 
 
 sqlite_file_name = data_directory() / "elia.sqlite"
 sqlite_url = f"sqlite+aiosqlite:///{sqlite_file_name}"
-engine = create_async_engine(sqlite_url)
 
 
-async def create_database():
+def _create_engine(config: DatabaseConfig) -> AsyncEngine:
+    """Create an engine whose connections are configured by `config`."""
+    new_engine = create_async_engine(
+        sqlite_url,
+        connect_args={"cached_statements": config.statement_cache_size},
+    )
+
+    @event.listens_for(new_engine.sync_engine, "connect")
+    def apply_pragmas(dbapi_connection: Any, _connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in config.pragmas.items():
+            # The values are validated by DatabaseConfig, so can't inject SQL.
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    return new_engine
+
+
+def _create_session_factory(
+    engine: AsyncEngine,
+) -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+engine = _create_engine(DatabaseConfig())
+# Creates the sessions returned by `get_session`.
+session_factory = _create_session_factory(engine)
+
+
+def configure_database(config: DatabaseConfig) -> None:
+    """Configure the connections made to the database.
+
+    Connections are configured when they're opened, so this must be called
+    before the database is first used.
+    """
+    global engine, session_factory
+    engine = _create_engine(config)
+    session_factory = _create_session_factory(engine)
+
+
+async def create_database() -> None:
+    """Create the tables (and indexes etc.) of a new database."""
     async with engine.begin() as conn:
-        # TODO - check if exists, use Alembic.
         await conn.run_sync(SQLModel.metadata.create_all)
+    await migrate(engine)
+
+
+async def upgrade_database() -> list[int]:
+    """Bring the schema of an existing database up to date.
+
+    Returns:
+        The schema versions which the database was migrated to, in order.
+    """
+    return await migrate(engine)
 
 
 @asynccontextmanager
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    async_session = async_sessionmaker(
-        engine, class_=AsyncSession, expire_on_commit=False
-    )
-    async with async_session() as session:
+    async with session_factory() as session:
         yield session
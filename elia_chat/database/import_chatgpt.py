@@ -1,81 +1,577 @@
+"""Importing conversations exported from ChatGPT.
+
+Exports can be several gigabytes, so rather than loading the whole file, the
+top-level array of conversations is parsed incrementally and each conversation
+is imported as soon as it has been parsed. Memory use depends on the size of
+the largest conversation, not on the size of the file.
+
+The import is a pipeline: the export is parsed and normalised into rows in a
+separate process, while the main process bulk-inserts the rows from previous
+batches.
+
+Imports are idempotent. The IDs of conversations and messages in the export
+are recorded in the `meta` of the chats and messages imported from them, so
+importing a newer export only adds what's new. A checkpoint is saved after
+each batch, so an interrupted import resumes where it stopped.
+
+If [ijson](https://pypi.org/project/ijson/) is installed, it's used to parse
+the file. Otherwise, a parser built on the standard library's `json` is used.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import codecs
 import json
+import multiprocessing
+import re
+import time
+from dataclasses import dataclass, field
 from datetime import datetime
+from multiprocessing.queues import Queue
 from pathlib import Path
+from queue import Empty
+from typing import Any, BinaryIO, Iterator
 
+import humanize
 from rich.console import Console
 from rich.live import Live
 from rich.text import Text
+from sqlalchemy import func, insert, literal_column, text
+from sqlmodel import SQLModel, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from elia_chat.database.database import get_session
-from elia_chat.database.models import MessageDao, ChatDao
+from elia_chat.database.models import CHAT_PREVIEW_LENGTH, MessageDao, ChatDao
+from elia_chat.locations import data_directory
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# The number of bytes read from the export at a time.
+READ_CHUNK_SIZE = 1024 * 1024
+
+# The (approximate) number of messages written to the database per transaction.
+# Progress is also reported once per batch.
+IMPORT_BATCH_SIZE = 10_000
+
+# The number of parsed batches which can be waiting to be written. This bounds
+# the memory used if the export is parsed faster than it can be written.
+IMPORT_QUEUED_BATCHES = 2
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_ITEM_DELIMITERS = frozenset(",] \t\n\r")
+
+
+def iter_json_array(file: BinaryIO) -> Iterator[Any]:
+    """Yield the items of the JSON array in a file, parsing one item at a time.
+
+    Only the item being parsed (and up to `READ_CHUNK_SIZE` bytes after it) is
+    held in memory at once.
+
+    Args:
+        file: The file, opened in binary mode.
+
+    Raises:
+        ValueError: If the file doesn't contain a JSON array.
+    """
+    if ijson is not None:
+        # Floats rather than Decimals, so that metadata can be stored as JSON.
+        yield from ijson.items(file, "item", use_float=True)
+        return
+
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    position = 0
+    at_end_of_file = False
+    expecting = "["
+
+    while True:
+        position = _WHITESPACE.match(buffer, position).end()  # type: ignore[union-attr]
+        char = buffer[position] if position < len(buffer) else ""
+        if char and expecting == "[":
+            if char != "[":
+                raise ValueError("Expected a JSON array of conversations.")
+            expecting = "item"
+            position += 1
+            continue
+        if char and expecting == ",":
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' but found {char!r}.")
+            expecting = "item"
+            position += 1
+            continue
+        if char and expecting == "item":
+            if char == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Unless the whole file has been read, the item may just
+                # continue beyond the end of the buffer.
+                if at_end_of_file:
+                    raise
+            else:
+                # Likewise, a number may continue beyond the end of the
+                # buffer (e.g. "1." + "5"), so an item is only complete once
+                # the character after it has been read.
+                if at_end_of_file or buffer[end : end + 1] in _ITEM_DELIMITERS:
+                    yield item
+                    position = end
+                    expecting = ","
+                    continue
+        elif at_end_of_file:
+            raise ValueError(f"Unexpected end of file (expected {expecting!r}).")
+
+        # Read at least as much as is already buffered, so that an item which
+        # spans many reads is only parsed a logarithmic number of times.
+        data = file.read(max(READ_CHUNK_SIZE, len(buffer) - position))
+        at_end_of_file = not data
+        buffer = buffer[position:] + text_decoder.decode(data, final=at_end_of_file)
+        position = 0
+
+
+def output_progress(
+    chat_count: int,
+    skipped_count: int,
+    message_count: int,
+    bytes_read: int,
+    total_bytes: int,
+    elapsed: float,
+    finished: bool = False,
+) -> Text:
+    """The progress of an import, for display in a Live."""
+    if finished:
+        remaining = "done"
+    elif bytes_read and elapsed:
+        seconds_left = (total_bytes - bytes_read) * elapsed / bytes_read
+        remaining = f"about {humanize.naturaldelta(seconds_left)} remaining"
+    else:
+        remaining = "estimating time remaining"
+    percent = bytes_read / total_bytes * 100 if total_bytes else 100.0
+    return Text.from_markup(
+        f"Imported [b]{chat_count}[/] chats "
+        f"([b]{skipped_count}[/] more were already up to date).\n"
+        f"[b]{message_count}[/] new messages in total.\n"
+        f"Read [b]{humanize.naturalsize(bytes_read)}[/] of "
+        f"[b]{humanize.naturalsize(total_bytes)}[/] ({percent:.0f}%), {remaining}.",
+        style="green" if finished else "yellow",
+    )
+
+
+def normalize_conversation(
+    chat_data: dict[str, Any],
+) -> tuple[dict[str, Any], list[dict[str, Any]]]:
+    """Convert a conversation from the export into rows of the `chat` and
+    `message` tables.
+
+    The IDs of the conversation and of its messages in the export are recorded
+    as the `source_id` in the `meta` of their rows, so that they can be
+    recognised if they're imported again.
+
+    Returns:
+        The values of the chat's row, and of its messages' rows (without
+        their `chat_id`).
+    """
+    chat_model = "gpt-3.5-turbo"
+    messages: list[dict[str, Any]] = []
+    for node_id, message_data in chat_data["mapping"].items():
+        message_info = message_data.get("message")
+        if not message_info:
+            continue
+        metadata = message_info.get("metadata", {})
+        model = "gpt-3.5-turbo"
+        if metadata:
+            model = metadata.get("model_slug")
+            chat_model = "gpt-4-turbo" if model == "gpt-4" else "gpt-3.5-turbo"
+        messages.append(
+            {
+                "role": message_info["author"]["role"],
+                "content": str(message_info["content"].get("parts", [""])[0]),
+                "timestamp": datetime.fromtimestamp(
+                    message_info.get("create_time", 0) or 0
+                ),
+                "model": model,
+                "meta": {**metadata, "source_id": node_id},
+            }
+        )
+
+    source_id = chat_data.get("conversation_id") or chat_data.get("id")
+    chat_meta: dict[str, Any] = {}
+    if source_id:
+        chat_meta = {
+            "source": "chatgpt",
+            "source_id": source_id,
+            "source_update_time": chat_data.get("update_time"),
+        }
+
+    # The denormalised columns, as `ChatDao.record_message` would set them.
+    chat = {
+        "title": chat_data.get("title"),
+        "model": chat_model,
+        "started_at": datetime.fromtimestamp(chat_data.get("create_time", 0) or 0),
+        "message_count": len(messages),
+        "last_message_at": max(
+            (message["timestamp"] for message in messages), default=None
+        ),
+        "preview": next(
+            (
+                message["content"][:CHAT_PREVIEW_LENGTH]
+                for message in messages
+                if message["role"] == "user" and message["content"]
+            ),
+            "",
+        ),
+        "meta": chat_meta,
+    }
+    return chat, messages
+
+
+@dataclass
+class ImportBatch:
+    """Conversations which are written to the database in one transaction."""
+
+    chats: list[dict[str, Any]] = field(default_factory=list)
+    """The rows of the chats."""
+    messages: list[list[dict[str, Any]]] = field(default_factory=list)
+    """The rows of the messages of each chat."""
+    message_count: int = 0
+    bytes_read: int = 0
+    """How far through the export the parser was after the last conversation."""
+
+
+def parse_export(file: Path, batches: Queue[Any], skip: int = 0) -> None:
+    """Parse and normalise an export, putting the conversations on a queue in
+    batches of around `IMPORT_BATCH_SIZE` messages.
+
+    This is run in a process of its own, so that the export is parsed while
+    the previous batch is being written. When the whole export has been
+    parsed, None is put on the queue. If parsing fails, a description of the
+    error is put on the queue instead.
+
+    Args:
+        file: The export.
+        batches: The queue to put the batches on.
+        skip: The number of conversations at the start of the export to skip.
+    """
+    try:
+        with open(file, "rb") as f:
+            batch = ImportBatch()
+            for index, chat_data in enumerate(iter_json_array(f)):
+                if index < skip:
+                    continue
+                chat, messages = normalize_conversation(chat_data)
+                batch.chats.append(chat)
+                batch.messages.append(messages)
+                batch.message_count += len(messages)
+                if batch.message_count >= IMPORT_BATCH_SIZE:
+                    batch.bytes_read = f.tell()
+                    batches.put(batch)
+                    batch = ImportBatch()
+            if batch.chats:
+                batch.bytes_read = f.tell()
+                batches.put(batch)
+        batches.put(None)
+    except Exception as error:
+        batches.put(f"{type(error).__name__}: {error}")
+
+
+# The ID of an imported chat in its source. This is the expression which
+# `ix_chat_source_id` indexes, so the path isn't a bound parameter.
+_CHAT_SOURCE_ID = func.json_extract(ChatDao.meta, literal_column("'$.source_id'"))
 
-async def import_chatgpt_data(file: Path) -> None:
-    console = Console()
 
-    with open(file, "r") as f:
-        data = json.load(f)
+async def find_imported_chats(
+    session: AsyncSession, source_ids: list[str]
+) -> dict[str, tuple[int, dict[str, Any]]]:
+    """Look up the chats which were imported from the given source IDs.
 
-    console.print("[green]Loaded and parsed JSON.")
+    Returns:
+        The ID and meta of each chat which was found, by source ID.
+    """
+    if not source_ids:
+        return {}
+    result = await session.exec(
+        select(ChatDao.id, ChatDao.meta).where(_CHAT_SOURCE_ID.in_(source_ids))
+    )
+    return {
+        meta["source_id"]: (chat_id, dict(meta))
+        for chat_id, meta in result
+        if meta is not None
+    }
 
-    def output_progress(
-        imported_count: int, total_count: int, message_count: int
-    ) -> Text:
-        style = "green" if imported_count == total_count else "yellow"
-        return Text.from_markup(
-            f"Imported [b]{imported_count}[/] of [b]{total_count}[/] chats.\n"
-            f"[b]{message_count}[/] messages in total.",
-            style=style,
+
+async def write_batch(session: AsyncSession, batch: ImportBatch) -> tuple[int, int]:
+    """Write the chats and messages of a batch which weren't imported by a
+    previous import, and commit them.
+
+    Conversations which were imported previously and have been updated since
+    have only their new messages added.
+
+    Returns:
+        The number of messages written, and the number of conversations which
+        were skipped as they hadn't changed since they were imported.
+    """
+    imported = await find_imported_chats(
+        session,
+        [chat["meta"]["source_id"] for chat in batch.chats if chat["meta"]],
+    )
+    new_chats: list[dict[str, Any]] = []
+    new_chat_messages: list[list[dict[str, Any]]] = []
+    updated_chats: list[tuple[int, dict[str, Any], list[dict[str, Any]]]] = []
+    skipped = 0
+    for chat, messages in zip(batch.chats, batch.messages):
+        source_id = chat["meta"].get("source_id")
+        if source_id not in imported:
+            new_chats.append(chat)
+            new_chat_messages.append(messages)
+            continue
+        chat_id, meta = imported[source_id]
+        update_time = chat["meta"]["source_update_time"]
+        if update_time is not None and update_time == meta.get("source_update_time"):
+            skipped += 1
+        else:
+            updated_chats.append((chat_id, chat["meta"], messages))
+
+    rows: list[dict[str, Any]] = []
+    if new_chats:
+        result = await session.execute(
+            insert(ChatDao).returning(col(ChatDao.id), sort_by_parameter_order=True),
+            new_chats,
+        )
+        for chat_id, messages in zip(result.scalars().all(), new_chat_messages):
+            rows.extend({**message, "chat_id": chat_id} for message in messages)
+    if updated_chats:
+        rows.extend(await _update_imported_chats(session, updated_chats))
+    if not rows:
+        await session.commit()
+        return 0, skipped
+
+    last_message_id = (await session.exec(select(func.max(MessageDao.id)))).one()
+
+    # Indexing each message for search as it's inserted takes as long as the
+    # rest of the insert, so the trigger which does it is dropped while the
+    # messages are inserted, and they're indexed together afterwards. As the
+    # whole batch is written in one transaction, nothing else can insert a
+    # message in the meantime.
+    trigger = await session.execute(
+        text(
+            "SELECT sql FROM sqlite_master "
+            "WHERE type = 'trigger' AND name = 'message_fts_insert'"
+        )
+    )
+    create_trigger = trigger.scalar_one()
+    await session.execute(text("DROP TRIGGER message_fts_insert"))
+
+    # A Core insert, as the ORM's bookkeeping would cost more than the insert
+    # itself.
+    await session.execute(insert(SQLModel.metadata.tables["message"]), rows)
+    await session.execute(
+        text(
+            "INSERT INTO message_fts (rowid, content) "
+            "SELECT id, content FROM message WHERE id > :last_message_id "
+            "AND json_extract(meta, '$.in_progress') IS NULL"
+        ),
+        {"last_message_id": last_message_id or 0},
+    )
+
+    await session.execute(text(create_trigger))
+    await session.commit()
+    return len(rows), skipped
+
+
+async def _update_imported_chats(
+    session: AsyncSession,
+    updated_chats: list[tuple[int, dict[str, Any], list[dict[str, Any]]]],
+) -> list[dict[str, Any]]:
+    """Record the messages which have been added to previously imported
+    conversations against their chats.
+
+    Returns:
+        The rows of the messages which weren't imported previously.
+    """
+    chat_ids = [chat_id for chat_id, _meta, _messages in updated_chats]
+    result = await session.exec(
+        select(
+            MessageDao.chat_id, func.json_extract(MessageDao.meta, "$.source_id")
+        ).where(col(MessageDao.chat_id).in_(chat_ids))
+    )
+    imported_messages = {(chat_id, source_id) for chat_id, source_id in result}
+
+    rows: list[dict[str, Any]] = []
+    for chat_id, meta, messages in updated_chats:
+        chat = await session.get(ChatDao, chat_id)
+        assert chat is not None
+        for message in messages:
+            if (chat_id, message["meta"]["source_id"]) not in imported_messages:
+                row = {**message, "chat_id": chat_id}
+                chat.record_message(MessageDao(**row))
+                rows.append(row)
+        # Assigned rather than updated in place, so the change is detected.
+        chat.meta = {**(chat.meta or {}), **meta}
+        session.add(chat)
+    return rows
+
+
+def _checkpoint_file() -> Path:
+    return data_directory() / "import_checkpoint.json"
+
+
+def _export_identity(file: Path) -> dict[str, Any]:
+    """Identifies an export file, so a checkpoint isn't applied to another."""
+    stat = file.stat()
+    return {
+        "path": str(file.resolve()),
+        "size": stat.st_size,
+        "modified": stat.st_mtime_ns,
+    }
+
+
+def save_checkpoint(
+    file: Path, conversation_count: int, last_source_id: str | None
+) -> None:
+    """Record that the first `conversation_count` conversations of an export
+    have been written to the database."""
+    checkpoint = {
+        "export": _export_identity(file),
+        "conversations": conversation_count,
+        "last_source_id": last_source_id,
+    }
+    path = _checkpoint_file()
+    temporary_path = path.with_suffix(".tmp")
+    temporary_path.write_text(json.dumps(checkpoint))
+    temporary_path.replace(path)
+
+
+async def load_checkpoint(session: AsyncSession, file: Path) -> int:
+    """Return the number of conversations at the start of an export which were
+    written by an interrupted import of it, or 0.
+
+    The checkpoint is only used if the export hasn't changed since, and the
+    last conversation it records is in the database (it wouldn't be if the
+    database had been reset, for example).
+    """
+    try:
+        checkpoint = json.loads(_checkpoint_file().read_text())
+    except (OSError, ValueError):
+        return 0
+    last_source_id = checkpoint.get("last_source_id")
+    if checkpoint.get("export") != _export_identity(file) or not last_source_id:
+        return 0
+    if not await find_imported_chats(session, [last_source_id]):
+        return 0
+    return int(checkpoint.get("conversations", 0))
+
+
+def clear_checkpoint() -> None:
+    _checkpoint_file().unlink(missing_ok=True)
+
+
+async def import_chatgpt_data(file: Path) -> None:
+    """Import the conversations in an export which haven't been imported yet.
+
+    Importing an export again only adds the conversations and messages which
+    are new since it was last imported. If an import is interrupted, running
+    it again resumes from the last batch which was written.
+    """
+    console = Console()
+    parser = "ijson" if ijson is not None else "json"
+    console.print(f"[green]Streaming conversations from {file.name!r} ({parser}).")
+
+    async with get_session() as session:
+        conversation_count = await load_checkpoint(session, file)
+    if conversation_count:
+        console.print(
+            f"[green]Resuming the previous import, "
+            f"after the first {conversation_count} conversations."
         )
 
+    total_bytes = file.stat().st_size
+    start_time = time.monotonic()
+    chat_count = 0
+    skipped_count = 0
     message_count = 0
-    with Live(output_progress(0, len(data), message_count)) as live:
-        async with get_session() as session:
-            for chat_number, chat_data in enumerate(data, start=1):
-                chat = ChatDao(
-                    title=chat_data.get("title"),
-                    model="gpt-3.5-turbo",
-                    started_at=datetime.fromtimestamp(
-                        chat_data.get("create_time", 0) or 0
-                    ),
-                )
-                session.add(chat)
-                await (
-                    session.commit()
-                )  # Make sure to commit so that chat.id is assigned
-
-                for _message_id, message_data in chat_data["mapping"].items():
-                    message_info = message_data.get("message")
-                    if message_info:
-                        metadata = message_info.get("metadata", {})
-                        model = "gpt-3.5-turbo"
-                        if metadata:
-                            model = metadata.get("model_slug")
-                            chat.model = (
-                                "gpt-4-turbo" if model == "gpt-4" else "gpt-3.5-turbo"
-                            )
-                            session.add(chat)
-                            await session.commit()
-
-                        role = message_info["author"]["role"]
-                        chat_id = chat.id
-                        message = MessageDao(
-                            chat_id=chat_id,
-                            role=role,
-                            content=str(message_info["content"].get("parts", [""])[0]),
-                            timestamp=datetime.fromtimestamp(
-                                message_info.get("create_time", 0) or 0
+
+    # Spawned rather than forked, as the database driver runs in a thread.
+    context = multiprocessing.get_context("spawn")
+    batches = context.Queue(maxsize=IMPORT_QUEUED_BATCHES)
+    parser_process = context.Process(
+        target=parse_export, args=(file, batches, conversation_count), daemon=True
+    )
+    parser_process.start()
+
+    def next_batch() -> ImportBatch | str | None:
+        while True:
+            try:
+                return batches.get(timeout=1)
+            except Empty:
+                if not parser_process.is_alive():
+                    return "The process parsing the export exited unexpectedly."
+
+    try:
+        with Live(output_progress(0, 0, 0, 0, total_bytes, 0.0)) as live:
+            async with get_session() as session:
+                while True:
+                    batch = await asyncio.to_thread(next_batch)
+                    if batch is None:
+                        break
+                    if isinstance(batch, str):
+                        raise ValueError(f"Couldn't read {file.name!r}. {batch}")
+                    written, skipped = await write_batch(session, batch)
+                    conversation_count += len(batch.chats)
+                    save_checkpoint(
+                        file,
+                        conversation_count,
+                        next(
+                            (
+                                chat["meta"]["source_id"]
+                                for chat in reversed(batch.chats)
+                                if chat["meta"]
                             ),
-                            model=model,
-                            meta=metadata,
-                        )
-                        session.add(message)
-                        message_count += 1
-                        live.update(
-                            output_progress(chat_number, len(data), message_count)
+                            None,
+                        ),
+                    )
+                    chat_count += len(batch.chats) - skipped
+                    skipped_count += skipped
+                    message_count += written
+                    live.update(
+                        output_progress(
+                            chat_count,
+                            skipped_count,
+                            message_count,
+                            batch.bytes_read,
+                            total_bytes,
+                            time.monotonic() - start_time,
                         )
+                    )
+
+            elapsed = time.monotonic() - start_time
+            live.update(
+                output_progress(
+                    chat_count,
+                    skipped_count,
+                    message_count,
+                    total_bytes,
+                    total_bytes,
+                    elapsed,
+                    finished=True,
+                )
+            )
+    finally:
+        parser_process.kill()
+        parser_process.join()
+    clear_checkpoint()
 
-                await session.commit()
+    rate = message_count / elapsed if elapsed else 0.0
+    console.print(
+        f"[green]Imported [b]{message_count}[/] messages in "
+        f"[b]{elapsed:.1f}[/] seconds ([b]{rate:,.0f}[/] messages/second)."
+    )
 
 
 if __name__ == "__main__":
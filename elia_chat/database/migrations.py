@@ -0,0 +1,263 @@
+"""Versioned migrations of the database schema.
+
+The schema version of a database is stored in its `user_version` pragma. Each
+migration brings the schema from one version to the next, and is applied in a
+transaction of its own along with the new version number, so an interrupted
+upgrade carries on from where it stopped.
+
+New databases are created from the models (which describe the latest schema)
+and then migrated, so migrations must be safe to apply to a schema which
+already includes their changes.
+
+To change the schema, update the models and append a migration to
+`MIGRATIONS`. Migrations which have been released must never be changed.
+"""
+
+from __future__ import annotations
+
+from typing import Awaitable, Callable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+Migration = Callable[[AsyncConnection], Awaitable[None]]
+
+
+async def _add_chat_metadata_columns(conn: AsyncConnection) -> None:
+    """Add and backfill the denormalised `chat` columns which let us list chats
+    without reading the `message` table."""
+    from elia_chat.database.models import CHAT_PREVIEW_LENGTH
+
+    result = await conn.execute(text("PRAGMA table_info(chat)"))
+    columns = {row.name for row in result}
+    if not columns or "last_message_at" in columns:
+        return
+
+    await conn.execute(text("ALTER TABLE chat ADD COLUMN last_message_at DATETIME"))
+    await conn.execute(
+        text("ALTER TABLE chat ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+    )
+    await conn.execute(
+        text("ALTER TABLE chat ADD COLUMN preview VARCHAR NOT NULL DEFAULT ''")
+    )
+    await conn.execute(
+        text("""
+            UPDATE chat SET
+                last_message_at = (
+                    SELECT max(timestamp) FROM message WHERE chat_id = chat.id
+                ),
+                message_count = (
+                    SELECT count(*) FROM message WHERE chat_id = chat.id
+                ),
+                preview = coalesce((
+                    SELECT substr(content, 1, :preview_length) FROM message
+                    WHERE chat_id = chat.id AND role = 'user'
+                    ORDER BY id LIMIT 1
+                ), '')
+        """),
+        {"preview_length": CHAT_PREVIEW_LENGTH},
+    )
+    await conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_chat_archived_last_message_at "
+            "ON chat (archived, last_message_at DESC)"
+        )
+    )
+
+
+# The FTS5 full-text indexes of message content and chat titles, used for
+# searching the chat history.
+_SEARCH_INDEX_SCHEMA = [
+    # The indexes store only the tokens. The text itself is read from the
+    # `message` and `chat` tables, so it isn't stored twice. The prefix index
+    # speeds up matching the partially typed last word of a search.
+    """
+    CREATE VIRTUAL TABLE message_fts USING fts5(
+        content, content='message', content_rowid='id', prefix='2 3'
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE chat_fts USING fts5(
+        title, content='chat', content_rowid='id'
+    )
+    """,
+    # Triggers keep the indexes in sync with the tables they index.
+    """
+    CREATE TRIGGER message_fts_insert AFTER INSERT ON message BEGIN
+        INSERT INTO message_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER message_fts_delete AFTER DELETE ON message BEGIN
+        INSERT INTO message_fts (message_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER message_fts_update AFTER UPDATE OF content ON message BEGIN
+        INSERT INTO message_fts (message_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+        INSERT INTO message_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_fts_insert AFTER INSERT ON chat BEGIN
+        INSERT INTO chat_fts (rowid, title) VALUES (new.id, new.title);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_fts_delete AFTER DELETE ON chat BEGIN
+        INSERT INTO chat_fts (chat_fts, rowid, title)
+        VALUES ('delete', old.id, old.title);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_fts_update AFTER UPDATE OF title ON chat BEGIN
+        INSERT INTO chat_fts (chat_fts, rowid, title)
+        VALUES ('delete', old.id, old.title);
+        INSERT INTO chat_fts (rowid, title) VALUES (new.id, new.title);
+    END
+    """,
+]
+
+
+async def _create_search_index(conn: AsyncConnection) -> None:
+    """Create the full-text search indexes, and index any existing messages."""
+    result = await conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = 'message_fts'")
+    )
+    if result.first() is not None:
+        return
+
+    for statement in _SEARCH_INDEX_SCHEMA:
+        await conn.execute(text(statement))
+    await conn.execute(text("INSERT INTO message_fts (message_fts) VALUES ('rebuild')"))
+    await conn.execute(text("INSERT INTO chat_fts (chat_fts) VALUES ('rebuild')"))
+
+
+async def _add_indexes(conn: AsyncConnection) -> None:
+    """Index the columns messages are looked up by, so that reading a chat's
+    messages doesn't scan the whole `message` table."""
+    # The names match those of the indexes declared on the models.
+    for statement in [
+        "CREATE INDEX IF NOT EXISTS ix_message_chat_id ON message (chat_id)",
+        "CREATE INDEX IF NOT EXISTS ix_message_timestamp ON message (timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_message_parent_id ON message (parent_id)",
+        # Also serves lookups by `archived` alone.
+        "CREATE INDEX IF NOT EXISTS ix_chat_archived_last_message_at "
+        "ON chat (archived, last_message_at DESC)",
+    ]:
+        await conn.execute(text(statement))
+
+
+async def _add_chat_meta(conn: AsyncConnection) -> None:
+    """Add the `chat.meta` column, and index the IDs of imported chats in it."""
+    result = await conn.execute(text("PRAGMA table_info(chat)"))
+    columns = {row.name for row in result}
+    if "meta" not in columns:
+        await conn.execute(text("ALTER TABLE chat ADD COLUMN meta JSON"))
+    await conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_chat_source_id "
+            "ON chat (json_extract(meta, '$.source_id'))"
+        )
+    )
+
+
+_COMPLETED_MESSAGE_SEARCH_TRIGGERS = [
+    # Responses are saved repeatedly while they stream in, and indexing a
+    # message costs time proportional to its length, so messages which are
+    # in progress aren't indexed. They're indexed once, when the flag is
+    # cleared.
+    """
+    CREATE TRIGGER message_fts_insert AFTER INSERT ON message
+    WHEN json_extract(new.meta, '$.in_progress') IS NULL BEGIN
+        INSERT INTO message_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER message_fts_delete AFTER DELETE ON message
+    WHEN json_extract(old.meta, '$.in_progress') IS NULL BEGIN
+        INSERT INTO message_fts (message_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER message_fts_update AFTER UPDATE OF content, meta ON message
+    WHEN json_extract(old.meta, '$.in_progress') IS NULL
+        OR json_extract(new.meta, '$.in_progress') IS NULL
+    BEGIN
+        INSERT INTO message_fts (message_fts, rowid, content)
+        SELECT 'delete', old.id, old.content
+        WHERE json_extract(old.meta, '$.in_progress') IS NULL;
+        INSERT INTO message_fts (rowid, content)
+        SELECT new.id, new.content
+        WHERE json_extract(new.meta, '$.in_progress') IS NULL;
+    END
+    """,
+]
+
+
+async def _index_completed_messages_only(conn: AsyncConnection) -> None:
+    """Stop indexing messages for search while they're streaming in."""
+    result = await conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE name = 'message_fts_insert'")
+    )
+    if "in_progress" in (result.scalar_one_or_none() or ""):
+        return
+
+    for name in ["message_fts_insert", "message_fts_delete", "message_fts_update"]:
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    await conn.execute(
+        text("""
+            INSERT INTO message_fts (message_fts, rowid, content)
+            SELECT 'delete', id, content FROM message
+            WHERE json_extract(meta, '$.in_progress') IS NOT NULL
+        """)
+    )
+    for statement in _COMPLETED_MESSAGE_SEARCH_TRIGGERS:
+        await conn.execute(text(statement))
+
+
+# The migrations, in order. A database at version N has had the first N applied.
+MIGRATIONS: list[Migration] = [
+    _add_chat_metadata_columns,
+    _create_search_index,
+    _add_indexes,
+    _add_chat_meta,
+    _index_completed_messages_only,
+]
+
+# The version of the schema described by the models.
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def get_schema_version(conn: AsyncConnection) -> int:
+    result = await conn.execute(text("PRAGMA user_version"))
+    return result.scalar_one()
+
+
+async def migrate(engine: AsyncEngine) -> list[int]:
+    """Apply any migrations which haven't been applied to the database yet.
+
+    A database which was created by a newer version of Elia is left as it is.
+
+    Returns:
+        The versions which the database was migrated to, in order.
+    """
+    async with engine.connect() as conn:
+        version = await get_schema_version(conn)
+
+    applied: list[int] = []
+    for new_version in range(version + 1, SCHEMA_VERSION + 1):
+        async with engine.connect() as conn:
+            # The driver only begins transactions before DML, so begin one
+            # explicitly. DDL is transactional in SQLite, so the migration is
+            # then applied either completely or not at all.
+            await conn.exec_driver_sql("BEGIN IMMEDIATE")
+            await MIGRATIONS[new_version - 1](conn)
+            # The version can't be a bound parameter, but it's always an int.
+            await conn.exec_driver_sql(f"PRAGMA user_version = {new_version:d}")
+            await conn.commit()
+        applied.append(new_version)
+    return applied
@@ -1,13 +1,59 @@
 from datetime import datetime
 from typing import Any, Optional
 
-from sqlalchemy import Column, DateTime, func, JSON, desc
+from sqlalchemy import (
+    JSON,
+    Column,
+    DateTime,
+    Index,
+    Row,
+    desc,
+    func,
+    text,
+    tuple_,
+)
+from sqlalchemy import select as core_select
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import selectinload
-from sqlmodel import Field, Relationship, SQLModel, select
+from sqlmodel import Field, Relationship, SQLModel, col, select
 
 from elia_chat.database.database import get_session
 
+# The number of characters of the first user message stored in `chat.preview`.
+CHAT_PREVIEW_LENGTH = 80
+
+# The number of most recent matching messages which are ranked by relevance.
+#
+# Ranking every match of a common word in a large history would take seconds, so
+# only the most recent matches are ranked. Finding them is cheap, since the
+# full-text index is ordered by message ID.
+SEARCH_CANDIDATES = 1000
+
+# Surround the matching terms in the snippets returned by searches.
+SEARCH_HIGHLIGHT_START = "\x02"
+SEARCH_HIGHLIGHT_END = "\x03"
+
+# The maximum number of words in the snippets returned by searches.
+SEARCH_SNIPPET_TOKENS = 16
+
+
+def search_match_expression(query: str) -> str | None:
+    """Convert a search typed by the user into an FTS5 query.
+
+    Every word must match, as a prefix of a word in the text, so results
+    appear while the user is still typing. Returns None if there's nothing
+    to search for.
+    """
+    terms = []
+    for word in query.split():
+        term = '"' + word.replace('"', '""') + '"'
+        # Single character prefixes match too much to be useful (and aren't
+        # covered by the prefix index).
+        if len(word) > 1:
+            term += "*"
+        terms.append(term)
+    return " ".join(terms) or None
+
 
 class SystemPromptsDao(AsyncAttrs, SQLModel, table=True):
     __tablename__ = "system_prompt"
@@ -24,16 +70,16 @@ class MessageDao(AsyncAttrs, SQLModel, table=True):
     __tablename__ = "message"
 
     id: int | None = Field(default=None, primary_key=True)
-    chat_id: Optional[int] = Field(foreign_key="chat.id")
+    chat_id: Optional[int] = Field(foreign_key="chat.id", index=True)
     chat: Optional["ChatDao"] = Relationship(back_populates="messages")
     role: str
     content: str
     timestamp: datetime | None = Field(
-        sa_column=Column(DateTime(), server_default=func.now())
+        sa_column=Column(DateTime(), server_default=func.now(), index=True)
     )
     meta: dict[Any, Any] = Field(sa_column=Column(JSON), default={})
     parent_id: Optional[int] = Field(
-        foreign_key="message.id", default=None, nullable=True
+        foreign_key="message.id", default=None, nullable=True, index=True
     )
     parent: Optional["MessageDao"] = Relationship(
         back_populates="replies",
@@ -47,9 +93,70 @@ class MessageDao(AsyncAttrs, SQLModel, table=True):
     model: str | None
     """The model that wrote this response. (Could switch models mid-chat, possibly)"""
 
+    @staticmethod
+    async def search(query: str, limit: int) -> list[Row[Any]]:
+        """Return a row per message which matches a search, most relevant first.
+
+        Messages in archived chats and system prompts are excluded. Each row
+        contains the IDs of the message and its chat, the role and timestamp
+        of the message, the title and preview of the chat, and a snippet of
+        the message with the matching terms highlighted.
+
+        Args:
+            query: The search, as typed by the user.
+            limit: The maximum number of rows to return.
+        """
+        match = search_match_expression(query)
+        if match is None:
+            return []
+        statement = text("""
+            WITH recent AS (
+                SELECT rowid FROM message_fts WHERE message_fts MATCH :match
+                ORDER BY rowid DESC LIMIT :candidates
+            )
+            SELECT
+                message.id AS message_id,
+                message.chat_id,
+                message.role,
+                message.timestamp,
+                chat.title AS chat_title,
+                chat.preview AS chat_preview,
+                snippet(message_fts, 0, :start, :end, '…', :tokens) AS snippet
+            FROM message_fts
+            JOIN message ON message.id = message_fts.rowid
+            JOIN chat ON chat.id = message.chat_id
+            WHERE message_fts MATCH :match
+                AND message_fts.rowid >= (SELECT min(rowid) FROM recent)
+                AND message.role != 'system'
+                AND NOT chat.archived
+            ORDER BY message_fts.rank
+            LIMIT :limit
+        """).columns(timestamp=DateTime())
+        async with get_session() as session:
+            result = await session.execute(
+                statement,
+                {
+                    "match": match,
+                    "candidates": SEARCH_CANDIDATES,
+                    "start": SEARCH_HIGHLIGHT_START,
+                    "end": SEARCH_HIGHLIGHT_END,
+                    "tokens": SEARCH_SNIPPET_TOKENS,
+                    "limit": limit,
+                },
+            )
+            return list(result)
+
 
 class ChatDao(AsyncAttrs, SQLModel, table=True):
     __tablename__ = "chat"
+    __table_args__ = (
+        Index(
+            "ix_chat_archived_last_message_at",
+            "archived",
+            text("last_message_at DESC"),
+        ),
+        Index("ix_chat_source_id", text("json_extract(meta, '$.source_id')")),
+    )
 
     id: int = Field(default=None, primary_key=True)
     model: str
@@ -59,28 +166,134 @@ class ChatDao(AsyncAttrs, SQLModel, table=True):
     )
     messages: list[MessageDao] = Relationship(back_populates="chat")
     archived: bool = Field(default=False)
+    last_message_at: datetime | None = Field(
+        default=None, sa_column=Column(DateTime(), nullable=True)
+    )
+    """The timestamp of the most recent message in the chat.
+
+    This, `message_count` and `preview` are denormalised from the `message` table
+    so that chats can be listed without touching it. They must be kept up to date
+    whenever a message is added to the chat (see `record_message`)."""
+    message_count: int = Field(default=0)
+    """The number of messages in the chat, including the system prompt."""
+    preview: str = Field(default="")
+    """The first `CHAT_PREVIEW_LENGTH` characters of the first user message."""
+    meta: dict[Any, Any] | None = Field(sa_column=Column(JSON), default={})
+    """Metadata about the chat.
+
+    Chats imported from elsewhere have a `source_id` identifying the original,
+    so that importing it again doesn't duplicate it (see `import_chatgpt`)."""
+
+    def record_message(self, message: MessageDao) -> None:
+        """Update the denormalised metadata of this chat to account for a
+        message which has been added to it.
+
+        Args:
+            message: The message that was added to the chat.
+        """
+        self.message_count = (self.message_count or 0) + 1
+        timestamp = message.timestamp
+        if timestamp is not None:
+            last_message_at = self.last_message_at
+            if last_message_at is None or timestamp.replace(
+                tzinfo=None
+            ) >= last_message_at.replace(tzinfo=None):
+                self.last_message_at = timestamp
+        if not self.preview and message.role == "user":
+            self.preview = message.content[:CHAT_PREVIEW_LENGTH]
 
     @staticmethod
-    async def all() -> list["ChatDao"]:
+    async def summaries(
+        limit: int | None = None,
+        after: tuple[datetime, int] | None = None,
+    ) -> list[Row[Any]]:
+        """Return a row per unarchived chat, containing only the columns
+        required to list it, most recently active first.
+
+        This reads only the `chat` table, using the index on
+        `(archived, last_message_at DESC)`, and no messages are loaded.
+
+        Args:
+            limit: The maximum number of rows to return.
+            after: The `(last_message_at, id)` of the last row of the previous
+                page. Only rows which sort after it are returned.
+        """
         async with get_session() as session:
-            # Create a subquery that finds the maximum
-            # (most recent) timestamp for each chat.
-            max_timestamp: Any = func.max(MessageDao.timestamp).label("max_timestamp")
-            subquery = (
-                select(MessageDao.chat_id, max_timestamp)
-                .group_by(MessageDao.chat_id)
-                .alias("subquery")
+            # A Core select, as the columns are returned as rows rather than
+            # as a model.
+            statement = (
+                core_select(
+                    col(ChatDao.id),
+                    col(ChatDao.model),
+                    col(ChatDao.title),
+                    col(ChatDao.preview),
+                    col(ChatDao.message_count),
+                    col(ChatDao.last_message_at),
+                )
+                .where(col(ChatDao.archived) == False)  # noqa: E712
+                .where(col(ChatDao.last_message_at) != None)  # noqa: E711
+                .order_by(desc(col(ChatDao.last_message_at)), desc(col(ChatDao.id)))
             )
+            if after is not None:
+                last_message_at, chat_id = after
+                statement = statement.where(
+                    tuple_(ChatDao.last_message_at, ChatDao.id)
+                    < tuple_(last_message_at, chat_id)
+                )
+            if limit is not None:
+                statement = statement.limit(limit)
+            results = await session.execute(statement)
+            return list(results)
 
+    @staticmethod
+    async def count() -> int:
+        """Return the number of unarchived chats, without reading any rows."""
+        async with get_session() as session:
             statement = (
-                select(ChatDao)
-                .join(subquery, subquery.c.chat_id == ChatDao.id)
+                select(func.count())
+                .select_from(ChatDao)
                 .where(ChatDao.archived == False)  # noqa: E712
-                .order_by(desc(subquery.c.max_timestamp))
-                .options(selectinload(ChatDao.messages))
+                .where(ChatDao.last_message_at != None)  # noqa: E711
             )
-            results = await session.exec(statement)
-            return list(results)
+            result = await session.exec(statement)
+            return result.one()
+
+    @staticmethod
+    async def search_titles(query: str, limit: int) -> list[Row[Any]]:
+        """Return a row per unarchived chat whose title matches a search,
+        most relevant first.
+
+        Args:
+            query: The search, as typed by the user.
+            limit: The maximum number of rows to return.
+        """
+        match = search_match_expression(query)
+        if match is None:
+            return []
+        statement = text("""
+            SELECT
+                chat.id AS chat_id,
+                chat.title AS chat_title,
+                chat.preview AS chat_preview,
+                chat.last_message_at AS timestamp,
+                highlight(chat_fts, 0, :start, :end) AS snippet
+            FROM chat_fts
+            JOIN chat ON chat.id = chat_fts.rowid
+            WHERE chat_fts MATCH :match AND NOT chat.archived
+            ORDER BY chat_fts.rank
+            LIMIT :limit
+        """).columns(timestamp=DateTime())
+        async with get_session() as session:
+            result = await session.execute(
+                statement,
+                {
+                    "match": match,
+                    "start": SEARCH_HIGHLIGHT_START,
+                    "end": SEARCH_HIGHLIGHT_END,
+                    "limit": limit,
+                },
+            )
+            return list(result)
 
     @staticmethod
     async def from_id(chat_id: int) -> "ChatDao":
@@ -92,11 +305,3 @@ class ChatDao(AsyncAttrs, SQLModel, table=True):
             )
             result = await session.exec(statement)
             return result.one()
-
-    @staticmethod
-    async def rename_chat(chat_id: int, new_title: str) -> None:
-        async with get_session() as session:
-            chat = await ChatDao.from_id(chat_id)
-            chat.title = new_title
-            session.add(chat)
-            await session.commit()
@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import sys
+from dataclasses import dataclass, field
 from datetime import UTC, datetime
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, cast
 
 
 from elia_chat.config import LaunchConfig, EliaChatModel
@@ -13,34 +14,131 @@ if TYPE_CHECKING:
     from litellm.types.completion import ChatCompletionMessageParam
 
 
-class UnknownModel(EliaChatModel):
-    pass
-
-
 def get_model(
     model_id_or_name: str, config: LaunchConfig | None = None
 ) -> EliaChatModel:
     """Given the id or name of a model as a string, return the EliaChatModel.
 
-    Models are looked up by ID first.
+    Models are looked up by ID first. If there's no such model, the shared
+    `UNKNOWN_MODEL` is returned.
     """
     if config is None:
         config = active_app.get().launch_config
-    try:
-        return {model.id: model for model in config.all_models}[model_id_or_name]
-    except KeyError:
-        try:
-            return {model.name: model for model in config.all_models}[model_id_or_name]
-        except KeyError:
-            pass
-    return UnknownModel(id="unknown", name="unknown model")
+    return config.model_registry.get(model_id_or_name)
 
 
-@dataclass
+@dataclass(slots=True, init=False)
 class ChatMessage:
-    message: ChatCompletionMessageParam
+    """A message in a chat.
+
+    Chats can contain many thousands of messages, so messages are stored
+    compactly: the role (interned, so it's shared between messages) and the
+    content are held directly rather than in a dict per message, and the
+    metadata and streamed chunks are only allocated if they're used. The dict
+    sent to litellm is built by `message` when a request is made.
+    """
+
+    role: str
+    content: str | list[Any] | None
+    """The content of the message. Usually a string, but can be a list of
+    content parts (e.g. for images), or None if the message has no content.
+
+    If the message is streaming in, call `materialize_content` first."""
     timestamp: datetime | None
     model: EliaChatModel
+    id: int | None
+    """The ID of the message in the database, if it has been saved."""
+    _meta: dict[str, Any] | None
+    _extra: dict[str, Any] | None = field(repr=False)
+    """Any keys of the litellm message other than the role and content."""
+    _chunks: list[str] | None = field(repr=False, compare=False)
+    """Streamed chunks which haven't been joined into the content yet."""
+
+    def __init__(
+        self,
+        message: ChatCompletionMessageParam,
+        timestamp: datetime | None,
+        model: EliaChatModel,
+        id: int | None = None,
+        meta: dict[str, Any] | None = None,
+    ) -> None:
+        """
+        Args:
+            message: The message, in the form litellm expects.
+            timestamp: When the message was sent.
+            model: The model of the chat which the message belongs to.
+            id: The ID of the message in the database, if it has been saved.
+            meta: Metadata about the message (see `meta`).
+        """
+        self.role = sys.intern(message["role"])
+        self.content = message.get("content")  # type: ignore[assignment]
+        self.timestamp = timestamp
+        self.model = model
+        self.id = id
+        self._meta = meta or None
+        extra = {
+            key: value
+            for key, value in message.items()
+            if key != "role" and key != "content"
+        }
+        self._extra = extra or None
+        self._chunks = None
+
+    @property
+    def message(self) -> ChatCompletionMessageParam:
+        """The message in the form litellm expects.
+
+        A new dict is built on each access, so changes to it don't affect
+        this message.
+        """
+        message: dict[str, Any] = {"role": self.role, "content": self.content}
+        if self._extra:
+            message.update(self._extra)
+        return cast("ChatCompletionMessageParam", message)
+
+    @property
+    def meta(self) -> dict[str, Any]:
+        """Metadata about the message, e.g. `{"truncated": True}` if the response
+        was stopped before it was complete, or `{"in_progress": True}` while it's
+        still streaming in."""
+        if self._meta is None:
+            self._meta = {}
+        return self._meta
+
+    @property
+    def truncated(self) -> bool:
+        """True if this is a response which was stopped before it completed."""
+        return bool(self._meta and self._meta.get("truncated"))
+
+    @property
+    def interrupted(self) -> bool:
+        """True if this is a response which was cut short by Elia exiting."""
+        return bool(self._meta and self._meta.get("interrupted"))
+
+    def copy(self) -> ChatMessage:
+        """Return a copy of the message (with any streamed chunks joined into
+        its content), which doesn't share its metadata."""
+        self.materialize_content()
+        meta = dict(self._meta) if self._meta else None
+        return ChatMessage(self.message, self.timestamp, self.model, self.id, meta)
+
+    def append_content(self, chunk: str) -> None:
+        """Append a chunk of streamed text to the content of the message.
+
+        Appending doesn't copy the content, so it's constant time. The chunks
+        are joined into `content` by `materialize_content`, which must be
+        called before reading the content of a streaming message.
+        """
+        if self._chunks is None:
+            self._chunks = []
+        self._chunks.append(chunk)
+
+    def materialize_content(self) -> None:
+        """Join any appended chunks into `content`."""
+        if self._chunks:
+            content = self.content if isinstance(self.content, str) else ""
+            self.content = "".join([content, *self._chunks])
+            self._chunks.clear()
 
 
 @dataclass
@@ -50,21 +148,33 @@ class ChatData:
     title: str | None
     create_timestamp: datetime | None
     messages: list[ChatMessage]
+    """The loaded messages of the chat. The first is always the system prompt.
+
+    For long chats, only the most recent messages may have been loaded (see
+    `older_message_count`)."""
+    older_message_count: int = 0
+    """The number of messages between the system prompt and `messages[1]`
+    which haven't been loaded from the database yet."""
+    preview: str | None = None
+    """The start of the first user message, for when it hasn't been loaded."""
 
     @property
     def short_preview(self) -> str:
-        first_message = self.first_user_message.message
-
-        if "content" in first_message:
-            first_message = first_message["content"]
-            # We have content, but it's not guaranteed to be a string quite yet.
-            # In the case of tool calls or image generation requests, we can
-            # have non-string types here. We're not handling/considering this atm.
-            if first_message and isinstance(first_message, str):
-                if len(first_message) > 77:
-                    return first_message[:77] + "..."
-                else:
-                    return first_message
+        if self.preview is not None:
+            if len(self.preview) > 77:
+                return self.preview[:77] + "..."
+            return self.preview
+
+        first_message = self.first_user_message.content
+
+        # The content isn't guaranteed to be a string. In the case of tool calls
+        # or image generation requests, we can have non-string types here.
+        # We're not handling/considering this atm.
+        if first_message and isinstance(first_message, str):
+            if len(first_message) > 77:
+                return first_message[:77] + "..."
+            else:
+                return first_message
 
         return ""
 
@@ -82,7 +192,58 @@ class ChatData:
     ) -> list[ChatMessage]:
         return self.messages[1:]
 
+    @property
+    def message_count(self) -> int:
+        """The number of non-system messages, including those not loaded yet."""
+        return len(self.messages) - 1 + self.older_message_count
+
     @property
     def update_time(self) -> datetime:
         message_timestamp = self.messages[-1].timestamp
         return message_timestamp.astimezone().replace(tzinfo=UTC)
+
+
+@dataclass
+class ChatSummary:
+    """A lightweight view of a chat, containing only what's needed to list it.
+
+    Unlike ChatData, this doesn't hold the messages of the chat.
+    """
+
+    id: int
+    model: EliaChatModel
+    title: str | None
+    preview: str
+    """The (possibly truncated) content of the first user message."""
+    message_count: int
+    last_message_at: datetime | None
+
+    @property
+    def short_preview(self) -> str:
+        if len(self.preview) > 77:
+            return self.preview[:77] + "..."
+        return self.preview
+
+    @property
+    def update_time(self) -> datetime:
+        message_timestamp = self.last_message_at
+        if message_timestamp is None:
+            return datetime.now(UTC)
+        return message_timestamp.astimezone().replace(tzinfo=UTC)
+
+
+@dataclass
+class SearchResult:
+    """A message (or the title of a chat) which matched a search of the history."""
+
+    chat_id: int
+    chat_title: str | None
+    chat_preview: str
+    snippet: str
+    """The part of the message (or the title) which matched."""
+    highlights: list[tuple[int, int]]
+    """The `(start, end)` offsets of the matching terms within `snippet`."""
+    message_id: int | None = None
+    """The ID of the message which matched, or None if the chat's title matched."""
+    role: str | None = None
+    timestamp: datetime | None = None
@@ -40,7 +40,7 @@ class ChatDetails(ModalScreen[None]):
             vs.border_subtitle = "(read only)"
             with Horizontal():
                 with VerticalScroll(id="left"):
-                    content = chat.system_prompt.message.get("content", "")
+                    content = chat.system_prompt.content
                     if isinstance(content, str):
                         yield Label("System prompt", classes="heading")
                         yield Markdown(content)
@@ -91,4 +91,4 @@ class ChatDetails(ModalScreen[None]):
                     yield Rule()
 
                     yield Label("Message count", classes="heading")
-                    yield Label(str(len(chat.messages) - 1), classes="datum")
+                    yield Label(str(chat.message_count), classes="datum")
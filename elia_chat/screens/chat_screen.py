@@ -25,13 +25,15 @@ class ChatScreen(Screen[None]):
     def __init__(
         self,
         chat_data: ChatData,
+        focus_message_id: int | None = None,
     ):
         super().__init__()
         self.chat_data = chat_data
+        self.focus_message_id = focus_message_id
         self.chats_manager = ChatsManager()
 
     def compose(self) -> ComposeResult:
-        yield Chat(self.chat_data)
+        yield Chat(self.chat_data, self.focus_message_id)
         yield Footer()
 
     @on(Chat.NewUserMessage)
@@ -49,18 +51,18 @@ class ChatScreen(Screen[None]):
         response_status.set_agent_responding()
         response_status.display = True
 
+    @on(Chat.AgentResponseFailed)
+    def agent_response_failed(self) -> None:
+        """Allow the user to send messages again."""
+        self.query_one(ResponseStatus).display = False
+        self.query_one(Chat).allow_input_submit = True
+
     @on(Chat.AgentResponseComplete)
     async def agent_response_complete(self, event: Chat.AgentResponseComplete) -> None:
         """Allow the user to send messages again."""
         self.query_one(ResponseStatus).display = False
         self.query_one(Chat).allow_input_submit = True
+        # The message was saved as it streamed in (see Chat.stream_agent_response).
         log.debug(
-            f"Agent response complete. Adding message "
-            f"to chat_id {event.chat_id!r}: {event.message}"
-        )
-        if self.chat_data.id is None:
-            raise RuntimeError("Chat has no ID. This is likely a bug in Elia.")
-
-        await self.chats_manager.add_message_to_chat(
-            chat_id=self.chat_data.id, message=event.message
+            f"Agent response complete in chat_id {event.chat_id!r}: {event.message}"
         )
@@ -54,11 +54,21 @@ but if you just wish to scroll a little, you can use `shift+up` and `shift+down`
 ### The chat list
 
 - `up,down,k,j`: Navigate through chats.
-- `a`: Archive the highlighted chat.
+- `a`: Archive the marked chats, or the highlighted chat if none are marked.
+- `space`: Mark/unmark the highlighted chat.
+- `u`: Undo the last archive.
 - `pageup,pagedown`: Up/down a page.
 - `home,end`: Go to first/last chat.
 - `g,G`: Go to first/last chat.
 - `enter,l`: Open chat.
+- `/`: Search chats (`ctrl+s` also works from the home screen prompt).
+
+### Searching chats
+
+Press `ctrl+s` on the home screen to search the titles and messages of your chats.
+Results appear as you type, most relevant first.
+Press `down` to move to the results, and `enter` to open the chat at the
+matching message.
 
 ### The options window
 
@@ -126,6 +136,7 @@ You can use the arrow keys to move up and down through messages.
 
 - `ctrl+r`: Rename the chat (or click the chat title).
 - `f2`: View more information about the chat.
+- `ctrl+s`: Stop the agent's response. The text received so far is kept.
 
 _With a message focused_:
 
@@ -7,12 +7,15 @@ from textual.screen import Screen
 from textual.signal import Signal
 from textual.widgets import Footer
 
+from elia_chat import constants
 from elia_chat.runtime_config import RuntimeConfig
 from elia_chat.widgets.chat_list import ChatList
 from elia_chat.widgets.prompt_input import PromptInput
 from elia_chat.chats_manager import ChatsManager
 from elia_chat.widgets.app_header import AppHeader
+from elia_chat.models import SearchResult
 from elia_chat.screens.chat_screen import ChatScreen
+from elia_chat.screens.search_screen import SearchScreen
 from elia_chat.widgets.chat_options import OptionsModal
 from elia_chat.widgets.welcome import Welcome
 
@@ -51,6 +54,13 @@ ChatList {
             tooltip="Change the model, system prompt, and check where Elia"
             " is storing your data.",
         ),
+        Binding(
+            "ctrl+s",
+            "search",
+            "Search",
+            key_display="^s",
+            tooltip="Search the titles and messages of your chats.",
+        ),
     ]
 
     def __init__(
@@ -75,18 +85,33 @@ ChatList {
         yield Footer()
 
     @on(ScreenResume)
-    async def reload_screen(self) -> None:
-        chat_list = self.query_one(ChatList)
-        await chat_list.reload_and_refresh()
+    def reload_screen(self) -> None:
+        # The ChatList keeps itself up to date as chats change, so there's
+        # no need to reload it here.
         self.show_welcome_if_required()
 
     @on(ChatList.ChatOpened)
     async def open_chat_screen(self, event: ChatList.ChatOpened):
         chat_id = event.chat.id
         assert chat_id is not None
-        chat = await self.chats_manager.get_chat(chat_id)
+        chat = await self.chats_manager.get_chat_tail(
+            chat_id, constants.CHAT_HISTORY_PAGE_SIZE
+        )
         await self.app.push_screen(ChatScreen(chat))
 
+    async def open_search_result(self, result: SearchResult | None) -> None:
+        if result is None:
+            return
+        if result.message_id is None:
+            chat = await self.chats_manager.get_chat_tail(
+                result.chat_id, constants.CHAT_HISTORY_PAGE_SIZE
+            )
+        else:
+            chat = await self.chats_manager.get_chat_tail_including(
+                result.chat_id, result.message_id, constants.CHAT_HISTORY_PAGE_SIZE
+            )
+        await self.app.push_screen(ChatScreen(chat, result.message_id))
+
     @on(ChatList.CursorEscapingTop)
     def cursor_escaping_top(self):
         self.query_one(HomePromptInput).focus()
@@ -107,6 +132,9 @@ ChatList {
         prompt_input = self.query_one(PromptInput)
         prompt_input.action_submit_prompt()
 
+    async def action_search(self) -> None:
+        await self.app.push_screen(SearchScreen(), callback=self.open_search_result)
+
     async def action_options(self) -> None:
         await self.app.push_screen(
             OptionsModal(),
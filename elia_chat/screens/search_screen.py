@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+
+import humanize
+from rich.console import Console, ConsoleOptions, RenderResult
+from rich.padding import Padding
+from rich.text import Text
+from textual import on, work
+from textual.app import ComposeResult
+from textual.binding import Binding
+from textual.containers import Vertical
+from textual.screen import ModalScreen
+from textual.widgets import Footer, Input, OptionList
+from textual.widgets.option_list import Option
+
+from elia_chat import constants
+from elia_chat.chats_manager import ChatsManager
+from elia_chat.models import SearchResult
+
+
+class SearchResultRenderable:
+    def __init__(self, result: SearchResult) -> None:
+        self.result = result
+
+    def __rich_console__(
+        self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+        result = self.result
+        width = options.max_width - 1
+        preview = result.chat_preview.replace("\n", " ")
+        details = []
+        if result.role is not None:
+            details.append(result.role)
+        if result.timestamp is not None:
+            timestamp = result.timestamp.astimezone().replace(tzinfo=datetime.UTC)
+            now = datetime.datetime.now(datetime.UTC)
+            details.append(humanize.naturaltime(now - timestamp))
+
+        if result.message_id is None:
+            # The title of the chat matched.
+            heading = self._highlighted_snippet()
+            body = Text(preview, style="dim")
+        else:
+            heading = Text(result.chat_title or preview)
+            body = self._highlighted_snippet()
+        if details:
+            heading.append(f" · {' · '.join(details)}", style="dim")
+        heading.truncate(width, overflow="ellipsis")
+
+        lines = body.wrap(console, width)
+        body_lines = lines[:2]
+        if len(lines) > 2:
+            body_lines[1].truncate(width - 1)
+            body_lines[1].append("…")
+        yield Padding(Text("\n").join([heading, *body_lines]), pad=(0, 0, 0, 1))
+
+    def _highlighted_snippet(self) -> Text:
+        snippet = Text(self.result.snippet.replace("\n", " "), style="dim")
+        for start, end in self.result.highlights:
+            snippet.stylize("not dim bold underline", start, end)
+        return snippet
+
+
+class SearchResultItem(Option):
+    def __init__(self, result: SearchResult) -> None:
+        """
+        Args:
+            result: The search result associated with this option.
+        """
+        super().__init__(SearchResultRenderable(result))
+        self.result = result
+
+
+class SearchScreen(ModalScreen[SearchResult | None]):
+    """Searches the chat history as the user types.
+
+    Dismissed with the chosen result, or None if the search was cancelled.
+    """
+
+    BINDINGS = [
+        Binding("escape", "dismiss(None)", "Close search", key_display="esc"),
+        Binding("down", "focus_results", "Results", show=False),
+    ]
+
+    def compose(self) -> ComposeResult:
+        with Vertical() as container:
+            container.border_title = "Search chats"
+            search_input = Input(placeholder="Search titles and messages...")
+            search_input.border_subtitle = (
+                "[[white]enter[/]] Open  [[white]esc[/]] Cancel"
+            )
+            yield search_input
+            yield OptionList(id="search-results")
+        yield Footer()
+
+    @on(Input.Changed)
+    def search_changed(self, event: Input.Changed) -> None:
+        self.search(event.value)
+
+    @work(exclusive=True, group="search")
+    async def search(self, query: str) -> None:
+        """Show the results of a search.
+
+        Starting another search cancels this one, so while the user is typing
+        only the latest search is run.
+        """
+        await asyncio.sleep(constants.SEARCH_DEBOUNCE_SECS)
+        results = await ChatsManager.search(query, constants.SEARCH_RESULT_LIMIT)
+        result_list = self.query_one("#search-results", OptionList)
+        result_list.clear_options()
+        result_list.add_options(SearchResultItem(result) for result in results)
+        container = self.query_one(Vertical)
+        container.border_subtitle = f"{len(results)} results" if query.strip() else ""
+        if results:
+            result_list.highlighted = 0
+
+    @on(Input.Submitted)
+    def open_highlighted_result(self) -> None:
+        result_list = self.query_one("#search-results", OptionList)
+        if result_list.highlighted is not None:
+            result_list.action_select()
+
+    @on(OptionList.OptionSelected)
+    def open_result(self, event: OptionList.OptionSelected) -> None:
+        assert isinstance(event.option, SearchResultItem)
+        self.dismiss(event.option.result)
+
+    def action_focus_results(self) -> None:
+        self.query_one("#search-results", OptionList).focus()
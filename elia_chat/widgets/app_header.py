@@ -9,7 +9,6 @@ from textual.widgets import Label
 
 from rich.text import Text
 from elia_chat.config import EliaChatModel
-from elia_chat.models import get_model
 from elia_chat.runtime_config import RuntimeConfig
 
 
@@ -49,7 +48,7 @@ class AppHeader(Widget):
                 self.elia.runtime_config.selected_model.id
                 or self.elia.runtime_config.selected_model.name
             )
-            model = get_model(model_name_or_id, self.elia.launch_config)
+            model = self.elia.launch_config.model_registry.get(model_name_or_id)
             yield Label(self._get_selected_model_link_text(model), id="model-label")
 
     def _get_selected_model_link_text(self, model: EliaChatModel) -> str:
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import asyncio
 import datetime
+import importlib
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, cast
+from functools import partial
+from typing import TYPE_CHECKING, AsyncIterator, cast
 
 from textual.widgets import Label
 
@@ -10,24 +13,34 @@ from elia_chat import constants
 from textual import log, on, work, events
 from textual.app import ComposeResult
 from textual.binding import Binding
-from textual.containers import VerticalScroll
 from textual.css.query import NoMatches
 from textual.message import Message
 from textual.reactive import reactive
 from textual.widget import Widget
-
-from elia_chat.chats_manager import ChatsManager
+from textual.worker import Worker
+
+from elia_chat.chats_manager import (
+    AddMessage,
+    ChatsManager,
+    RenameChat,
+    UpdateMessage,
+)
 from elia_chat.models import ChatData, ChatMessage
 from elia_chat.screens.chat_details import ChatDetails
 from elia_chat.widgets.agent_is_typing import ResponseStatus
 from elia_chat.widgets.chat_header import ChatHeader, TitleStatic
+from elia_chat.widgets.chat_transcript import ChatTranscript
 from elia_chat.widgets.prompt_input import PromptInput
 from elia_chat.widgets.chatbox import Chatbox
+from elia_chat.widgets.stream_buffer import StreamBuffer
+from elia_chat.write_queue import ResponseCheckpoint
 
 
 if TYPE_CHECKING:
     from elia_chat.app import Elia
+    from litellm import CustomStreamWrapper
     from litellm.types.completion import (
+        ChatCompletionMessageParam,
         ChatCompletionUserMessageParam,
         ChatCompletionAssistantMessageParam,
     )
@@ -56,16 +69,32 @@ class Chat(Widget):
             show=False,
         ),
         Binding(key="f2", action="details", description="Chat info"),
+        Binding(
+            key="ctrl+s",
+            action="stop_response",
+            description="Stop response",
+            key_display="^s",
+        ),
     ]
 
     allow_input_submit = reactive(True)
     """Used to lock the chat input while the agent is responding."""
 
-    def __init__(self, chat_data: ChatData) -> None:
+    def __init__(
+        self, chat_data: ChatData, focus_message_id: int | None = None
+    ) -> None:
+        """
+        Args:
+            chat_data: The chat to show.
+            focus_message_id: The ID of a message to focus once the chat has
+                loaded, rather than scrolling to the end.
+        """
         super().__init__()
         self.chat_data = chat_data
+        self.focus_message_id = focus_message_id
         self.elia = cast("Elia", self.app)
         self.model = chat_data.model
+        self._loading_older_messages = False
 
     @dataclass
     class AgentResponseStarted(Message):
@@ -75,7 +104,6 @@ class Chat(Widget):
     class AgentResponseComplete(Message):
         chat_id: int | None
         message: ChatMessage
-        chatbox: Chatbox
 
     @dataclass
     class AgentResponseFailed(Message):
@@ -92,8 +120,8 @@ class Chat(Widget):
         yield ResponseStatus()
         yield ChatHeader(chat=self.chat_data, model=self.model)
 
-        with VerticalScroll(id="chat-container") as vertical_scroll:
-            vertical_scroll.can_focus = False
+        with ChatTranscript(self.chat_data.model, id="chat-container") as transcript:
+            transcript.can_focus = False
 
         yield ChatPromptInput(id="prompt")
 
@@ -104,8 +132,8 @@ class Chat(Widget):
         await self.load_chat(self.chat_data)
 
     @property
-    def chat_container(self) -> VerticalScroll:
-        return self.query_one("#chat-container", VerticalScroll)
+    def chat_container(self) -> ChatTranscript:
+        return self.query_one("#chat-container", ChatTranscript)
 
     @property
     def is_empty(self) -> bool:
@@ -119,9 +147,11 @@ class Chat(Widget):
 
     @on(AgentResponseFailed)
     def restore_state_on_agent_failure(self, event: Chat.AgentResponseFailed) -> None:
-        original_prompt = event.last_message.message.get("content", "")
+        prompt = self.query_one(ChatPromptInput)
+        original_prompt = event.last_message.content
         if isinstance(original_prompt, str):
-            self.query_one(ChatPromptInput).text = original_prompt
+            prompt.text = original_prompt
+        prompt.submit_ready = True
 
     async def new_user_message(self, content: str) -> None:
         log.debug(f"User message submitted in chat {self.chat_data.id!r}: {content!r}")
@@ -134,54 +164,137 @@ class Chat(Widget):
 
         user_chat_message = ChatMessage(user_message, now_utc, self.chat_data.model)
         self.chat_data.messages.append(user_chat_message)
-        user_message_chatbox = Chatbox(user_chat_message, self.chat_data.model)
 
         assert (
             self.chat_container is not None
         ), "Textual has mounted container at this point in the lifecycle."
 
-        await self.chat_container.mount(user_message_chatbox)
+        await self.chat_container.append_message(user_chat_message)
 
         self.scroll_to_latest_message()
         self.post_message(self.NewUserMessage(content))
 
-        await ChatsManager.add_message_to_chat(
-            chat_id=self.chat_data.id, message=user_chat_message
-        )
+        chat_id = self.chat_data.id
+        if chat_id is None:
+            raise RuntimeError("Chat has no ID. This is likely a bug in Elia.")
+        self.elia.write_queue.put(AddMessage(chat_id, user_chat_message))
 
         prompt = self.query_one(ChatPromptInput)
         prompt.submit_ready = False
-        self.stream_agent_response()
+        self.stream_agent_response(await self.get_request_messages())
 
-    @work(thread=True, group="agent_response")
-    async def stream_agent_response(self) -> None:
+    async def get_request_messages(self) -> list[ChatCompletionMessageParam]:
+        """Return every message in the chat, ready to be sent to the model.
+
+        This includes older messages which haven't been loaded into the
+        transcript, which are read from the database.
+        """
+        messages = self.chat_data.messages
+        older_messages: list[ChatMessage] = []
+        first_loaded_id = messages[1].id if len(messages) > 1 else None
+        if (
+            self.chat_data.older_message_count
+            and self.chat_data.id is not None
+            and first_loaded_id is not None
+        ):
+            older_messages = await ChatsManager.get_messages_before(
+                self.chat_data.id, first_loaded_id
+            )
+        return [
+            message.message
+            for message in [messages[0], *older_messages, *messages[1:]]
+        ]
+
+    @on(ChatTranscript.NearTop)
+    def load_older_messages_near_top(self) -> None:
+        if self.chat_data.older_message_count and not self._loading_older_messages:
+            self._loading_older_messages = True
+            self.load_older_messages()
+
+    @work(group="load_older_messages")
+    async def load_older_messages(self) -> None:
+        """Load the page of messages preceding the oldest loaded message, and
+        add them to the start of the transcript."""
+        chat_id = self.chat_data.id
+        messages = self.chat_data.messages
+        if chat_id is None or len(messages) < 2 or messages[1].id is None:
+            self._loading_older_messages = False
+            return
+
+        try:
+            older_messages = await ChatsManager.get_messages_before(
+                chat_id, messages[1].id, limit=constants.CHAT_HISTORY_PAGE_SIZE
+            )
+        finally:
+            self._loading_older_messages = False
+        log.debug(f"Loaded {len(older_messages)} older messages in chat {chat_id}")
+        messages[1:1] = older_messages
+        if len(older_messages) < constants.CHAT_HISTORY_PAGE_SIZE:
+            self.chat_data.older_message_count = 0
+        else:
+            self.chat_data.older_message_count = max(
+                0, self.chat_data.older_message_count - len(older_messages)
+            )
+        self.chat_container.prepend_messages(older_messages)
+
+    @work(group="agent_response")
+    async def stream_agent_response(
+        self, raw_messages: list[ChatCompletionMessageParam]
+    ) -> None:
         model = self.chat_data.model
+        chat_id = self.chat_data.id
+        if chat_id is None:
+            raise RuntimeError("Chat has no ID. This is likely a bug in Elia.")
         log.debug(f"Creating streaming response with model {model.name!r}")
 
+        # Importing litellm is slow the first time, so do it off the event loop.
+        await asyncio.to_thread(importlib.import_module, "litellm")
         import litellm
-        from litellm import ModelResponse, acompletion
+        from litellm import acompletion
         from litellm.utils import trim_messages
 
-        raw_messages = [message.message for message in self.chat_data.messages]
-
-        messages: list[ChatCompletionUserMessageParam] = trim_messages(
-            raw_messages, model.name
-        )  # type: ignore
-
         litellm.organization = model.organization
         try:
-            response = await acompletion(
-                messages=messages,
-                stream=True,
-                model=model.name,
-                temperature=model.temperature,
-                max_retries=model.max_retries,
-                api_key=model.api_key.get_secret_value() if model.api_key else None,
-                api_base=model.api_base.unicode_string() if model.api_base else None,
+            # Trimming counts the tokens in every message, which is CPU-bound.
+            messages: list[ChatCompletionUserMessageParam] = await asyncio.to_thread(
+                trim_messages, raw_messages, model.name
+            )  # type: ignore
+            async with asyncio.timeout(constants.AGENT_RESPONSE_TIMEOUT_SECS):
+                response = await acompletion(
+                    messages=messages,
+                    stream=True,
+                    model=model.name,
+                    temperature=model.temperature,
+                    max_retries=model.max_retries,
+                    api_key=model.api_key.get_secret_value() if model.api_key else None,
+                    api_base=model.api_base.unicode_string()
+                    if model.api_base
+                    else None,
+                )
+        except asyncio.CancelledError:
+            # The response was stopped before it started. Save it as an empty,
+            # stopped response, so the prompt isn't sent again automatically
+            # when the chat is next opened.
+            stopped: ChatCompletionAssistantMessageParam = {
+                "content": "",
+                "role": "assistant",
+            }
+            message = ChatMessage(
+                message=stopped,
+                model=model,
+                timestamp=datetime.datetime.now(datetime.timezone.utc),
+                meta={"truncated": True},
             )
+            self.post_message(self.AgentResponseStarted())
+            await self.chat_container.append_message(message)
+            self.elia.write_queue.put(AddMessage(chat_id, message))
+            self.post_message(
+                self.AgentResponseComplete(chat_id=self.chat_data.id, message=message)
+            )
+            raise
         except Exception as exception:
             self.app.notify(
-                f"{exception}",
+                f"{exception}" or "Timed out waiting for a response.",
                 title="Error",
                 severity="error",
                 timeout=constants.ERROR_NOTIFY_TIMEOUT_SECS,
@@ -196,41 +309,42 @@ class Chat(Widget):
         now = datetime.datetime.now(datetime.timezone.utc)
 
         message = ChatMessage(message=ai_message, model=model, timestamp=now)
-        response_chatbox = Chatbox(
-            message=message,
-            model=self.chat_data.model,
-            classes="response-in-progress",
-        )
         self.post_message(self.AgentResponseStarted())
-        self.app.call_from_thread(self.chat_container.mount, response_chatbox)
-
-        assert (
-            self.chat_container is not None
-        ), "Textual has mounted container at this point in the lifecycle."
+        await self.chat_container.append_message(message, in_progress=True)
+
+        # Save the response as it streams in, so it isn't lost if Elia exits.
+        checkpoint = ResponseCheckpoint(self.elia.write_queue, chat_id, message)
+        checkpoint.start()
+        checkpoint_timer = self.set_interval(
+            constants.RESPONSE_CHECKPOINT_INTERVAL_SECS,
+            checkpoint.save,
+            name="response-checkpoint",
+        )
 
+        # Chunks are coalesced and delivered to the UI at most once per frame.
+        stream_buffer = StreamBuffer(
+            self,
+            partial(self.chat_container.append_chunk, message),
+            fps=self.elia.launch_config.stream_fps,
+        )
+        stream_buffer.start()
         try:
-            chunk_count = 0
-            async for chunk in response:
-                chunk = cast(ModelResponse, chunk)
-                response_chatbox.border_title = "Agent is responding..."
-
-                chunk_content = chunk.choices[0].delta.content
-                if isinstance(chunk_content, str):
-                    self.app.call_from_thread(
-                        response_chatbox.append_chunk, chunk_content
-                    )
-                else:
-                    break
-
-                scroll_y = self.chat_container.scroll_y
-                max_scroll_y = self.chat_container.max_scroll_y
-                if scroll_y in range(max_scroll_y - 3, max_scroll_y + 1):
-                    self.app.call_from_thread(
-                        self.chat_container.scroll_end, animate=False
-                    )
-
-                chunk_count += 1
+            async for chunk_content in stream_response_text(response):
+                stream_buffer.write(chunk_content)
+        except asyncio.CancelledError:
+            # The response was stopped. Keep the text received so far, and
+            # unlock the prompt without waiting for the stream to close.
+            stream_buffer.stop()
+            message.materialize_content()
+            message.meta["truncated"] = True
+            checkpoint.finish()
+            self.post_message(
+                self.AgentResponseComplete(chat_id=self.chat_data.id, message=message)
+            )
+            raise
         except Exception:
+            stream_buffer.stop()
+            checkpoint.discard()
             self.notify(
                 "There was a problem using this model. "
                 "Please check your configuration file.",
@@ -240,13 +354,43 @@ class Chat(Widget):
             )
             self.post_message(self.AgentResponseFailed(self.chat_data.messages[-1]))
         else:
+            stream_buffer.stop()
+            message.materialize_content()
+            checkpoint.finish()
             self.post_message(
                 self.AgentResponseComplete(
                     chat_id=self.chat_data.id,
-                    message=response_chatbox.message,
-                    chatbox=response_chatbox,
+                    message=message,
                 )
             )
+        finally:
+            checkpoint_timer.stop()
+            # Closing the stream releases its connection immediately, rather
+            # than leaving the model generating a response nobody will read.
+            await close_response(response)
+
+    def action_stop_response(self) -> None:
+        """Stop the agent's response. The text received so far is kept."""
+        self.workers.cancel_group(self, "agent_response")
+
+    @property
+    def is_responding(self) -> bool:
+        """True if the agent is currently responding."""
+        return any(
+            worker.node is self and worker.group == "agent_response"
+            for worker in self.workers
+            if not worker.is_finished
+        )
+
+    def check_action(self, action: str, parameters: tuple[object, ...]) -> bool | None:
+        if action == "stop_response":
+            return self.is_responding
+        return True
+
+    @on(Worker.StateChanged)
+    def refresh_response_bindings(self, event: Worker.StateChanged) -> None:
+        if event.worker.group == "agent_response":
+            self.refresh_bindings()
 
     @on(AgentResponseFailed)
     @on(AgentResponseStarted)
@@ -265,8 +409,7 @@ class Chat(Widget):
     def agent_finished_responding(self, event: AgentResponseComplete) -> None:
         # Ensure the thread is updated with the message from the agent
         self.chat_data.messages.append(event.message)
-        event.chatbox.border_title = "Agent"
-        event.chatbox.remove_class("response-in-progress")
+        self.chat_container.complete_response(event.message)
         prompt = self.query_one(ChatPromptInput)
         prompt.submit_ready = True
 
@@ -282,7 +425,7 @@ class Chat(Widget):
     async def on_cursor_up_from_prompt(
         self, event: PromptInput.CursorEscapingTop
     ) -> None:
-        self.focus_latest_message()
+        await self.focus_latest_message()
 
     @on(Chatbox.CursorEscapingBottom)
     def move_focus_to_prompt(self) -> None:
@@ -294,29 +437,21 @@ class Chat(Widget):
             self.chat_data.title = event.new_title
             header = self.query_one(ChatHeader)
             header.update_header(self.chat_data, self.model)
-            await ChatsManager.rename_chat(event.chat_id, event.new_title)
+            self.elia.write_queue.put(RenameChat(event.chat_id, event.new_title))
 
-    def get_latest_chatbox(self) -> Chatbox:
-        return self.query(Chatbox).last()
-
-    def focus_latest_message(self) -> None:
-        try:
-            self.get_latest_chatbox().focus()
-        except NoMatches:
-            pass
+    async def focus_latest_message(self) -> None:
+        transcript = self.chat_container
+        await transcript.focus_message(len(transcript.messages) - 1)
 
     def action_rename(self) -> None:
         title_static = self.query_one(TitleStatic)
         title_static.begin_rename()
 
-    def action_focus_latest_message(self) -> None:
-        self.focus_latest_message()
+    async def action_focus_latest_message(self) -> None:
+        await self.focus_latest_message()
 
-    def action_focus_first_message(self) -> None:
-        try:
-            self.query(Chatbox).first().focus()
-        except NoMatches:
-            pass
+    async def action_focus_first_message(self) -> None:
+        await self.chat_container.focus_message(0)
 
     def action_scroll_container_up(self) -> None:
         if self.chat_container:
@@ -330,12 +465,19 @@ class Chat(Widget):
         await self.app.push_screen(ChatDetails(self.chat_data))
 
     async def load_chat(self, chat_data: ChatData) -> None:
-        chatboxes = [
-            Chatbox(chat_message, chat_data.model)
-            for chat_message in chat_data.non_system_messages
-        ]
-        await self.chat_container.mount_all(chatboxes)
+        messages = chat_data.messages
+        if messages and messages[-1].meta.get("in_progress"):
+            self.recover_interrupted_response(messages[-1])
+
+        await self.chat_container.set_messages(chat_data.non_system_messages)
         self.chat_container.scroll_end(animate=False, force=True)
+        message_ids = [message.id for message in chat_data.non_system_messages]
+        if self.focus_message_id in message_ids:
+            # After the screen has focused the prompt, which it does on mount.
+            self.call_after_refresh(
+                self.chat_container.focus_message,
+                message_ids.index(self.focus_message_id),
+            )
         chat_header = self.query_one(ChatHeader)
         chat_header.update_header(
             chat=chat_data,
@@ -343,12 +485,55 @@ class Chat(Widget):
         )
 
         # If the last message didn't receive a response, try again.
-        messages = chat_data.messages
-        if messages and messages[-1].message["role"] == "user":
+        if messages and messages[-1].role == "user":
             prompt = self.query_one(ChatPromptInput)
             prompt.submit_ready = False
-            self.stream_agent_response()
+            self.stream_agent_response(await self.get_request_messages())
+
+    def recover_interrupted_response(self, message: ChatMessage) -> None:
+        """Flag a response which was still streaming in when Elia last exited.
+
+        The text saved before then is kept, rather than sending the prompt again.
+        """
+        message.meta.pop("in_progress", None)
+        message.meta["truncated"] = True
+        message.meta["interrupted"] = True
+        self.elia.write_queue.put(UpdateMessage(message, meta=dict(message.meta)))
+        self.notify(
+            "Elia exited while the agent was responding. "
+            "The part of the response received before then has been kept.",
+            title="Response interrupted",
+            severity="warning",
+        )
 
-    def action_close(self) -> None:
+    async def action_close(self) -> None:
+        # Make sure the chat list on the home screen is up to date.
+        await self.elia.write_queue.flush()
         self.app.clear_notifications()
         self.app.pop_screen()
+
+
+async def stream_response_text(response: CustomStreamWrapper) -> AsyncIterator[str]:
+    """Yield the text content of each chunk of a streaming response.
+
+    Each chunk must arrive within `AGENT_RESPONSE_TIMEOUT_SECS`, otherwise
+    `TimeoutError` is raised.
+    """
+    chunks = aiter(response)
+    while True:
+        try:
+            async with asyncio.timeout(constants.AGENT_RESPONSE_TIMEOUT_SECS):
+                chunk = await anext(chunks)
+        except StopAsyncIteration:
+            return
+        chunk_content = chunk.choices[0].delta.content
+        if not isinstance(chunk_content, str):
+            return
+        yield chunk_content
+
+
+async def close_response(response: CustomStreamWrapper) -> None:
+    """Close a streaming response, releasing its connection."""
+    aclose = getattr(response, "aclose", None)
+    if aclose is not None:
+        await aclose()
@@ -2,29 +2,42 @@ from __future__ import annotations
 
 import datetime
 from dataclasses import dataclass
-from typing import Self, cast
+from typing import TYPE_CHECKING, Callable, Self, cast
 
 import humanize
 from rich.console import RenderResult, Console, ConsoleOptions
 from rich.markup import escape
 from rich.padding import Padding
 from rich.text import Text
-from textual import events, log, on
+from textual import events, log, on, work
 from textual.binding import Binding
 from textual.geometry import Region
 from textual.message import Message
 from textual.widgets import OptionList
 from textual.widgets.option_list import Option
 
-from elia_chat.chats_manager import ChatsManager
+from elia_chat.chats_manager import (
+    ArchiveChats,
+    ChatCreated,
+    ChatEvent,
+    ChatRenamed,
+    ChatsArchived,
+    ChatsDeleted,
+    ChatsManager,
+    MessageAppended,
+)
 from elia_chat.config import LaunchConfig
-from elia_chat.models import ChatData
+from elia_chat.models import ChatSummary
+
+if TYPE_CHECKING:
+    from elia_chat.app import Elia
 
 
 @dataclass
 class ChatListItemRenderable:
-    chat: ChatData
+    chat: ChatSummary
     config: LaunchConfig
+    marked: bool = False
 
     def __rich_console__(
         self, console: Console, options: ConsoleOptions
@@ -39,14 +52,15 @@ class ChatListItemRenderable:
             subtitle += f" [i]by[/] {escape(model.provider)}"
         model_text = Text.from_markup(subtitle)
         title = self.chat.title or self.chat.short_preview.replace("\n", " ")
+        marker = ("● ", "bold") if self.marked else ""
         yield Padding(
-            Text.assemble(title, "\n", model_text, "\n", time_ago_text),
+            Text.assemble(marker, title, "\n", model_text, "\n", time_ago_text),
             pad=(0, 0, 0, 1),
         )
 
 
 class ChatListItem(Option):
-    def __init__(self, chat: ChatData, config: LaunchConfig) -> None:
+    def __init__(self, chat: ChatSummary, config: LaunchConfig) -> None:
         """
         Args:
             chat: The chat associated with this option.
@@ -54,6 +68,14 @@ class ChatListItem(Option):
         super().__init__(ChatListItemRenderable(chat, config))
         self.chat = chat
         self.config = config
+        self.marked = False
+        self.measured: tuple[int, int] | None = None
+        """The width the item was last measured at, and its height at that width."""
+
+    def update_prompt(self) -> None:
+        """Render the item again, after its chat or `marked` has changed."""
+        self.set_prompt(ChatListItemRenderable(self.chat, self.config, self.marked))
+        self.measured = None
 
 
 class ChatList(OptionList):
@@ -70,9 +92,25 @@ class ChatList(OptionList):
             "archive_chat",
             "Archive chat",
             key_display="a",
-            tooltip="Archive the highlighted chat"
-            " (without deleting it from Elia's database).",
+            tooltip="Archive the marked chats, or the highlighted chat if none"
+            " are marked (without deleting them from Elia's database).",
+        ),
+        Binding(
+            "space",
+            "toggle_mark",
+            "Mark",
+            key_display="space",
+            tooltip="Mark or unmark the highlighted chat, to archive several"
+            " chats at once.",
         ),
+        Binding(
+            "u",
+            "undo_archive",
+            "Undo archive",
+            show=False,
+            tooltip="Unarchive the chats which were most recently archived.",
+        ),
+        Binding("slash", "screen.search", "Search", show=False),
         Binding("j,down", "cursor_down", "Down", show=False),
         Binding("k,up", "cursor_up", "Up", show=False),
         Binding("l,right,enter", "select", "Select", show=False),
@@ -84,7 +122,7 @@ class ChatList(OptionList):
 
     @dataclass
     class ChatOpened(Message):
-        chat: ChatData
+        chat: ChatSummary
 
     class CursorEscapingTop(Message):
         """Cursor attempting to move out-of-bounds at top of list."""
@@ -92,14 +130,36 @@ class ChatList(OptionList):
     class CursorEscapingBottom(Message):
         """Cursor attempting to move out-of-bounds at bottom of list."""
 
+    def __init__(
+        self,
+        name: str | None = None,
+        id: str | None = None,
+        classes: str | None = None,
+        disabled: bool = False,
+    ) -> None:
+        super().__init__(name=name, id=id, classes=classes, disabled=disabled)
+        self.options: list[ChatListItem] = []
+        self.total_chats = 0
+        """The number of chats in the history, including those not yet loaded."""
+        self._all_pages_loaded = False
+        self._loading_page = True
+        """True while a page is being loaded (or the list is being reloaded)."""
+        self._generation = 0
+        """Incremented on reload, so in-flight page loads know to discard results."""
+        self.marked: set[int] = set()
+        """The IDs of the marked chats, which are archived together."""
+        self._last_archived: tuple[int, ...] = ()
+        """The IDs of the chats which were most recently archived, for undo."""
+
     async def on_mount(self) -> None:
+        elia = cast("Elia", self.app)
+        elia.chat_event_signal.subscribe(self, self.apply_chat_event)
         await self.reload_and_refresh()
 
     @on(OptionList.OptionSelected)
-    async def post_chat_opened(self, event: OptionList.OptionSelected) -> None:
+    def post_chat_opened(self, event: OptionList.OptionSelected) -> None:
         assert isinstance(event.option, ChatListItem)
         chat = event.option.chat
-        await self.reload_and_refresh()
         self.post_message(ChatList.ChatOpened(chat=chat))
 
     @on(OptionList.OptionHighlighted)
@@ -110,17 +170,45 @@ class ChatList(OptionList):
         elif self.option_count > 0:
             self.highlighted = 0
 
+    @on(OptionList.OptionHighlighted)
+    def load_more_if_cursor_near_end(self) -> None:
+        if (
+            self.highlighted is not None
+            and self.highlighted >= self.option_count - self.page_size // 2
+        ):
+            self.load_next_page()
+
+    def watch_scroll_y(self, old_value: float, new_value: float) -> None:
+        super().watch_scroll_y(old_value, new_value)
+        if new_value >= self.max_scroll_y - self.scrollable_content_region.height:
+            self.load_next_page()
+
     def on_blur(self) -> None:
         self.border_subtitle = None
 
+    @property
+    def page_size(self) -> int:
+        """The number of chats to load at a time: roughly a screenful, with
+        some headroom so that scrolling doesn't immediately hit the end."""
+        return self.app.size.height // 3 + 10
+
     async def reload_and_refresh(self, new_highlighted: int = -1) -> None:
         """Reload the chats and refresh the widget. Can be used to
         update the ordering/previews/titles etc contained in the list.
 
+        Only the first page of chats (or as many as were already loaded, if
+        that's more) is loaded. The rest are loaded as the user scrolls.
+
         Args:
             new_highlighted: The index to highlight after refresh.
         """
-        self.options = await self.load_chat_list_items()
+        self._loading_page = True
+        self._generation += 1
+        limit = max(self.page_size, len(self.options))
+        self.total_chats = await ChatsManager.count_chats()
+        self.options = await self.load_chat_list_items(limit)
+        self._all_pages_loaded = len(self.options) < limit
+        self._loading_page = False
         old_highlighted = self.highlighted
         self.clear_options()
         self.add_options(self.options)
@@ -132,54 +220,250 @@ class ChatList(OptionList):
 
         self.refresh()
 
-    async def load_chat_list_items(self) -> list[ChatListItem]:
-        chats = await self.load_chats()
-        return [ChatListItem(chat, self.app.launch_config) for chat in chats]
+    @work(group="load-chat-page")
+    async def load_next_page(self) -> None:
+        """Load the next page of chats and append it to the list."""
+        if self._all_pages_loaded or self._loading_page:
+            return
+
+        self._loading_page = True
+        generation = self._generation
+        after = self.options[-1].chat if self.options else None
+        try:
+            items = await self.load_chat_list_items(self.page_size, after)
+        finally:
+            if generation == self._generation:
+                self._loading_page = False
 
-    async def load_chats(self) -> list[ChatData]:
-        all_chats = await ChatsManager.all_chats()
-        return all_chats
+        if generation != self._generation:
+            # The list was reloaded while we were loading, so this page is stale.
+            return
 
-    async def action_archive_chat(self) -> None:
+        log.debug(f"Loaded page of {len(items)} chats")
+        self._all_pages_loaded = len(items) < self.page_size
+        # A chat may have moved to the top of the list (e.g. via a new message)
+        # while this page was being loaded, so we may already have it.
+        loaded_ids = {item.chat.id for item in self.options}
+        items = [item for item in items if item.chat.id not in loaded_ids]
+        self.options.extend(items)
+        self.add_options(items)
+        self.border_subtitle = self.get_border_subtitle()
+
+    async def load_chat_list_items(
+        self, limit: int, after: ChatSummary | None = None
+    ) -> list[ChatListItem]:
+        chats = await self.load_chats(limit, after)
+        return [self._create_item(chat) for chat in chats]
+
+    async def load_chats(
+        self, limit: int, after: ChatSummary | None = None
+    ) -> list[ChatSummary]:
+        return await ChatsManager.list_summaries(limit=limit, after=after)
+
+    def action_toggle_mark(self) -> None:
         if self.highlighted is None:
             return
 
         item = cast(ChatListItem, self.get_option_at_index(self.highlighted))
-        self.options.pop(self.highlighted)
-        self.remove_option_at_index(self.highlighted)
+        item.marked = not item.marked
+        if item.marked:
+            self.marked.add(item.chat.id)
+        else:
+            self.marked.discard(item.chat.id)
+        index = self.highlighted
+        self._update_items(lambda: self._refresh_item(index))
+        if self.highlighted < self.option_count - 1:
+            self.action_cursor_down()
 
-        chat_id = item.chat.id
-        await ChatsManager.archive_chat(chat_id)
+    def action_archive_chat(self) -> None:
+        if self.marked:
+            chats = [item.chat for item in self.options if item.chat.id in self.marked]
+        elif self.highlighted is not None:
+            item = cast(ChatListItem, self.get_option_at_index(self.highlighted))
+            chats = [item.chat]
+        else:
+            return
 
-        self.border_title = self.get_border_title()
-        self.border_subtitle = self.get_border_subtitle()
-        self.app.notify(
-            item.chat.title or f"Chat [b]{chat_id!r}[/] archived.",
-            title="Chat archived",
-        )
-        self.refresh()
+        chat_ids = tuple(chat.id for chat in chats)
+
+        # Every chat is archived by the same UPDATE statement. The items are
+        # removed now, so that pressing the key again archives the next chat,
+        # rather than this one again. The total is updated once it's committed.
+        elia = cast("Elia", self.app)
+        elia.write_queue.put(ArchiveChats(chat_ids))
+        self.marked.clear()
+        self._update_items(lambda: self._remove_items(chat_ids))
+        self._last_archived = chat_ids
+
+        if len(chats) == 1:
+            chat = chats[0]
+            message = chat.title or f"Chat [b]{chat.id!r}[/] archived."
+            title = "Chat archived"
+        else:
+            message = f"{len(chats)} chats archived."
+            title = "Chats archived"
+        self.app.notify(f"{message}\nPress [b]u[/] to undo.", title=title)
+
+    def action_undo_archive(self) -> None:
+        if not self._last_archived:
+            return
+
+        elia = cast("Elia", self.app)
+        elia.write_queue.put(ArchiveChats(self._last_archived, archived=False))
+        self._last_archived = ()
 
     def get_border_title(self) -> str:
-        return f"History ({len(self.options)})"
+        if self.marked:
+            return f"History ({self.total_chats}, {len(self.marked)} marked)"
+        return f"History ({self.total_chats})"
 
     def get_border_subtitle(self) -> str:
         if self.highlighted is None:
             return ""
-        return f"{self.highlighted + 1} / {self.option_count}"
-
-    def create_chat(self, chat_data: ChatData) -> None:
-        new_chat_list_item = ChatListItem(chat_data, self.app.launch_config)
-        log.debug(f"Creating new chat {new_chat_list_item!r}")
-
-        option_list = self.query_one(OptionList)
-        self.options = [
-            new_chat_list_item,
-            *self.options,
-        ]
-        option_list.clear_options()
-        option_list.add_options(self.options)
-        option_list.highlighted = 0
-        self.refresh()
+        return f"{self.highlighted + 1} / {self.total_chats}"
+
+    def apply_chat_event(self, event: ChatEvent) -> None:
+        """Update the list in response to a change to the chat history.
+
+        Only the affected chat's item is created, updated or removed, and the
+        highlighted chat stays highlighted (at the same position on screen).
+
+        OptionList can only add options at the end, so a chat which moves to
+        (or is created at) the top of the list is put there by adding the
+        loaded items to it again. The items keep their measured heights, so
+        only the moved item is rendered to keep the highlighted chat in place.
+        """
+        match event:
+            case ChatCreated(chat):
+                self.create_chat(chat)
+            case MessageAppended(chat):
+                self._update_items(lambda: self._move_to_top(chat))
+            case ChatRenamed(chat_id, title):
+                self._update_items(lambda: self._rename(chat_id, title))
+            case ChatsArchived(chat_ids, archived=True, changed_count=count) | (
+                ChatsDeleted(chat_ids, unarchived_count=count)
+            ):
+                self._update_items(lambda: self._remove_chats(chat_ids, count))
+            case ChatsArchived(archived=False):
+                # We don't know where unarchived chats belong among those which
+                # aren't loaded, so reload the list.
+                self.call_later(self.reload_and_refresh)
+
+    def create_chat(self, chat_summary: ChatSummary) -> None:
+        log.debug(f"Creating new chat {chat_summary!r}")
+
+        def insert_chat() -> None:
+            if self._index_of(chat_summary.id) is None:
+                self._insert_item(0, self._create_item(chat_summary))
+                self.total_chats += 1
+
+        self._update_items(insert_chat)
+
+    def _index_of(self, chat_id: int) -> int | None:
+        for index, item in enumerate(self.options):
+            if item.chat.id == chat_id:
+                return index
+        return None
+
+    def _insert_item(self, index: int, item: ChatListItem) -> None:
+        self.options.insert(index, item)
+        if index == len(self.options) - 1:
+            self.add_option(item)
+        else:
+            # OptionList can only append, so the options are added again in order.
+            self.clear_options()
+            self.add_options(self.options)
+
+    def _remove_item(self, index: int) -> None:
+        del self.options[index]
+        self.remove_option_at_index(index)
+
+    def _refresh_item(self, index: int) -> None:
+        item = self.options[index]
+        item.update_prompt()
+        self.replace_option_prompt_at_index(index, item.prompt)
+
+    def _move_to_top(self, chat: ChatSummary) -> None:
+        index = self._index_of(chat.id)
+        if index is None:
+            # The chat wasn't loaded yet, but it belongs at the top now.
+            self._insert_item(0, self._create_item(chat))
+            return
+
+        item = self.options[index]
+        item.chat = chat
+        if index == 0:
+            # E.g. a message was sent in the most recently active chat.
+            self._refresh_item(0)
+        else:
+            item.update_prompt()
+            del self.options[index]
+            self._insert_item(0, item)
+
+    def _rename(self, chat_id: int, title: str) -> None:
+        index = self._index_of(chat_id)
+        if index is not None:
+            self.options[index].chat.title = title
+            self._refresh_item(index)
+
+    def _remove_chats(self, chat_ids: tuple[int, ...], listed_count: int) -> None:
+        # Only chats which were counted in the total (i.e. unarchived ones,
+        # whether or not they're loaded yet) are subtracted from it.
+        self.total_chats -= listed_count
+        self._remove_items(chat_ids)
+
+    def _remove_items(self, chat_ids: tuple[int, ...]) -> None:
+        removed = set(chat_ids)
+        self.marked -= removed
+        for index in reversed(range(len(self.options))):
+            if self.options[index].chat.id in removed:
+                self._remove_item(index)
+
+    def _create_item(self, chat: ChatSummary) -> ChatListItem:
+        item = ChatListItem(chat, self.app.launch_config)
+        if chat.id in self.marked:
+            item.marked = True
+            item.update_prompt()
+        return item
+
+    def _item_height(self, item: ChatListItem) -> int:
+        """The number of lines the item takes up in the list."""
+        width = self.scrollable_content_region.width
+        if item.measured is None or item.measured[0] != width:
+            padding = self.get_component_styles("option-list--option").padding
+            console = self.app.console
+            options = console.options.update_width(width)
+            lines = console.render_lines(Padding(item.prompt, padding), options)
+            item.measured = (width, len(lines))
+        return item.measured[1]
+
+    def _offset_of(self, index: int) -> int:
+        """The line in the list at which the item at the given index starts."""
+        return sum(self._item_height(item) for item in self.options[:index])
+
+    def _update_items(self, update: Callable[[], None]) -> None:
+        """Apply an update to the loaded items, keeping the highlighted chat
+        highlighted and at the same position on screen, where possible."""
+        highlighted = self.highlighted
+        highlighted_chat_id: int | None = None
+        screen_offset = 0.0
+        if highlighted is not None:
+            highlighted_chat_id = self.options[highlighted].chat.id
+            screen_offset = self._offset_of(highlighted) - self.scroll_y
+
+        update()
+
+        if highlighted_chat_id is not None:
+            new_highlighted = self._index_of(highlighted_chat_id)
+            if new_highlighted is None:
+                # The highlighted chat was removed, so highlight its neighbour.
+                new_highlighted = highlighted
+            self.highlighted = new_highlighted
+            if self.highlighted is not None:
+                top = self._offset_of(self.highlighted) - screen_offset
+                self.scroll_to(y=top, animate=False, force=True)
+        self.border_title = self.get_border_title()
+        self.border_subtitle = self.get_border_subtitle()
 
     def action_cursor_up(self) -> None:
         if self.highlighted == 0:
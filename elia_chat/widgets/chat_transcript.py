@@ -0,0 +1,590 @@
+"""A scrollable chat transcript which only mounts the messages near the viewport.
+
+Chats can contain thousands of messages. Mounting a Chatbox for each of them
+makes long chats slow to open and expensive to keep open, so the transcript
+mounts a window of Chatboxes covering the viewport (plus some overscan), and
+represents everything above and below the window with a spacer whose height
+is the estimated (or previously measured) height of the messages it replaces.
+
+Rendering large messages (Markdown, and especially highlighted code) is slow,
+so when messages are loaded they're pre-rendered into the app's render cache
+in a thread pool, nearest the viewport first. Until a message has been
+rendered, its Chatbox shows its plain text.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+from dataclasses import dataclass
+from itertools import accumulate
+from math import ceil
+from typing import TYPE_CHECKING, Awaitable, Hashable, cast
+
+from rich.cells import cell_len
+from rich.segment import Segment
+from textual import on, work
+from textual.await_complete import AwaitComplete
+from textual.containers import VerticalScroll
+from textual.message import Message
+from textual.widget import Widget
+
+from elia_chat import constants
+from elia_chat.config import EliaChatModel
+from elia_chat.models import ChatMessage
+from elia_chat.widgets.chatbox import (
+    Chatbox,
+    cached_message_renderable,
+    measure_message,
+)
+
+if TYPE_CHECKING:
+    from elia_chat.app import Elia
+
+
+def _wrapped_line_count(cells: int, width: int) -> int:
+    """The number of lines a line of text of the given cell length wraps to."""
+    return max(1, ceil(cells / width))
+
+
+@dataclass
+class _StreamedLineCount:
+    """A running count of the lines of a message which is being streamed in."""
+
+    message: ChatMessage
+    width: int
+    """The width the lines are wrapped to."""
+    complete_lines: int = 0
+    """The number of lines the complete (newline-terminated) lines wrap to."""
+    last_line_cells: int = 0
+    """The cell length of the incomplete last line."""
+
+    def append(self, text: str) -> None:
+        *complete, last = text.split("\n")
+        for line in complete:
+            cells = self.last_line_cells + cell_len(line)
+            self.complete_lines += _wrapped_line_count(cells, self.width)
+            self.last_line_cells = 0
+        self.last_line_cells += cell_len(last)
+
+    @property
+    def lines(self) -> int:
+        if not self.last_line_cells:
+            return self.complete_lines
+        return self.complete_lines + _wrapped_line_count(
+            self.last_line_cells, self.width
+        )
+
+
+class TranscriptSpacer(Widget):
+    """Takes up the space of the messages which aren't mounted."""
+
+    DEFAULT_CSS = """
+    TranscriptSpacer {
+        height: 0;
+    }
+    """
+
+
+class ChatTranscript(VerticalScroll):
+    OVERSCAN = 4
+    """The number of messages to mount above and below the viewport."""
+
+    CHATBOX_CHROME_WIDTH = 9
+    """The horizontal space taken up by the margin, border and padding of a
+    Chatbox, and the scrollbar of the transcript."""
+
+    CHATBOX_CHROME_HEIGHT = 2
+    """The vertical space taken up by the border of a Chatbox."""
+
+    CHATBOX_GUTTER_WIDTH = 8
+    """The horizontal space taken up by the margin, border and padding of a
+    Chatbox, i.e. the width of its content is the width of the transcript
+    content minus this."""
+
+    CHATBOX_MIN_CONTENT_WIDTH = 6
+    """The width of the content of a Chatbox at its minimum width."""
+
+    class NearTop(Message):
+        """Sent when the user scrolls (or moves focus) close to the first
+        message, so that older messages can be loaded and prepended."""
+
+    def __init__(
+        self,
+        model: EliaChatModel,
+        name: str | None = None,
+        id: str | None = None,
+        classes: str | None = None,
+        disabled: bool = False,
+    ) -> None:
+        super().__init__(name=name, id=id, classes=classes, disabled=disabled)
+        self.model = model
+        self.messages: list[ChatMessage] = []
+        """Every message in the transcript, mounted or not."""
+        self._heights: list[int] = []
+        """The height of each message. Estimated until the message is mounted
+        and measured."""
+        self._start = 0
+        self._end = 0
+        """The messages in the range [_start, _end) are currently mounted."""
+        self._chatboxes: list[Chatbox] = []
+        """The mounted Chatboxes, corresponding to messages[_start:_end]."""
+        self._in_progress: ChatMessage | None = None
+        """The message currently being streamed in from the agent, if any."""
+        self._streamed_lines: _StreamedLineCount | None = None
+        """The lines of the streamed message, counted as chunks arrive while
+        its Chatbox isn't mounted, so the content isn't joined for each chunk."""
+        self._top_spacer = TranscriptSpacer()
+        self._bottom_spacer = TranscriptSpacer()
+        self._update_scheduled = False
+        self._prepended_count = 0
+        """The total number of messages prepended, used to correct message
+        indices which were captured before a prepend."""
+        self._prepend_pending = False
+        """True from prepending messages until the scroll position has been
+        corrected for them."""
+        self._at_end = True
+        """True if the user has scrolled to the end of the transcript, in which
+        case the end is kept in view as the content grows."""
+        self._jumping = False
+        """True while the transcript is scrolling itself (rather than being
+        scrolled by the user)."""
+        self._unrendered: dict[int, ChatMessage] = {}
+        """Messages waiting to be pre-rendered, keyed by their position.
+
+        The position of a message is its index minus `_prepended_count`, so it
+        doesn't change when messages are prepended."""
+        self._unrendered_positions: list[int] = []
+        """The keys of `_unrendered`, in order."""
+        self._rendering: set[int] = set()
+        """The positions of the messages currently being pre-rendered."""
+        self._prerendering = False
+
+    def compose(self):
+        yield self._top_spacer
+        yield self._bottom_spacer
+
+    @property
+    def chatboxes(self) -> list[Chatbox]:
+        """The Chatboxes which are currently mounted."""
+        return list(self._chatboxes)
+
+    def get_chatbox(self, message: ChatMessage) -> Chatbox | None:
+        """Return the Chatbox for a message, if it's currently mounted."""
+        for chatbox in self._chatboxes:
+            if chatbox.message is message:
+                return chatbox
+        return None
+
+    def set_messages(self, messages: list[ChatMessage]) -> AwaitComplete:
+        """Replace the content of the transcript, and show the latest messages."""
+        self.messages = list(messages)
+        self._heights = [self._estimate_height(message) for message in messages]
+        self._unrendered.clear()
+        self._unrendered_positions.clear()
+        self._queue_prerender(0, len(messages))
+        return self._set_window(*self._window_for(self._total_height()))
+
+    def append_message(
+        self, message: ChatMessage, in_progress: bool = False
+    ) -> AwaitComplete:
+        """Add a message to the end of the transcript.
+
+        Args:
+            message: The message to add.
+            in_progress: True if the message is a response which is still being
+                streamed in, and will have chunks appended to it.
+        """
+        if in_progress:
+            self._in_progress = message
+        window_at_end = self._end == len(self.messages)
+        self.messages.append(message)
+        self._heights.append(self._estimate_height(message))
+        if window_at_end:
+            return self._set_window(self._start, len(self.messages))
+        else:
+            # The user has scrolled away from the end, so leave the window where
+            # it is and let the message be mounted if they scroll down to it.
+            self._update_spacers()
+            return AwaitComplete()
+
+    def prepend_messages(self, messages: list[ChatMessage]) -> None:
+        """Add older messages to the start of the transcript, without moving
+        the content the user is currently looking at."""
+        if not messages:
+            return
+        anchor, anchor_delta, at_bottom = self._scroll_anchor(self._end)
+        self.messages[:0] = messages
+        self._heights[:0] = [self._estimate_height(message) for message in messages]
+        self._start += len(messages)
+        self._end += len(messages)
+        self._prepended_count += len(messages)
+        self._prepend_pending = True
+        self._queue_prerender(0, len(messages))
+        self._update_spacers()
+        # The top spacer grows by the height of the new messages, so scroll down
+        # by the same amount once the new height has been applied.
+        self.call_after_refresh(
+            self._restore_prepended_scroll,
+            anchor + len(messages),
+            anchor_delta,
+            at_bottom,
+        )
+
+    def _restore_prepended_scroll(
+        self, anchor: int, anchor_delta: float, at_bottom: bool
+    ) -> None:
+        self._prepend_pending = False
+        self._restore_scroll(anchor, anchor_delta, at_bottom, self._prepended_count)
+        self._schedule_update()
+
+    def _queue_prerender(self, start: int, end: int) -> None:
+        """Pre-render messages[start:end] in the background (once the
+        transcript has been laid out, and its width is known)."""
+        for index in range(start, end):
+            message = self.messages[index]
+            position = index - self._prepended_count
+            if message is not self._in_progress and position not in self._unrendered:
+                self._unrendered[position] = message
+                bisect.insort(self._unrendered_positions, position)
+        if self._unrendered and not self._prerendering:
+            self._prerendering = True
+            self.call_after_refresh(self._prerender_messages)
+
+    @work(group="prerender")
+    async def _prerender_messages(self) -> None:
+        """Render messages into the render cache in the thread pool.
+
+        The messages nearest the viewport are rendered first. The choice of
+        which message to render next is made as each thread becomes free, so
+        the order follows the viewport if the user scrolls in the meantime.
+        """
+        app = cast("Elia", self.app)
+        cache = app.render_cache
+        loop = asyncio.get_running_loop()
+        running: dict[
+            asyncio.Future[list[Segment]], tuple[int, ChatMessage, Hashable]
+        ]
+        running = {}
+        try:
+            while self._unrendered or running:
+                while self._unrendered and len(running) < constants.PRERENDER_THREADS:
+                    position = self._nearest_unrendered()
+                    message = self._unrendered.pop(position)
+                    message.materialize_content()
+                    renderable = cached_message_renderable(message, app)
+                    options = app.console.options.update(
+                        highlight=False, width=self._content_width(message)
+                    )
+                    key = renderable.cache_key(options)
+                    if key in cache:
+                        self._prerendered(message)
+                        continue
+                    future = loop.run_in_executor(
+                        app.render_pool,
+                        renderable.render_uncached,
+                        app.console,
+                        options,
+                    )
+                    running[future] = (position, message, key)
+                    self._rendering.add(position)
+
+                if running:
+                    done, _ = await asyncio.wait(
+                        running, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        position, message, key = running.pop(future)
+                        self._rendering.discard(position)
+                        # If rendering failed, the Chatbox will render the
+                        # message itself (and report the error) instead.
+                        if future.exception() is None:
+                            cache.set(key, future.result())
+                        self._prerendered(message)
+        finally:
+            self._prerendering = False
+            self._rendering.clear()
+
+    def _nearest_unrendered(self) -> int:
+        """Remove and return the position of the unrendered message nearest
+        the viewport."""
+        first, last = self._window_for(self.scroll_y)
+        # The window includes the overscan, which isn't in the viewport.
+        first = first + self.OVERSCAN - self._prepended_count
+        last = last - self.OVERSCAN - self._prepended_count
+        positions = self._unrendered_positions
+        after = bisect.bisect_left(positions, first)
+        if after == len(positions):
+            index = after - 1
+        elif after == 0 or positions[after] < last:
+            index = after
+        else:
+            below = positions[after] - last + 1
+            above = first - positions[after - 1]
+            index = after if below <= above else after - 1
+        return positions.pop(index)
+
+    def _prerendered(self, message: ChatMessage) -> None:
+        chatbox = self.get_chatbox(message)
+        if chatbox is not None:
+            chatbox.prerendered()
+
+    def _content_width(self, message: ChatMessage) -> int:
+        """The width of the content of a message's Chatbox."""
+        available = max(
+            self.CHATBOX_MIN_CONTENT_WIDTH,
+            self.scrollable_content_region.width - self.CHATBOX_GUTTER_WIDTH,
+        )
+        width = measure_message(message, available)
+        return max(self.CHATBOX_MIN_CONTENT_WIDTH, min(width, available))
+
+    def append_chunk(self, message: ChatMessage, chunk: str) -> None:
+        """Append a chunk of streamed content to a message in the transcript."""
+        chatbox = self.get_chatbox(message)
+        if chatbox is not None:
+            self._streamed_lines = None
+            chatbox.append_chunk(chunk)
+            return
+
+        message.append_content(chunk)
+        index = len(self.messages) - 1
+        if not self.messages or self.messages[index] is not message:
+            return
+        text_width = self._text_width()
+        streamed_lines = self._streamed_lines
+        if (
+            streamed_lines is None
+            or streamed_lines.message is not message
+            or streamed_lines.width != text_width
+        ):
+            # Count the lines received so far, then just those in each chunk.
+            message.materialize_content()
+            content = message.content if isinstance(message.content, str) else ""
+            streamed_lines = _StreamedLineCount(message, text_width)
+            streamed_lines.append(content)
+            self._streamed_lines = streamed_lines
+        else:
+            streamed_lines.append(chunk)
+        self._heights[index] = max(1, streamed_lines.lines) + self.CHATBOX_CHROME_HEIGHT
+        self._update_spacers()
+
+    def complete_response(self, message: ChatMessage) -> None:
+        """Mark a streamed response as complete."""
+        if self._in_progress is message:
+            self._in_progress = None
+        self._streamed_lines = None
+        chatbox = self.get_chatbox(message)
+        if chatbox is not None:
+            chatbox.complete_response()
+
+    async def focus_message(self, index: int) -> None:
+        """Mount (if required) and focus the message at the given index."""
+        if not self.messages:
+            return
+        index = max(0, min(index, len(self.messages) - 1))
+        if not (self._start <= index < self._end):
+            offsets = self._offsets()
+            bottom = self._total_height() - self._viewport_height()
+            top = min(offsets[index], bottom)
+            self._at_end = top >= bottom
+            # Scroll immediately, so that the window is positioned relative to
+            # the new scroll position.
+            self._jump_to(top)
+            await self._set_window(*self._window_for(top))
+        self._chatboxes[index - self._start].focus()
+        if index <= self.OVERSCAN:
+            self.post_message(self.NearTop())
+
+    @on(Chatbox.MoveFocus)
+    async def move_focus(self, event: Chatbox.MoveFocus) -> None:
+        event.stop()
+        try:
+            index = self._start + self._chatboxes.index(event.chatbox)
+        except ValueError:
+            return
+        target = index + event.direction
+        if target >= len(self.messages):
+            self.post_message(Chatbox.CursorEscapingBottom())
+        elif target >= 0:
+            await self.focus_message(target)
+
+    def watch_scroll_y(self, old_value: float, new_value: float) -> None:
+        super().watch_scroll_y(old_value, new_value)
+        self._schedule_update()
+        if self._jumping:
+            return
+        self._at_end = new_value >= self.max_scroll_y - 3
+        if new_value < old_value and new_value <= self._viewport_height():
+            self.post_message(self.NearTop())
+
+    def watch_virtual_size(self) -> None:
+        # Keep the end in view as content is added, if the user is at the end.
+        if self._at_end:
+            self._jump_to(self.max_scroll_y)
+
+    def on_resize(self) -> None:
+        # Wrapping changes with the width, so all heights must be re-estimated.
+        self._heights = [self._estimate_height(message) for message in self.messages]
+        self._schedule_update()
+
+    def _schedule_update(self) -> None:
+        if not self._update_scheduled:
+            self._update_scheduled = True
+            self.call_after_refresh(self._update_window)
+
+    def _update_window(self) -> None:
+        self._update_scheduled = False
+        # Until the scroll position accounts for prepended messages, it doesn't
+        # correspond to the window (the update is rescheduled once it does).
+        if self.messages and not self._prepend_pending:
+            self._measure_mounted()
+            self._set_window(*self._window_for(self.scroll_y))
+
+    def _window_for(self, scroll_y: float) -> tuple[int, int]:
+        """Return the range of messages to mount for a given scroll position."""
+        offsets = self._offsets()
+        message_count = len(self.messages)
+        top = max(0, scroll_y)
+        bottom = top + self._viewport_height()
+        first = max(0, min(bisect.bisect_right(offsets, top) - 1, message_count - 1))
+        last = max(first, min(bisect.bisect_left(offsets, bottom), message_count))
+        return max(0, first - self.OVERSCAN), min(message_count, last + self.OVERSCAN)
+
+    def _set_window(self, start: int, end: int) -> AwaitComplete:
+        """Mount and unmount Chatboxes so that exactly messages[start:end]
+        are mounted, and resize the spacers to account for the rest."""
+        if (start, end) == (self._start, self._end) and len(self._chatboxes) == (
+            end - start
+        ):
+            self._update_spacers()
+            return AwaitComplete()
+
+        anchor, anchor_delta, at_bottom = self._scroll_anchor(end)
+
+        old_start, old_end = self._start, self._end
+        overlaps = max(start, old_start) < min(end, old_end)
+        if overlaps:
+            keep_from, keep_to = max(start, old_start), min(end, old_end)
+        else:
+            keep_from = keep_to = start
+
+        removed = [
+            chatbox
+            for index, chatbox in enumerate(self._chatboxes, old_start)
+            if not keep_from <= index < keep_to
+        ]
+        kept = self._chatboxes[keep_from - old_start : keep_to - old_start]
+        above = [self._create_chatbox(index) for index in range(start, keep_from)]
+        below = [self._create_chatbox(index) for index in range(keep_to, end)]
+
+        self._start, self._end = start, end
+        self._chatboxes = above + kept + below
+        self._update_spacers()
+
+        awaitables: list[Awaitable[None]] = []
+        if removed:
+            awaitables.append(self.remove_children(removed))
+        if above:
+            awaitables.append(self.mount_all(above, after=self._top_spacer))
+        if below:
+            awaitables.append(self.mount_all(below, before=self._bottom_spacer))
+        self.call_after_refresh(
+            self._restore_scroll,
+            anchor,
+            anchor_delta,
+            at_bottom,
+            self._prepended_count,
+        )
+        return AwaitComplete(*awaitables)
+
+    def _scroll_anchor(self, end: int) -> tuple[int, float, bool]:
+        """Return the index of the message at the top of the viewport, how far
+        into that message the viewport is scrolled, and whether the viewport is
+        scrolled to (and following) the bottom."""
+        offsets = self._offsets()
+        at_bottom = self._at_end
+        anchor = max(0, min(bisect.bisect_right(offsets, self.scroll_y) - 1, end - 1))
+        return anchor, self.scroll_y - offsets[anchor], at_bottom
+
+    def _restore_scroll(
+        self,
+        anchor: int,
+        anchor_delta: float,
+        at_bottom: bool,
+        prepended_count: int,
+    ) -> None:
+        """Once newly mounted messages have been measured, scroll so that the
+        content the user was looking at doesn't jump."""
+        # Messages may have been prepended since the anchor was captured.
+        anchor += self._prepended_count - prepended_count
+        self._measure_mounted()
+        if at_bottom:
+            self._jump_to(self.max_scroll_y)
+        elif anchor < len(self.messages):
+            offsets = self._offsets()
+            y = offsets[anchor] + anchor_delta
+            self._jump_to(y)
+
+    def _jump_to(self, y: float) -> None:
+        """Scroll immediately (`scroll_to` waits for a refresh) without
+        animating, and without treating the scroll as the user's."""
+        self._jumping = True
+        try:
+            self._scroll_to(y=y, animate=False, force=True)
+        finally:
+            self._jumping = False
+
+    def _create_chatbox(self, index: int) -> Chatbox:
+        message = self.messages[index]
+        in_progress = message is self._in_progress
+        chatbox = Chatbox(
+            message,
+            self.model,
+            classes="response-in-progress" if in_progress else None,
+        )
+        position = index - self._prepended_count
+        chatbox.awaiting_prerender = (
+            position in self._unrendered or position in self._rendering
+        )
+        return chatbox
+
+    def _measure_mounted(self) -> None:
+        heights = self._heights
+        for index, chatbox in enumerate(self._chatboxes, self._start):
+            height = chatbox.outer_size.height
+            if height:
+                heights[index] = height
+        self._update_spacers()
+
+    def _update_spacers(self) -> None:
+        heights = self._heights
+        self._top_spacer.styles.height = sum(heights[: self._start])
+        self._bottom_spacer.styles.height = sum(heights[self._end :])
+
+    def _offsets(self) -> list[int]:
+        """The y offset of the top of each message, followed by the total height."""
+        return list(accumulate(self._heights, initial=0))
+
+    def _total_height(self) -> int:
+        return sum(self._heights)
+
+    def _viewport_height(self) -> int:
+        return self.scrollable_content_region.height or self.app.size.height
+
+    def _estimate_height(self, message: ChatMessage) -> int:
+        """Estimate the height of a message from the length of its lines."""
+        message.materialize_content()
+        content = message.content
+        if not isinstance(content, str):
+            content = ""
+        text_width = self._text_width()
+        lines = sum(
+            _wrapped_line_count(cell_len(line), text_width)
+            for line in content.splitlines()
+        )
+        return max(1, lines) + self.CHATBOX_CHROME_HEIGHT
+
+    def _text_width(self) -> int:
+        """The width the text of a message is wrapped to, for estimating."""
+        width = self.scrollable_content_region.width or self.app.size.width
+        return max(1, width - self.CHATBOX_CHROME_WIDTH)
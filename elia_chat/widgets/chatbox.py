@@ -1,11 +1,14 @@
 from __future__ import annotations
 import bisect
 from dataclasses import dataclass
+from functools import partial
+from typing import TYPE_CHECKING, cast
 
 from rich.cells import cell_len
 from rich.console import RenderableType
 from rich.markdown import Markdown
 from rich.syntax import Syntax
+from rich.text import Text
 from textual import on
 from textual.binding import Binding
 from textual.css.query import NoMatches
@@ -19,6 +22,11 @@ from textual.document._syntax_aware_document import SyntaxAwareDocumentError
 
 from elia_chat.config import EliaChatModel
 from elia_chat.models import ChatMessage
+from elia_chat.widgets.render_cache import CachedRenderable
+from elia_chat.widgets.streaming_markdown import StreamingMarkdown
+
+if TYPE_CHECKING:
+    from elia_chat.app import Elia
 
 
 class SelectionTextArea(TextArea):
@@ -237,6 +245,18 @@ class Chatbox(Widget, can_focus=True):
     class CursorEscapingBottom(Message):
         """Sent when the cursor moves down from the bottom message."""
 
+    @dataclass
+    class MoveFocus(Message):
+        """Sent when the user wants to move focus to an adjacent message.
+
+        Not every message has a mounted Chatbox, so the parent is responsible
+        for moving focus (and mounting the target Chatbox if required).
+        """
+
+        chatbox: Chatbox
+        direction: int
+        """-1 to move to the previous message, 1 to move to the next."""
+
     selection_mode = reactive(False, init=False)
 
     def __init__(
@@ -256,25 +276,39 @@ class Chatbox(Widget, can_focus=True):
         )
         self.message = message
         self.model = model
+        self._markdown: StreamingMarkdown | None = None
+        self.awaiting_prerender = False
+        """True if the output of the message is being rendered in the
+        background, in which case its plain text is shown until it's ready."""
 
     def on_mount(self) -> None:
-        litellm_message = self.message.message
-        role = litellm_message["role"]
-        if role == "assistant":
+        if self.message.role == "assistant":
             self.add_class("assistant-message")
-            self.border_title = "Agent"
+            if self.has_class("response-in-progress"):
+                self.border_title = "Agent is responding..."
+            else:
+                self.border_title = self.agent_title
         else:
             self.add_class("human-message")
             self.border_title = "You"
 
+    @property
+    def agent_title(self) -> str:
+        """The border title of a complete response from the agent."""
+        if self.message.interrupted:
+            return "Agent (interrupted)"
+        return "Agent (stopped)" if self.message.truncated else "Agent"
+
+    def complete_response(self) -> None:
+        """Mark the response streaming into this Chatbox as complete."""
+        self.border_title = self.agent_title
+        self.remove_class("response-in-progress")
+
     def action_up(self) -> None:
-        self.screen.focus_previous(Chatbox)
+        self.post_message(self.MoveFocus(self, -1))
 
     def action_down(self) -> None:
-        if self.parent and self is self.parent.children[-1]:
-            self.post_message(self.CursorEscapingBottom())
-        else:
-            self.screen.focus_next(Chatbox)
+        self.post_message(self.MoveFocus(self, 1))
 
     def action_select(self) -> None:
         self.selection_mode = not self.selection_mode
@@ -282,7 +316,8 @@ class Chatbox(Widget, can_focus=True):
 
     def action_copy_to_clipboard(self) -> None:
         if not self.selection_mode:
-            text_to_copy = self.message.message.get("content")
+            self.message.materialize_content()
+            text_to_copy = self.message.content
             if isinstance(text_to_copy, str):
                 try:
                     import pyperclip
@@ -306,7 +341,8 @@ class Chatbox(Widget, can_focus=True):
         if value:
             async with self.batch():
                 self.border_subtitle = "SELECT"
-                content = self.message.message.get("content")
+                self.message.materialize_content()
+                content = self.message.content
                 text_area = SelectionTextArea(
                     content if isinstance(content, str) else "",
                     read_only=True,
@@ -347,13 +383,22 @@ class Chatbox(Widget, can_focus=True):
         )
 
     @property
-    def markdown(self) -> Markdown:
-        """Return the content as a Rich Markdown object."""
-        content = self.message.message.get("content")
-        if not isinstance(content, str):
-            content = ""
-
-        return Markdown(content, code_theme=self.app.launch_config.message_code_theme)
+    def markdown(self) -> StreamingMarkdown:
+        """Return the content as a renderable Markdown object.
+
+        The object is kept between renders, so that chunks appended while the
+        response is streaming in don't require the whole message to be rendered
+        again.
+        """
+        code_theme = self.app.launch_config.message_code_theme
+        markdown = self._markdown
+        if markdown is None or markdown.code_theme != code_theme:
+            self.message.materialize_content()
+            content = self.message.content
+            if not isinstance(content, str):
+                content = ""
+            markdown = self._markdown = StreamingMarkdown(content, code_theme)
+        return markdown
 
     def render(self) -> RenderableType:
         if self.selection_mode:
@@ -361,30 +406,91 @@ class Chatbox(Widget, can_focus=True):
             # so we do not need to render anything.
             return ""
 
-        message = self.message.message
-        theme = self.app.theme_object
-        if theme:
-            background_color = theme.background
-        else:
-            background_color = "#121212"
-
-        if message["role"] == "user":
-            content = message["content"] or ""
-            if isinstance(content, str):
-                return Syntax(
-                    content,
-                    lexer="markdown",
-                    word_wrap=True,
-                    background_color=background_color,
-                )
-            else:
-                return ""
-        return self.markdown
+        if self.has_class("response-in-progress"):
+            # The content is changing, so there's no point caching it.
+            return self.markdown
+
+        self.message.materialize_content()
+        return cached_message_renderable(
+            self.message,
+            cast("Elia", self.app),
+            placeholder=self.awaiting_prerender,
+        )
+
+    def get_content_width(self, container: Size, viewport: Size) -> int:
+        if self.selection_mode or self.has_class("response-in-progress"):
+            return super().get_content_width(container, viewport)
+        # Measure the content itself, as the cached output and placeholder
+        # don't measure the same as the renderable they stand in for.
+        return measure_message(self.message, container.width)
+
+    def prerendered(self) -> None:
+        """Called when the output of the message has been pre-rendered."""
+        if self.awaiting_prerender:
+            self.awaiting_prerender = False
+            self.refresh(layout=True)
 
     def append_chunk(self, chunk: str) -> None:
         """Append a chunk of text to the end of the message."""
-        content = self.message.message.get("content")
+        self.message.append_content(chunk)
+        if self._markdown is not None:
+            self._markdown.append(chunk)
+        self.refresh(layout=True)
+
+
+def cached_message_renderable(
+    message: ChatMessage, app: Elia, placeholder: bool = False
+) -> CachedRenderable:
+    """Return a renderable for a complete message, rendered through the app's
+    render cache.
+
+    Args:
+        message: The message to render.
+        app: The app, whose settings affect the output.
+        placeholder: If True, the plain text of the message is shown on a
+            cache miss, rather than rendering the message.
+    """
+    code_theme = app.launch_config.message_code_theme
+    theme = app.theme_object
+    background_color = (theme.background if theme else None) or "#121212"
+    content = message.content
+    if not isinstance(content, str):
+        content = None
+    # Everything which affects the output (besides the width, which the cache
+    # accounts for) must be part of the key.
+    key = (message.role, content, code_theme, background_color)
+    return CachedRenderable(
+        app.render_cache,
+        key,
+        partial(build_message_renderable, message, code_theme, background_color),
+        placeholder=Text(content or "") if placeholder else None,
+    )
+
+
+def build_message_renderable(
+    message: ChatMessage, code_theme: str, background_color: str
+) -> RenderableType:
+    """Build the (uncached) renderable for a complete message."""
+    content = message.content
+    if message.role == "user":
         if isinstance(content, str):
-            content += chunk
-            self.message.message["content"] = content
-            self.refresh(layout=True)
+            return Syntax(
+                content,
+                lexer="markdown",
+                word_wrap=True,
+                background_color=background_color,
+            )
+        else:
+            return ""
+    return Markdown(content if isinstance(content, str) else "", code_theme=code_theme)
+
+
+def measure_message(message: ChatMessage, available_width: int) -> int:
+    """Return the width of the content of a message's Chatbox, given the width
+    available to the content (user messages are only as wide as their text)."""
+    if message.role != "user":
+        return available_width
+    content = message.content
+    if not isinstance(content, str):
+        return 0
+    return max((cell_len(line) for line in content.splitlines()), default=0)
@@ -0,0 +1,133 @@
+"""A bounded cache of rendered message output.
+
+Messages rarely change once they're complete, but their Chatboxes are rendered
+again whenever they're repainted (on scroll, focus changes, resizes, etc.).
+Rendering Markdown and highlighting code is expensive, so the rendered output
+is cached, keyed by everything which affects it.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from rich.console import Console, ConsoleOptions, RenderableType, RenderResult
+from rich.segment import Segment
+
+
+class RenderCache:
+    """A least-recently-used cache of rendered segments, bounded by the total
+    number of segments it holds."""
+
+    def __init__(self, max_size: int) -> None:
+        """
+        Args:
+            max_size: The maximum total number of segments to hold.
+        """
+        self.max_size = max_size
+        self.size = 0
+        """The total number of segments currently held."""
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, list[Segment]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        # Unlike `get`, this doesn't count as a lookup or a use of the entry.
+        return key in self._entries
+
+    def __repr__(self) -> str:
+        return (
+            f"RenderCache(entries={len(self)}, size={self.size}, "
+            f"max_size={self.max_size}, hits={self.hits}, misses={self.misses})"
+        )
+
+    @property
+    def hit_rate(self) -> float:
+        """The proportion of lookups which were hits."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: Hashable) -> list[Segment] | None:
+        segments = self._entries.get(key)
+        if segments is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return segments
+
+    def set(self, key: Hashable, segments: list[Segment]) -> None:
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        # Output larger than the whole cache would only evict everything else.
+        if len(segments) > self.max_size:
+            return
+        self._entries[key] = segments
+        self.size += len(segments)
+        while self.size > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def clear(self) -> None:
+        """Remove every entry, e.g. when the output they hold is out of date."""
+        self._entries.clear()
+        self.size = 0
+
+
+class CachedRenderable:
+    """Renders a renderable through a RenderCache.
+
+    The renderable is only created (and rendered) if its output for the
+    current width isn't already in the cache.
+    """
+
+    def __init__(
+        self,
+        cache: RenderCache,
+        key: Hashable,
+        get_renderable: Callable[[], RenderableType],
+        placeholder: RenderableType | None = None,
+    ) -> None:
+        """
+        Args:
+            cache: The cache to use.
+            key: Identifies the output, independently of the width it's
+                rendered at. Must include everything which affects the output.
+            get_renderable: Returns the renderable to render on a cache miss.
+            placeholder: If given, this is rendered (and not cached) on a cache
+                miss instead, e.g. while the output is being pre-rendered.
+        """
+        self.cache = cache
+        self.key = key
+        self.get_renderable = get_renderable
+        self.placeholder = placeholder
+
+    def cache_key(self, options: ConsoleOptions) -> Hashable:
+        """The key of the output for the given options."""
+        return (self.key, options.max_width, options.justify)
+
+    def render_uncached(
+        self, console: Console, options: ConsoleOptions
+    ) -> list[Segment]:
+        """Render the output without using the cache.
+
+        This doesn't touch the cache, so may be called from another thread.
+        """
+        return list(console.render(self.get_renderable(), options))
+
+    def __rich_console__(
+        self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+        key = self.cache_key(options)
+        segments = self.cache.get(key)
+        if segments is None:
+            if self.placeholder is not None:
+                yield self.placeholder
+                return
+            segments = self.render_uncached(console, options)
+            self.cache.set(key, segments)
+        yield from segments
@@ -0,0 +1,64 @@
+"""Coalesces the chunks of a streaming response into at most one update per frame.
+
+Models can stream hundreds of chunks per second. Delivering each of them to the
+UI separately costs a layout refresh per chunk, so the UI can fall behind the
+model. Instead, the producer writes chunks into a
+`StreamBuffer`, and the UI collects everything written since the previous frame
+on a timer.
+"""
+
+from __future__ import annotations
+
+from typing import Callable
+
+from textual.dom import DOMNode
+from textual.timer import Timer
+
+
+class StreamBuffer:
+    """A buffer of streamed text, delivered to the UI at a limited frame rate.
+
+    The text written is delivered (in a single call to the `deliver` callback)
+    at most `fps` times per second. If the UI is too busy to keep up, missed
+    frames are skipped rather than queued, so all of the text written in the
+    meantime is delivered in the next frame.
+    """
+
+    def __init__(self, node: DOMNode, deliver: Callable[[str], None], fps: int) -> None:
+        """
+        Args:
+            node: The node whose timer delivers the text.
+            deliver: Called with the text written since the previous delivery.
+            fps: The maximum number of deliveries per second.
+        """
+        self._node = node
+        self._deliver = deliver
+        self._fps = fps
+        self._chunks: list[str] = []
+        self._timer: Timer | None = None
+
+    def start(self) -> None:
+        """Start delivering text."""
+        if self._timer is None:
+            self._timer = self._node.set_interval(
+                1 / self._fps, self.flush, name="stream-buffer"
+            )
+
+    def write(self, chunk: str) -> None:
+        """Add a chunk of text to the buffer."""
+        self._chunks.append(chunk)
+
+    def flush(self) -> None:
+        """Deliver any buffered text now."""
+        if not self._chunks:
+            return
+        text = "".join(self._chunks)
+        self._chunks.clear()
+        self._deliver(text)
+
+    def stop(self) -> None:
+        """Deliver any remaining text, and stop delivering text."""
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+        self.flush()
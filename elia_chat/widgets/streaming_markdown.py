@@ -0,0 +1,184 @@
+"""A Markdown renderable which can be extended cheaply while a response streams in.
+
+Rendering a `rich.markdown.Markdown` parses and renders the whole document, so
+re-rendering it after every streamed chunk costs time proportional to the
+length of the response so far. `StreamingMarkdown` splits the document into
+its top-level blocks (paragraphs, code fences, lists, tables, etc.). Blocks
+which can no longer be changed by appended text are parsed once and their
+rendered output is cached, so only the trailing block is re-rendered per chunk.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+
+from markdown_it import MarkdownIt
+from rich.console import Console, ConsoleOptions, RenderResult
+from rich.markdown import Markdown, UnknownElement
+from rich.segment import Segment
+
+_LINE_BREAK = re.compile(r"\r\n?|\n")
+
+# Blocks which leave `Markdown` in each state of its "insert a blank line
+# before the next element" flag.
+#
+# Whether `Markdown` puts a blank line before an element can depend on the
+# element before it. Rendering a block after the primer for the preceding block's
+# flag (then dropping the primer's output) renders it as it would be in context.
+_PRIMERS = {False: "***\n\n", True: "x\n\n"}
+
+
+def _markdown_parser() -> MarkdownIt:
+    # The same parser configuration used by `rich.markdown.Markdown`.
+    return MarkdownIt().enable("strikethrough").enable("table")
+
+
+def _render_block(
+    source: str,
+    after_new_line: bool,
+    code_theme: str,
+    console: Console,
+    options: ConsoleOptions,
+) -> list[Segment]:
+    """Render a block of Markdown as it would be rendered as part of a document.
+
+    Args:
+        source: The Markdown source of the block.
+        after_new_line: The `new_line` flag of the element preceding the block.
+        code_theme: The theme used to highlight code.
+        console: The console to render with.
+        options: The options to render with.
+    """
+    primer = _PRIMERS[after_new_line]
+    primer_length = len(list(console.render(Markdown(primer), options)))
+    markdown = Markdown(primer + source, code_theme=code_theme)
+    return list(console.render(markdown, options))[primer_length:]
+
+
+@dataclass
+class _StableBlock:
+    """A top-level block which appended text can no longer change."""
+
+    source: str
+    after_new_line: bool
+    """The `new_line` flag of the element preceding this block."""
+    new_line: bool
+    """The `new_line` flag of this block, which affects the next block."""
+    _rendered: dict[tuple[int, str | None], list[Segment]] = field(
+        default_factory=dict
+    )
+
+    def render(
+        self, console: Console, options: ConsoleOptions, code_theme: str
+    ) -> list[Segment]:
+        key = (options.max_width, options.justify)
+        segments = self._rendered.get(key)
+        if segments is None:
+            segments = self._rendered[key] = _render_block(
+                self.source, self.after_new_line, code_theme, console, options
+            )
+        return segments
+
+
+class StreamingMarkdown:
+    """A Markdown renderable which can have text appended to it.
+
+    The rendered output is the same as that of `rich.markdown.Markdown`.
+    """
+
+    def __init__(self, markup: str = "", code_theme: str = "monokai") -> None:
+        self.code_theme = code_theme
+        self._parser = _markdown_parser()
+        self._blocks: list[_StableBlock] = []
+        self._stable_markup: list[str] = []
+        """The markup preceding the tail, which has been split into blocks."""
+        self._tail = ""
+        """The trailing part of the document, which may still change."""
+        self._tail_is_empty = True
+        self._has_references = False
+        """Link reference definitions can affect blocks anywhere in the
+        document, so once one is seen, the document is rendered as a whole."""
+        self.append(markup)
+
+    @property
+    def markup(self) -> str:
+        """The Markdown source of the whole document."""
+        return "".join([*self._stable_markup, self._tail])
+
+    def append(self, text: str) -> None:
+        """Append text to the end of the document.
+
+        Only the tail of the document (the text after the last stable block)
+        is copied and parsed again, so appending is cheap however long the
+        document is.
+        """
+        if not text:
+            return
+        pending = self._tail + text
+        self._tail = pending
+        if self._has_references:
+            return
+
+        env: dict = {}
+        tokens = self._parser.parse(pending, env)
+        if env.get("references"):
+            self._has_references = True
+            return
+
+        top_level = [
+            token
+            for token in tokens
+            if token.level == 0 and token.nesting != -1 and token.map
+        ]
+        line_starts = [0, *(match.end() for match in _LINE_BREAK.finditer(pending))]
+        # The last line may be incomplete. Until the line which starts a block
+        # is complete, the block could still turn out to be part of the block
+        # before it (e.g. `***x` continues a paragraph, but `***` doesn't).
+        last_line = len(line_starts) - 1
+        stable_count = 0
+        for next_token in top_level[1:]:
+            assert next_token.map is not None
+            if next_token.map[0] >= last_line:
+                break
+            stable_count += 1
+
+        if stable_count:
+            for token in top_level[:stable_count]:
+                assert token.map is not None
+                start, end = token.map
+                element_class = Markdown.elements.get(token.type, UnknownElement)
+                self._blocks.append(
+                    _StableBlock(
+                        source=pending[line_starts[start] : line_starts[end]],
+                        after_new_line=self._new_line,
+                        new_line=element_class.new_line,
+                    )
+                )
+            next_start = top_level[stable_count].map
+            assert next_start is not None
+            tail_offset = line_starts[next_start[0]]
+            self._stable_markup.append(pending[:tail_offset])
+            pending = pending[tail_offset:]
+
+        self._tail = pending
+        self._tail_is_empty = not top_level
+
+    @property
+    def _new_line(self) -> bool:
+        """The `new_line` flag of the last stable block."""
+        return self._blocks[-1].new_line if self._blocks else False
+
+    def __rich_console__(
+        self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+        if self._has_references:
+            yield Markdown(self.markup, code_theme=self.code_theme)
+            return
+
+        for block in self._blocks:
+            yield from block.render(console, options, self.code_theme)
+        if not self._tail_is_empty:
+            yield from _render_block(
+                self._tail, self._new_line, self.code_theme, console, options
+            )
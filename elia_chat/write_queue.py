@@ -0,0 +1,175 @@
+"""Write-behind persistence of changes to the chat history.
+
+Committing a transaction waits for the disk, so awaiting each change as it's
+made (a message being sent, a chat being renamed, etc.) holds up the UI, and a
+burst of changes costs a sync each. Instead, changes are added to the app's
+WriteQueue and committed in the background, grouped into one transaction per
+interval.
+
+Responses from the agent can take minutes to stream in, so they're saved
+incrementally (see `ResponseCheckpoint`) rather than only once complete.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Callable
+
+from textual import log
+
+from elia_chat.chats_manager import (
+    AddMessage,
+    ChatsManager,
+    ChatWrite,
+    DeleteMessage,
+    UpdateMessage,
+)
+from elia_chat.models import ChatMessage
+
+
+class WriteQueue:
+    """Applies changes to the chat history in the background, in batches.
+
+    Changes are applied in the order they're queued. Call `flush` to wait
+    until everything queued so far has been committed.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        on_error: Callable[[ChatWrite, Exception], None],
+    ) -> None:
+        """
+        Args:
+            interval: The number of seconds to wait after a change is queued
+                before committing it, so that it can be grouped with others.
+            on_error: Called with each change which couldn't be committed,
+                and the exception raised.
+        """
+        self.interval = interval
+        self.on_error = on_error
+        self._pending: list[ChatWrite] = []
+        self._queued = asyncio.Event()
+        self._lock = asyncio.Lock()
+        """Held while a batch is being written, so batches are written in order."""
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        """Start committing queued changes. Must be called from a running loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="write-queue")
+
+    def put(self, write: ChatWrite) -> None:
+        """Queue a change to be committed in the background."""
+        self._pending.append(write)
+        self._queued.set()
+
+    async def flush(self) -> None:
+        """Commit everything which has been queued so far."""
+        await self._write_batch()
+
+    async def close(self) -> None:
+        """Stop committing in the background, then commit anything pending."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await self._queued.wait()
+            # Give any related changes a chance to join the batch.
+            await asyncio.sleep(self.interval)
+            await self._write_batch()
+
+    async def _write_batch(self) -> None:
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            self._queued.clear()
+            if not batch:
+                return
+            try:
+                await ChatsManager.apply_writes(batch)
+            except Exception as error:
+                if len(batch) == 1:
+                    self._report(batch[0], error)
+                    return
+                # Retry each change on its own, so that one failing change
+                # doesn't lose the others.
+                for write in batch:
+                    try:
+                        await ChatsManager.apply_writes([write])
+                    except Exception as write_error:
+                        self._report(write, write_error)
+            else:
+                log.debug(f"Committed {len(batch)} queued change(s)")
+
+    def _report(self, write: ChatWrite, error: Exception) -> None:
+        log.error(f"Failed to commit {write!r}: {error!r}")
+        self.on_error(write, error)
+
+
+class ResponseCheckpoint:
+    """Saves a response to the database as it streams in.
+
+    The response is saved when it starts, flagged as in progress. Each call
+    to `save` then appends the text received since the previous call, so only
+    the new text is sent to the database. Messages aren't indexed for search
+    while they're in progress, so the response is indexed once, by `finish`.
+    If Elia exits before the response completes, the text received up to the
+    last save is recovered the next time the chat is opened.
+    """
+
+    def __init__(self, queue: WriteQueue, chat_id: int, message: ChatMessage) -> None:
+        """
+        Args:
+            queue: The queue to save the response through.
+            chat_id: The ID of the chat the response belongs to.
+            message: The response, which is still streaming in.
+        """
+        self.queue = queue
+        self.chat_id = chat_id
+        self.message = message
+        self._saved_length = 0
+        """The length of the content which has been saved so far."""
+
+    def start(self) -> None:
+        """Save the response (and any content it has so far)."""
+        self.message.meta["in_progress"] = True
+        self.queue.put(AddMessage(self.chat_id, self.message))
+        self._saved_length = len(self._content())
+
+    def save(self) -> None:
+        """Save the content received since the previous save."""
+        appended = self._unsaved_content()
+        if appended:
+            self.queue.put(UpdateMessage(self.message, appended))
+
+    def finish(self) -> None:
+        """Save the rest of the response, and flag it as no longer in progress."""
+        self.message.meta.pop("in_progress", None)
+        self.queue.put(
+            UpdateMessage(
+                self.message, self._unsaved_content(), meta=dict(self.message.meta)
+            )
+        )
+
+    def discard(self) -> None:
+        """Delete the saved response."""
+        self.message.meta.pop("in_progress", None)
+        self.queue.put(DeleteMessage(self.chat_id, self.message))
+
+    def _content(self) -> str:
+        self.message.materialize_content()
+        content = self.message.content
+        return content if isinstance(content, str) else ""
+
+    def _unsaved_content(self) -> str:
+        content = self._content()
+        appended = content[self._saved_length :]
+        self._saved_length = len(content)
+        return appended
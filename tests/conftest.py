@@ -0,0 +1,24 @@
+import os
+import tempfile
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+# The location of the database is fixed when `elia_chat.database.database` is
+# imported, so Elia's directories are redirected before any test imports it.
+_elia_home = tempfile.mkdtemp(prefix="elia-tests-")
+os.environ["XDG_DATA_HOME"] = _elia_home
+os.environ["XDG_CONFIG_HOME"] = _elia_home
+
+from elia_chat.database import database  # noqa: E402
+
+from tests.utils import run  # noqa: E402
+
+
+@pytest.fixture
+def empty_database() -> Iterator[Path]:
+    """A new database, with the latest schema."""
+    database.sqlite_file_name.unlink(missing_ok=True)
+    run(database.create_database)
+    yield database.sqlite_file_name
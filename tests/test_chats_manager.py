@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Iterator
+
+import pytest
+from textual._context import active_app
+
+from elia_chat.chats_manager import ChatsManager
+from elia_chat.config import LaunchConfig
+from elia_chat.database import database
+from elia_chat.database.models import ChatDao, MessageDao
+from elia_chat.models import ChatSummary
+from tests.utils import run
+
+START = datetime(2024, 1, 1)
+
+
+@pytest.fixture(autouse=True)
+def launch_config() -> Iterator[None]:
+    """Let models be looked up (in the default config) without a running app."""
+    app = SimpleNamespace(launch_config=LaunchConfig())
+    token = active_app.set(app)  # type: ignore[arg-type]
+    yield
+    active_app.reset(token)
+
+
+async def create_chat(last_message_at: datetime | None, archived: bool = False) -> int:
+    """Create a chat, with a message sent at `last_message_at` unless it's None."""
+    async with database.get_session() as session:
+        chat = ChatDao(model="gpt-4o", title="", started_at=START, archived=archived)
+        session.add(chat)
+        await session.flush()
+        if last_message_at is not None:
+            message = MessageDao(
+                chat_id=chat.id,
+                role="user",
+                content="hi",
+                timestamp=last_message_at,
+                model="gpt-4o",
+            )
+            session.add(message)
+            chat.record_message(message)
+        await session.commit()
+        return chat.id
+
+
+async def list_in_pages(page_size: int) -> list[list[ChatSummary]]:
+    pages: list[list[ChatSummary]] = []
+    after = None
+    while True:
+        page = await ChatsManager.list_summaries(limit=page_size, after=after)
+        if not page:
+            return pages
+        pages.append(page)
+        after = page[-1]
+
+
+def test_pages_include_chats_active_at_the_same_time_once_each(
+    empty_database: Path,
+) -> None:
+    async def create_and_list() -> tuple[list[int], list[list[ChatSummary]]]:
+        # Most recently active first, then those active at the same time, by ID.
+        tied = [await create_chat(START) for _ in range(5)]
+        older = await create_chat(START - timedelta(hours=1))
+        newer = await create_chat(START + timedelta(hours=1))
+        return [newer, *reversed(tied), older], await list_in_pages(2)
+
+    expected, pages = run(create_and_list)
+
+    assert [len(page) for page in pages] == [2, 2, 2, 1]
+    assert [chat.id for page in pages for chat in page] == expected
+
+
+def test_chats_without_messages_are_not_listed(empty_database: Path) -> None:
+    async def create_and_list() -> tuple[list[int], list[ChatSummary], int]:
+        listed = [await create_chat(START), await create_chat(START)]
+        await create_chat(None)
+        summaries = await ChatsManager.list_summaries()
+        return listed, summaries, await ChatsManager.count_chats()
+
+    listed, summaries, count = run(create_and_list)
+
+    assert sorted(chat.id for chat in summaries) == listed
+    assert count == 2
+
+
+def test_archived_chats_are_not_listed(empty_database: Path) -> None:
+    async def create_and_list() -> tuple[list[int], list[list[ChatSummary]], int]:
+        listed: list[int] = []
+        for index in range(6):
+            archived = index % 2 == 1
+            chat_id = await create_chat(START + timedelta(minutes=index), archived)
+            if not archived:
+                listed.append(chat_id)
+        return listed, await list_in_pages(2), await ChatsManager.count_chats()
+
+    listed, pages, count = run(create_and_list)
+
+    assert [chat.id for page in pages for chat in page] == listed[::-1]
+    assert count == 3
@@ -0,0 +1,172 @@
+import io
+import json
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+
+from elia_chat.database import database, import_chatgpt
+from elia_chat.database.import_chatgpt import (
+    ImportBatch,
+    clear_checkpoint,
+    import_chatgpt_data,
+    iter_json_array,
+    normalize_conversation,
+    save_checkpoint,
+    write_batch,
+)
+from tests.utils import run
+
+
+@pytest.fixture
+def json_parser(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Use the parser built on `json`, even if ijson is installed."""
+    monkeypatch.setattr(import_chatgpt, "ijson", None)
+
+
+@pytest.mark.usefixtures("json_parser")
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 1024])
+@pytest.mark.parametrize(
+    "items",
+    [
+        [],
+        [123, 456],
+        [{"title": "a"}, {"title": "b", "mapping": {"x": [1, 2.5, None]}}],
+        ["naïve", "", True, False, None, -1.5e3],
+    ],
+)
+def test_items_are_parsed_whatever_the_chunk_size(
+    monkeypatch: pytest.MonkeyPatch, chunk_size: int, items: list
+) -> None:
+    monkeypatch.setattr(import_chatgpt, "READ_CHUNK_SIZE", chunk_size)
+    data = json.dumps(items, ensure_ascii=False).encode()
+    assert list(iter_json_array(io.BytesIO(data))) == items
+
+
+@pytest.mark.usefixtures("json_parser")
+@pytest.mark.parametrize("data", [b'{"title": "a"}', b"[1, 2", b"[1 2]", b"[1,"])
+def test_invalid_arrays_are_rejected(data: bytes) -> None:
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.BytesIO(data)))
+
+
+def conversation(index: int, message_count: int) -> dict[str, Any]:
+    """A conversation in the format of a ChatGPT export."""
+    mapping: dict[str, Any] = {
+        "root": {"id": "root", "message": None, "parent": None, "children": []}
+    }
+    for message_index in range(message_count):
+        node_id = f"conversation-{index}-message-{message_index}"
+        mapping[node_id] = {
+            "id": node_id,
+            "parent": "root",
+            "children": [],
+            "message": {
+                "id": node_id,
+                "author": {"role": "assistant" if message_index % 2 else "user"},
+                "create_time": 1_700_000_000 + index * 100 + message_index,
+                "content": {"content_type": "text", "parts": [f"Message {node_id}"]},
+                "metadata": {},
+            },
+        }
+    return {
+        "id": f"conversation-{index}",
+        "title": f"Conversation {index}",
+        "create_time": 1_700_000_000 + index * 100,
+        "update_time": 1_700_000_000 + index * 100 + message_count,
+        "mapping": mapping,
+    }
+
+
+def write_export(path: Path, conversations: list[dict[str, Any]]) -> Path:
+    path.write_text(json.dumps(conversations))
+    return path
+
+
+@pytest.fixture(autouse=True)
+def no_checkpoint() -> Iterator[None]:
+    """Don't leave a checkpoint for the next test to resume from."""
+    clear_checkpoint()
+    yield
+    clear_checkpoint()
+
+
+def import_export(export: Path) -> None:
+    run(lambda: import_chatgpt_data(export))
+
+
+def imported(database_file: Path) -> tuple[list[str], list[str]]:
+    """The source IDs of the chats and messages in the database."""
+    with closing(sqlite3.connect(database_file)) as connection:
+        chats = connection.execute(
+            "SELECT json_extract(meta, '$.source_id') FROM chat ORDER BY id"
+        )
+        messages = connection.execute(
+            "SELECT json_extract(meta, '$.source_id') FROM message ORDER BY id"
+        )
+        return [row[0] for row in chats], [row[0] for row in messages]
+
+
+def test_importing_an_export_again_adds_nothing(
+    empty_database: Path, tmp_path: Path
+) -> None:
+    export = write_export(
+        tmp_path / "conversations.json", [conversation(index, 4) for index in range(3)]
+    )
+
+    import_export(export)
+    chats, messages = imported(empty_database)
+    import_export(export)
+
+    assert len(chats) == 3
+    assert len(messages) == 12
+    assert imported(empty_database) == (chats, messages)
+
+
+def test_importing_a_newer_export_adds_only_what_is_new(
+    empty_database: Path, tmp_path: Path
+) -> None:
+    import_export(
+        write_export(
+            tmp_path / "old.json", [conversation(index, 4) for index in range(2)]
+        )
+    )
+    import_export(
+        write_export(
+            tmp_path / "new.json",
+            [conversation(0, 4), conversation(1, 6), conversation(2, 2)],
+        )
+    )
+
+    chats, messages = imported(empty_database)
+    assert sorted(chats) == [f"conversation-{index}" for index in range(3)]
+    assert len(messages) == len(set(messages)) == 12
+
+
+def test_resuming_an_interrupted_import_adds_no_duplicates(
+    empty_database: Path, tmp_path: Path
+) -> None:
+    conversations = [conversation(index, 4) for index in range(5)]
+    export = write_export(tmp_path / "conversations.json", conversations)
+
+    # The first batch of an import (of the first two conversations) was written
+    # before it was interrupted.
+    async def write_first_batch() -> None:
+        batch = ImportBatch()
+        for chat_data in conversations[:2]:
+            chat, messages = normalize_conversation(chat_data)
+            batch.chats.append(chat)
+            batch.messages.append(messages)
+        async with database.get_session() as session:
+            await write_batch(session, batch)
+        save_checkpoint(export, 2, "conversation-1")
+
+    run(write_first_batch)
+    import_export(export)
+
+    chats, messages = imported(empty_database)
+    assert chats == [f"conversation-{index}" for index in range(5)]
+    assert len(messages) == len(set(messages)) == 20
+    assert not import_chatgpt._checkpoint_file().exists()
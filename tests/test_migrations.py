@@ -0,0 +1,152 @@
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from elia_chat.database.migrations import SCHEMA_VERSION, migrate
+from tests.utils import run
+
+# The schema of databases created before migrations were introduced.
+BASELINE_SCHEMA = """
+CREATE TABLE system_prompt (
+    id INTEGER NOT NULL,
+    title VARCHAR NOT NULL,
+    prompt VARCHAR NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id)
+);
+CREATE TABLE chat (
+    id INTEGER NOT NULL,
+    model VARCHAR NOT NULL,
+    title VARCHAR,
+    started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    archived BOOLEAN NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE TABLE message (
+    id INTEGER NOT NULL,
+    chat_id INTEGER,
+    role VARCHAR NOT NULL,
+    content VARCHAR NOT NULL,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    meta JSON,
+    parent_id INTEGER,
+    model VARCHAR,
+    PRIMARY KEY (id),
+    FOREIGN KEY(chat_id) REFERENCES chat (id),
+    FOREIGN KEY(parent_id) REFERENCES message (id)
+);
+INSERT INTO chat (id, model, title, archived) VALUES (1, 'gpt-4o', 'Penguins', 0);
+INSERT INTO message (chat_id, role, content, timestamp, meta) VALUES
+    (1, 'system', 'You are a helpful assistant.', '2024-01-01 10:00:00', '{}'),
+    (1, 'user', 'Tell me about penguins', '2024-01-01 10:01:00', '{}'),
+    (1, 'assistant', 'Penguins are flightless birds', '2024-01-01 10:02:00', '{}'),
+    (1, 'assistant', 'Walruses are', '2024-01-01 10:03:00', '{"in_progress": true}');
+"""
+
+
+@pytest.fixture
+def baseline_database(tmp_path: Path) -> Path:
+    """A database with the schema (and some chats) of an old version of Elia."""
+    database_file = tmp_path / "elia.sqlite"
+    with closing(sqlite3.connect(database_file)) as connection:
+        connection.executescript(BASELINE_SCHEMA)
+    return database_file
+
+
+def migrate_database(database_file: Path) -> list[int]:
+    async def migrate_and_close_connections() -> list[int]:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{database_file}")
+        try:
+            return await migrate(engine)
+        finally:
+            await engine.dispose()
+
+    return run(migrate_and_close_connections)
+
+
+def query(database_file: Path, sql: str) -> list[tuple]:
+    with closing(sqlite3.connect(database_file)) as connection:
+        return connection.execute(sql).fetchall()
+
+
+def schema_names(database_file: Path, kind: str) -> set[str]:
+    rows = query(database_file, f"SELECT name FROM sqlite_master WHERE type = '{kind}'")
+    return {row[0] for row in rows}
+
+
+def test_baseline_database_is_migrated_to_the_latest_version(
+    baseline_database: Path,
+) -> None:
+    applied = migrate_database(baseline_database)
+
+    assert applied == list(range(1, SCHEMA_VERSION + 1))
+    assert query(baseline_database, "PRAGMA user_version") == [(SCHEMA_VERSION,)]
+    assert query(
+        baseline_database,
+        "SELECT last_message_at, message_count, preview, meta FROM chat",
+    ) == [("2024-01-01 10:03:00", 4, "Tell me about penguins", None)]
+    assert {"message_fts", "chat_fts"} <= schema_names(baseline_database, "table")
+    assert schema_names(baseline_database, "trigger") == {
+        "message_fts_insert",
+        "message_fts_delete",
+        "message_fts_update",
+        "chat_fts_insert",
+        "chat_fts_delete",
+        "chat_fts_update",
+    }
+    assert {
+        "ix_chat_archived_last_message_at",
+        "ix_chat_source_id",
+        "ix_message_chat_id",
+        "ix_message_parent_id",
+        "ix_message_timestamp",
+    } <= schema_names(baseline_database, "index")
+
+
+def test_existing_chats_are_indexed_for_search(baseline_database: Path) -> None:
+    migrate_database(baseline_database)
+
+    # Responses which are still streaming in aren't indexed.
+    assert query(
+        baseline_database,
+        "SELECT rowid FROM message_fts WHERE message_fts MATCH 'penguins OR walruses'"
+        " ORDER BY rowid",
+    ) == [(2,), (3,)]
+    assert query(
+        baseline_database, "SELECT rowid FROM chat_fts WHERE chat_fts MATCH 'penguins'"
+    ) == [(1,)]
+
+
+def test_messages_are_indexed_once_complete(baseline_database: Path) -> None:
+    migrate_database(baseline_database)
+
+    with closing(sqlite3.connect(baseline_database)) as connection:
+        connection.execute(
+            "UPDATE message SET content = content || ' large', meta = '{}'"
+            " WHERE id = 4"
+        )
+        connection.commit()
+
+    assert query(
+        baseline_database,
+        "SELECT rowid FROM message_fts WHERE message_fts MATCH 'walruses'",
+    ) == [(4,)]
+
+
+def test_migrating_again_applies_nothing(baseline_database: Path) -> None:
+    migrate_database(baseline_database)
+    schema = query(baseline_database, "SELECT * FROM sqlite_master ORDER BY name")
+
+    assert migrate_database(baseline_database) == []
+    assert query(baseline_database, "PRAGMA user_version") == [(SCHEMA_VERSION,)]
+    assert query(baseline_database, "SELECT * FROM sqlite_master ORDER BY name") == (
+        schema
+    )
+
+
+def test_new_database_is_created_at_the_latest_version(empty_database: Path) -> None:
+    assert query(empty_database, "PRAGMA user_version") == [(SCHEMA_VERSION,)]
+    assert migrate_database(empty_database) == []
@@ -0,0 +1,102 @@
+import io
+
+from rich.console import Console
+from rich.segment import Segment
+from rich.text import Text
+
+from elia_chat.widgets.render_cache import CachedRenderable, RenderCache
+
+
+def segments(count: int) -> list[Segment]:
+    return [Segment("x") for _ in range(count)]
+
+
+def test_get_counts_hits_and_misses() -> None:
+    cache = RenderCache(max_size=10)
+    cached = segments(2)
+    cache.set("a", cached)
+
+    assert cache.get("a") is cached
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.hit_rate == 0.5
+
+
+def test_least_recently_used_entry_is_evicted() -> None:
+    cache = RenderCache(max_size=6)
+    cache.set("a", segments(2))
+    cache.set("b", segments(2))
+    cache.set("c", segments(2))
+    cache.get("a")
+
+    cache.set("d", segments(2))
+
+    assert "b" not in cache
+    assert all(key in cache for key in ("a", "c", "d"))
+    assert cache.size == 6
+
+
+def test_entries_are_evicted_until_new_entry_fits() -> None:
+    cache = RenderCache(max_size=6)
+    cache.set("a", segments(2))
+    cache.set("b", segments(2))
+    cache.set("c", segments(2))
+
+    cache.set("d", segments(5))
+
+    assert len(cache) == 1
+    assert "d" in cache
+    assert cache.size == 5
+
+
+def test_replacing_an_entry_updates_the_size() -> None:
+    cache = RenderCache(max_size=10)
+    cache.set("a", segments(4))
+    cache.set("a", segments(1))
+
+    assert cache.size == 1
+    assert len(cache) == 1
+
+
+def test_output_larger_than_the_cache_is_not_cached() -> None:
+    cache = RenderCache(max_size=3)
+    cache.set("a", segments(2))
+
+    cache.set("b", segments(4))
+
+    assert "b" not in cache
+    assert "a" in cache
+    assert cache.size == 2
+
+
+def test_cached_renderable_only_renders_on_a_miss() -> None:
+    cache = RenderCache(max_size=1000)
+    calls = 0
+
+    def get_renderable() -> Text:
+        nonlocal calls
+        calls += 1
+        return Text("hello world")
+
+    renderable = CachedRenderable(cache, "message", get_renderable)
+    console = Console(file=io.StringIO(), width=40)
+    first = list(console.render(renderable, console.options))
+    second = list(console.render(renderable, console.options))
+    narrow = console.options.update_width(5)
+    list(console.render(renderable, narrow))
+
+    assert first == second
+    assert calls == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_clear_removes_every_entry() -> None:
+    cache = RenderCache(max_size=10)
+    cache.set("a", segments(2))
+    cache.set("b", segments(3))
+
+    cache.clear()
+
+    assert len(cache) == 0
+    assert cache.size == 0
+    assert cache.get("a") is None
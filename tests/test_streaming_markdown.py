@@ -0,0 +1,90 @@
+import io
+
+import pytest
+from rich.console import Console, RenderableType
+from rich.markdown import Markdown
+
+from elia_chat.widgets.streaming_markdown import StreamingMarkdown
+
+DOCUMENTS = [
+    """\
+# Title
+
+Some *para* text
+continued here.
+
+- item one
+- item two
+
+  nested para
+
+1. one
+2. two
+
+```python
+def f():
+    return 1
+```
+
+> quote
+lazy
+
+| a | b |
+|---|---|
+| 1 | 2 |
+
+para
+***
+after hr
+setext
+---
+
+    indented code
+
+Final `code` and [link](http://example.com).
+""",
+    "text with [ref][r]\n\n[r]: http://example.com\n\nmore\n",
+    "```\nunclosed fence\nstill\n",
+    "a\n\n\n\nb\r\nc\r\n\r\nd\n",
+    "````\n```\ninner\n````\ntext\n",
+    "- a\n\n- b\n\nc\n\n* d\n+ e\n",
+]
+
+
+def render(renderable: RenderableType, width: int) -> list[tuple[str, str]]:
+    console = Console(
+        file=io.StringIO(), width=width, color_system="truecolor", force_terminal=True
+    )
+    return [
+        (segment.text, str(segment.style))
+        for segment in console.render(renderable, console.options)
+    ]
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+@pytest.mark.parametrize("chunk_size", [1, 3, 7])
+@pytest.mark.parametrize("width", [40, 80])
+def test_streamed_render_matches_markdown(
+    document: str, chunk_size: int, width: int
+) -> None:
+    markdown = StreamingMarkdown()
+    for start in range(0, len(document), chunk_size):
+        markdown.append(document[start : start + chunk_size])
+        received = document[: start + chunk_size]
+        assert render(markdown, width) == render(Markdown(received), width)
+    assert markdown.markup == document
+
+
+def test_stable_blocks_are_not_rendered_again() -> None:
+    markdown = StreamingMarkdown("first paragraph\n\nsecond paragraph\n\nthi")
+    render(markdown, 80)
+    rendered = [block._rendered[(80, None)] for block in markdown._blocks]
+    assert rendered
+
+    markdown.append("rd paragraph\n\nfourth")
+    render(markdown, 80)
+    assert len(markdown._blocks) > len(rendered)
+    assert all(
+        block._rendered[(80, None)] is segments
+        for block, segments in zip(markdown._blocks, rendered)
+    )
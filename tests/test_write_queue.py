@@ -0,0 +1,103 @@
+import sqlite3
+from contextlib import closing
+from datetime import UTC, datetime
+from pathlib import Path
+
+import pytest
+
+from elia_chat.chats_manager import (
+    AddMessage,
+    ChatsManager,
+    ChatWrite,
+    DeleteMessage,
+    UpdateMessage,
+)
+from elia_chat.config import EliaChatModel
+from elia_chat.database import database
+from elia_chat.database.models import ChatDao
+from elia_chat.models import ChatMessage
+from elia_chat.write_queue import WriteQueue
+from tests.utils import run
+
+MODEL = EliaChatModel(name="test-model")
+
+
+def message(content: str) -> ChatMessage:
+    return ChatMessage({"role": "user", "content": content}, datetime.now(UTC), MODEL)
+
+
+async def create_chat() -> int:
+    async with database.get_session() as session:
+        chat = ChatDao(model=MODEL.lookup_key, title="", started_at=datetime.now(UTC))
+        session.add(chat)
+        await session.commit()
+        return chat.id
+
+
+def saved_messages(database_file: Path) -> list[tuple[int, str]]:
+    with closing(sqlite3.connect(database_file)) as connection:
+        rows = connection.execute("SELECT id, content FROM message ORDER BY id")
+        return list(rows)
+
+
+def test_writes_in_a_batch_can_refer_to_a_message_added_earlier_in_it(
+    empty_database: Path,
+) -> None:
+    new = message("new")
+    errors: list[ChatWrite] = []
+
+    async def write() -> None:
+        chat_id = await create_chat()
+        queue = WriteQueue(interval=0, on_error=lambda write, _: errors.append(write))
+        queue.put(AddMessage(chat_id, new))
+        queue.put(UpdateMessage(new, " message"))
+        await queue.flush()
+
+    run(write)
+
+    assert errors == []
+    assert new.id is not None
+    assert saved_messages(empty_database) == [(new.id, "new message")]
+
+
+def test_a_failing_write_does_not_lose_the_rest_of_its_batch(
+    empty_database: Path,
+) -> None:
+    saved = message("saved")
+    new = message("new")
+    errors: list[ChatWrite] = []
+
+    async def write() -> AddMessage:
+        chat_id = await create_chat()
+        await ChatsManager.add_message_to_chat(chat_id, saved)
+        queue = WriteQueue(interval=0, on_error=lambda write, _: errors.append(write))
+        failing = AddMessage(chat_id + 1, message("lost"))
+        queue.put(DeleteMessage(chat_id, saved))
+        queue.put(AddMessage(chat_id, new))
+        queue.put(UpdateMessage(new, " message"))
+        queue.put(failing)
+        await queue.flush()
+        return failing
+
+    failing = run(write)
+
+    assert errors == [failing]
+    assert saved.id is None
+    assert new.id is not None
+    assert saved_messages(empty_database) == [(new.id, "new message")]
+
+
+def test_ids_are_not_assigned_if_the_transaction_fails(empty_database: Path) -> None:
+    new = message("new")
+
+    async def write() -> None:
+        chat_id = await create_chat()
+        with pytest.raises(RuntimeError):
+            await ChatsManager.apply_writes(
+                [AddMessage(chat_id, new), AddMessage(chat_id + 1, message("lost"))]
+            )
+
+    run(write)
+
+    assert new.id is None
+    assert saved_messages(empty_database) == []
@@ -0,0 +1,19 @@
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
+from elia_chat.database import database
+
+T = TypeVar("T")
+
+
+def run(function: Callable[[], Awaitable[T]]) -> T:
+    """Run a coroutine function, in an event loop of its own."""
+
+    async def run_and_close_connections() -> T:
+        try:
+            return await function()
+        finally:
+            # The connections belong to the event loop they were opened on.
+            await database.engine.dispose()
+
+    return asyncio.run(run_and_close_connections())